@@ -0,0 +1,368 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''Throughput benchmarks for parsing, decoding and encoding HID data.
+
+The benchmarks do not need uhid or root, they use the report descriptors
+found in the sources of ``tests/`` and ``hidtools/device/`` and reports
+generated from them::
+
+    $ ./benchmarks/hid_benchmark.py
+    $ ./benchmarks/hid_benchmark.py --events 100000 --json results.json
+    $ ./benchmarks/hid_benchmark.py --list
+
+Each benchmark runs ``--repeat`` times and the best and median times are
+reported, together with the number of operations per second of the best
+run.
+'''
+
+import argparse
+import ast
+import io
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# FIXME: this is really wrong :)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + '/..')  # noqa
+
+import hidtools.hid  # noqa
+import hidtools.hut  # noqa
+from hidtools.cli.parse_hid import parse_hid  # noqa
+
+TOP_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+SOURCE_DIRS = [os.path.join(TOP_DIR, 'tests'), os.path.join(TOP_DIR, 'hidtools', 'device')]
+
+_hex_bytes = re.compile(r'^\s*([0-9a-fA-F]{2}\s+){7,}[0-9a-fA-F]{2}\s*$')
+
+
+def find_descriptors(dirs=SOURCE_DIRS):
+    '''
+    Find the report descriptors in the python sources of ``dirs`` without
+    importing them: lists of bytes, strings of hex bytes and
+    human-readable descriptors (without f-string substitutions). The
+    byte descriptors are also converted into human-readable ones, most
+    human-readable descriptors in the sources are f-strings.
+
+    :returns: a tuple of the list of byte descriptors (lists of ints)
+        and the list of human-readable descriptors (strings)
+    '''
+    binary = {}
+    human = {}
+    for d in dirs:
+        for filename in sorted(os.listdir(d)):
+            if not filename.endswith('.py'):
+                continue
+            with open(os.path.join(d, filename)) as f:
+                tree = ast.parse(f.read(), filename)
+            for node in ast.walk(tree):
+                if isinstance(node, ast.List):
+                    values = [getattr(e, 'value', None) for e in node.elts]
+                    if (len(values) >= 8 and
+                       all(isinstance(v, int) and 0 <= v <= 255 for v in values)):
+                        binary.setdefault(bytes(values), None)
+                elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                    s = node.value
+                    if _hex_bytes.match(s):
+                        binary.setdefault(bytes(int(b, 16) for b in s.split()), None)
+                    elif 'Collection (' in s and 'End Collection' in s:
+                        human.setdefault(s, None)
+
+    def parses(parser, rdesc):
+        try:
+            return bool(parser(rdesc).input_reports)
+        except Exception:
+            return False
+
+    binary = [list(b) for b in binary if parses(hidtools.hid.ReportDescriptor.from_bytes, list(b))]
+    for b in binary:
+        rdesc = hidtools.hid.ReportDescriptor.from_bytes(b)
+        human.setdefault(''.join(f' {item.get_human_descr(0)[0]}\n' for item in rdesc.rdesc_items), None)
+    human = [h for h in human if parses(hidtools.hid.ReportDescriptor.from_human_descr, h)]
+    return binary, human
+
+
+def random_reports(rdesc, n, rng):
+    '''Return ``n`` random reports of the input reports of ``rdesc``.'''
+    reports = list(rdesc.input_reports.values())
+    data = []
+    for _ in range(n):
+        report = rng.choice(reports)
+        r = [rng.randrange(256) for _ in range(report.size)]
+        if report.numbered:
+            r[0] = report.report_ID
+        data.append((report, r))
+    return data
+
+
+def generate_recording(descriptors, events, rng):
+    '''
+    Generate a recording in the ``hid-recorder`` format with one device
+    per descriptor and ``events`` random events in total.
+    '''
+    f = io.StringIO()
+    per_device = max(1, events // len(descriptors))
+    usec = 0
+    for index, rdesc in enumerate(descriptors):
+        rd = ' '.join(f'{b:02x}' for b in rdesc.bytes)
+        f.write(f'D: {index}\n')
+        f.write(f'R: {len(rdesc.bytes)} {rd}\n')
+        f.write(f'N: benchmark device {index}\n')
+        f.write('I: 3 0001 0001\n')
+        for _, r in random_reports(rdesc, per_device, rng):
+            usec += 1000
+            data = ' '.join(f'{b:02x}' for b in r)
+            f.write(f'E: {usec // 1000000:06d}.{usec % 1000000:06d} {len(r)} {data}\n')
+    return f.getvalue()
+
+
+class Data(object):
+    pass
+
+
+class Benchmark(object):
+    '''
+    A benchmark: ``setup()`` prepares the input, ``run()`` is timed and
+    returns the number of operations it did.
+
+    .. attribute:: name
+
+        The name of the benchmark as shown in the results
+
+    .. attribute:: unit
+
+        What an operation is
+    '''
+    name = None
+    unit = 'ops'
+
+    def __init__(self, options):
+        self.options = options
+        self.rng = random.Random(options.seed)
+
+    def setup(self, binary, human):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+
+class FromBytes(Benchmark):
+    name = 'rdesc.from_bytes'
+    unit = 'descriptors'
+
+    def setup(self, binary, human):
+        self.descriptors = binary
+
+    def run(self):
+        for rdesc in self.descriptors:
+            hidtools.hid.ReportDescriptor.from_bytes(rdesc)
+        return len(self.descriptors)
+
+
+class FromHumanDescr(Benchmark):
+    name = 'rdesc.from_human_descr'
+    unit = 'descriptors'
+
+    def setup(self, binary, human):
+        self.descriptors = human
+
+    def run(self):
+        for rdesc in self.descriptors:
+            hidtools.hid.ReportDescriptor.from_human_descr(rdesc)
+        return len(self.descriptors)
+
+
+class _ReportBenchmark(Benchmark):
+    def setup(self, binary, human):
+        rdescs = [hidtools.hid.ReportDescriptor.from_bytes(b) for b in binary]
+        per_rdesc = max(1, self.options.reports // len(rdescs))
+        self.reports = []
+        for rdesc in rdescs:
+            self.reports.extend(random_reports(rdesc, per_rdesc, self.rng))
+
+
+class GetValues(_ReportBenchmark):
+    name = 'field.get_values'
+    unit = 'fields'
+
+    def run(self):
+        n = 0
+        for report, r in self.reports:
+            for field in report:
+                field.get_values(r)
+            n += len(report.fields)
+        return n
+
+
+class FormatReport(_ReportBenchmark):
+    name = 'report.format_report'
+    unit = 'reports'
+
+    def run(self):
+        for report, r in self.reports:
+            report.format_report(r)
+        return len(self.reports)
+
+
+class CreateReport(_ReportBenchmark):
+    name = 'report.create_report'
+    unit = 'reports'
+
+    def setup(self, binary, human):
+        super().setup(binary, human)
+        # fill every field of the first data object with a valid value
+        data = {}
+        for report, _ in self.reports:
+            if report not in data:
+                d = Data()
+                for index, attribute, field in report.data_layout():
+                    if index == 0:
+                        value = max(0, field.logical_min)
+                        setattr(d, attribute, [value] * field.count if field.count > 1 else value)
+                data[report] = d
+        self.data = data
+
+    def run(self):
+        data = self.data
+        for report, _ in self.reports:
+            report.create_report([data[report]], None)
+        return len(self.reports)
+
+
+class HutImport(Benchmark):
+    name = 'hut.import'
+    unit = 'tables'
+
+    def run(self):
+        hidtools.hut.HidUsageTable._from_hut_data()
+        return 1
+
+
+class ParseHid(Benchmark):
+    name = 'parse_hid'
+    unit = 'events'
+
+    def setup(self, binary, human):
+        rdescs = [hidtools.hid.ReportDescriptor.from_bytes(b) for b in binary]
+        self.recording = generate_recording(rdescs, self.options.events, self.rng)
+        self.events = self.recording.count('\nE: ')
+
+    def run(self):
+        parse_hid(io.StringIO(self.recording), io.StringIO())
+        return self.events
+
+
+BENCHMARKS = [FromBytes, FromHumanDescr, GetValues, FormatReport, CreateReport, HutImport, ParseHid]
+
+
+def git_revision():
+    '''The ``git describe`` of the source tree, or ``None``.'''
+    try:
+        r = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=TOP_DIR,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    except OSError:
+        return None
+    return r.stdout.strip() or None
+
+
+def run_benchmark(benchmark, repeat):
+    '''Run the benchmark ``repeat`` times and return its results as a dict.'''
+    times = []
+    ops = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = benchmark.run()
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    return {
+        'name': benchmark.name,
+        'unit': benchmark.unit,
+        'ops': ops,
+        'repeat': repeat,
+        'best': best,
+        'median': statistics.median(times),
+        'ops_per_sec': ops / best if best else 0.0,
+    }
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark parsing, decoding and encoding of HID data')
+    parser.add_argument('benchmarks', metavar='name', nargs='*',
+                        help='Only run the benchmarks whose name starts with one of these')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs of each benchmark (default: %(default)s)')
+    parser.add_argument('--reports', type=int, default=10000,
+                        help='Number of reports for the report benchmarks (default: %(default)s)')
+    parser.add_argument('--events', type=int, default=10000,
+                        help='Number of events in the generated recording (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated data (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE', type=str, default=None,
+                        help='Write the results as JSON to this file, - for stdout')
+    parser.add_argument('--list', action='store_true', default=False,
+                        help='List the benchmarks and exit')
+    options = parser.parse_args(args)
+
+    benchmarks = [b for b in BENCHMARKS
+                  if not options.benchmarks or any(b.name.startswith(n) for n in options.benchmarks)]
+    if options.list:
+        for b in benchmarks:
+            print(b.name)
+        return
+
+    binary, human = find_descriptors()
+
+    results = []
+    for cls in benchmarks:
+        benchmark = cls(options)
+        benchmark.setup(binary, human)
+        result = run_benchmark(benchmark, options.repeat)
+        results.append(result)
+        if options.json != '-':
+            print(f'{result["name"]:<24} {result["ops_per_sec"]:>14.1f} {result["unit"]}/s '
+                  f'(best {result["best"] * 1000:.2f}ms, median {result["median"] * 1000:.2f}ms, {result["ops"]} {result["unit"]})')
+
+    if options.json is not None:
+        output = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'descriptors': {'binary': len(binary), 'human': len(human)},
+            'options': {k: getattr(options, k) for k in ('repeat', 'reports', 'events', 'seed')},
+            'results': results,
+        }
+        if options.json == '-':
+            json.dump(output, sys.stdout, indent=2)
+            print()
+        else:
+            with open(options.json, 'w') as f:
+                json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
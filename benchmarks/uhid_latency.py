@@ -0,0 +1,405 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''End-to-end latency and throughput of the kernel HID stack.
+
+A UHID mouse sends reports carrying a sequence number in a vendor-defined
+field, the reports are read back from the device's hidraw node and the
+resulting events from its evdev node. This needs root and UHID::
+
+    $ sudo ./benchmarks/uhid_latency.py
+    $ sudo ./benchmarks/uhid_latency.py --count 10000 --json results.json
+
+Two measurements are done:
+
+- latency: one report at a time, waiting for it to come out of hidraw and
+  evdev before sending the next one. The evdev latency is measured both
+  to the kernel timestamp of the event and to the time we read it.
+- throughput: reports at a fixed rate for ``--duration`` seconds while a
+  thread reads them back, starting at ``--rate`` and doubling the rate
+  until reports are lost. The highest rate without loss is reported as
+  the maximum sustained rate.
+'''
+
+import argparse
+import fcntl
+import json
+import libevdev
+import os
+import platform
+import select
+import sys
+import threading
+import time
+
+# FIXME: this is really wrong :)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + '/..')  # noqa
+
+from hidtools.device.base_device import BaseDevice  # noqa
+from hidtools.device.playback import play_batches  # noqa
+from hidtools.hidraw import HidrawDevice  # noqa
+from hidtools.uhid import UHIDDevice  # noqa
+
+
+class LatencyMouse(BaseDevice):
+    '''
+    A relative mouse with a 16-bit vendor-defined sequence number in each
+    report. The kernel ignores the vendor-defined field, so every report
+    gives exactly one ``REL_X`` event and the sequence number is only
+    visible through hidraw.
+    '''
+    report_descriptor = '''
+     Usage Page (Generic Desktop)
+     Usage (Mouse)
+     Collection (Application)
+      Usage (Pointer)
+      Collection (Physical)
+       Usage Page (Button)
+       Usage Minimum (1)
+       Usage Maximum (3)
+       Logical Minimum (0)
+       Logical Maximum (1)
+       Report Count (3)
+       Report Size (1)
+       Input (Data,Var,Abs)
+       Report Count (1)
+       Report Size (5)
+       Input (Cnst,Var,Abs)
+       Usage Page (Generic Desktop)
+       Usage (X)
+       Usage (Y)
+       Logical Minimum (-127)
+       Logical Maximum (127)
+       Report Size (8)
+       Report Count (2)
+       Input (Data,Var,Rel)
+       Usage Page (0xff00)
+       Usage (0x01)
+       Logical Minimum (0)
+       Logical Maximum (255)
+       Report Size (8)
+       Report Count (2)
+       Input (Data,Var,Abs)
+      End Collection
+     End Collection
+    '''
+
+    def __init__(self, name='uhid latency mouse'):
+        super().__init__(name, 'Mouse', rdesc_str=self.report_descriptor)
+
+    def is_ready(self):
+        return super().is_ready() and self.hidraw_node is not None
+
+    @staticmethod
+    def report(seq):
+        '''The report for the sequence number ``seq``. The pointer goes
+        back and forth so it does not drift away.'''
+        dx = 1 if seq & 1 else 0xff
+        return [0, dx, 0, seq & 0xff, (seq >> 8) & 0xff]
+
+    @staticmethod
+    def seq(report):
+        '''The sequence number of a report read from hidraw.'''
+        return report[3] | (report[4] << 8)
+
+
+class Histogram(object):
+    '''
+    Latencies in seconds, summarized with percentiles and power-of-two
+    buckets in microseconds.
+    '''
+    def __init__(self):
+        self.values = []
+
+    def add(self, value):
+        self.values.append(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def percentile(self, p):
+        values = sorted(self.values)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def summary(self):
+        '''A dict of the count, min, mean, percentiles, max and buckets,
+        times in microseconds.'''
+        if not self.values:
+            return {'count': 0}
+
+        buckets = {}
+        for v in self.values:
+            us = max(0, v * 1e6)
+            bound = 1
+            while bound < us:
+                bound <<= 1
+            buckets[bound] = buckets.get(bound, 0) + 1
+
+        return {
+            'count': len(self.values),
+            'min': min(self.values) * 1e6,
+            'mean': sum(self.values) / len(self.values) * 1e6,
+            'p50': self.percentile(50) * 1e6,
+            'p90': self.percentile(90) * 1e6,
+            'p99': self.percentile(99) * 1e6,
+            'max': max(self.values) * 1e6,
+            'buckets': {f'<={b}us': buckets[b] for b in sorted(buckets)},
+        }
+
+
+class Harness(object):
+    '''
+    Measures the latency and throughput of a :class:`LatencyMouse`.
+
+    :param device: a :class:`LatencyMouse` that is ready
+    '''
+    def __init__(self, device):
+        self.device = device
+        self.evdev = device.evdev
+        self.hidraw_file = open(device.hidraw_node, 'rb')
+        fd = self.hidraw_file.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.hidraw = HidrawDevice(self.hidraw_file)
+        self.drain()
+
+    def close(self):
+        self.hidraw_file.close()
+
+    def _read_hidraw(self):
+        '''Return the sequence numbers of the reports read from hidraw.'''
+        # the fd is nonblocking, read_events() drains all pending reports
+        _, count = self.hidraw.read_events()
+        events = self.hidraw.events[len(self.hidraw.events) - count:]
+        self.hidraw.events = []
+        return [LatencyMouse.seq(e.bytes) for e in events]
+
+    def _read_evdev(self):
+        '''Return the kernel timestamps of the SYN_REPORTs read from
+        evdev and whether events were dropped.'''
+        stamps = []
+        dropped = False
+        try:
+            for e in self.evdev.events():
+                if e.matches(libevdev.EV_SYN.SYN_REPORT):
+                    stamps.append(e.sec + e.usec / 1e6)
+        except libevdev.EventsDroppedException:
+            dropped = True
+            for e in self.evdev.sync():
+                pass
+        return stamps, dropped
+
+    def drain(self):
+        self._read_hidraw()
+        self._read_evdev()
+
+    def latency(self, count, timeout=1.0):
+        '''
+        Send ``count`` reports one at a time.
+
+        :returns: a dict of the :class:`Histogram` summaries for
+            ``hidraw``, ``evdev`` (read times) and ``evdev_kernel``
+            (kernel timestamps), and the number of ``lost`` reports
+        '''
+        hidraw, evdev, kernel = Histogram(), Histogram(), Histogram()
+        lost = 0
+        poll = select.poll()
+        poll.register(self.hidraw_file.fileno(), select.POLLIN)
+        poll.register(self.evdev.fd.fileno(), select.POLLIN)
+
+        for seq in range(count):
+            report = LatencyMouse.report(seq)
+            seen_hidraw = seen_evdev = False
+            sent = time.time()
+            self.device.call_input_event(report)
+            deadline = sent + timeout
+            while not (seen_hidraw and seen_evdev):
+                remaining = deadline - time.time()
+                if remaining <= 0 or not poll.poll(remaining * 1000):
+                    lost += 1
+                    break
+                now = time.time()
+                if not seen_hidraw and (seq & 0xffff) in self._read_hidraw():
+                    hidraw.add(now - sent)
+                    seen_hidraw = True
+                if not seen_evdev:
+                    stamps, dropped = self._read_evdev()
+                    if stamps:
+                        evdev.add(now - sent)
+                        kernel.add(stamps[0] - sent)
+                        seen_evdev = True
+            self.drain()
+
+        return {
+            'count': count,
+            'lost': lost,
+            'hidraw': hidraw.summary(),
+            'evdev': evdev.summary(),
+            'evdev_kernel': kernel.summary(),
+        }
+
+    def throughput(self, rate, duration):
+        '''
+        Send reports at ``rate`` per second for ``duration`` seconds and
+        read them back in a thread.
+
+        :returns: a dict with the number of reports ``sent``, the number
+            received from ``hidraw`` and ``evdev``, whether evdev dropped
+            events, the effective ``rate`` and the :class:`Histogram`
+            summary of the hidraw ``latency``
+        '''
+        total = int(rate * duration)
+        sent_at = [None] * total
+        latency = Histogram()
+        received = {'hidraw': 0, 'evdev': 0, 'evdev_dropped': False}
+        stop = threading.Event()
+
+        def reader():
+            poll = select.poll()
+            poll.register(self.hidraw_file.fileno(), select.POLLIN)
+            poll.register(self.evdev.fd.fileno(), select.POLLIN)
+            base = 0
+            last = -1
+            while not stop.is_set():
+                if not poll.poll(100):
+                    continue
+                now = time.perf_counter()
+                for seq in self._read_hidraw():
+                    # undo the 16-bit wrap around of the sequence number
+                    if seq + base < last:
+                        base += 0x10000
+                    last = seq + base
+                    if last < total and sent_at[last] is not None:
+                        latency.add(now - sent_at[last])
+                    received['hidraw'] += 1
+                stamps, dropped = self._read_evdev()
+                received['evdev'] += len(stamps)
+                received['evdev_dropped'] |= dropped
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+
+        def stamp(first, last):
+            now = time.perf_counter()
+            for i in range(first, last):
+                sent_at[i] = now
+
+        batches = [[LatencyMouse.report(i)] for i in range(total)]
+        elapsed = play_batches(self.device, batches, rate, on_send=stamp).duration
+
+        # leave the reader some time to catch up
+        time.sleep(0.2)
+        stop.set()
+        thread.join()
+        self.drain()
+
+        return {
+            'requested_rate': rate,
+            'rate': total / elapsed if elapsed else 0.0,
+            'sent': total,
+            'hidraw': received['hidraw'],
+            'evdev': received['evdev'],
+            'evdev_dropped': received['evdev_dropped'],
+            'latency': latency.summary(),
+        }
+
+    def max_rate(self, rate, duration, limit):
+        '''
+        Double the rate from ``rate`` until reports are lost or ``limit``
+        is reached.
+
+        :returns: the highest rate without loss and the results of all
+            runs
+        '''
+        best = 0
+        runs = []
+        while rate <= limit:
+            r = self.throughput(rate, duration)
+            runs.append(r)
+            if r['hidraw'] < r['sent'] or r['evdev'] < r['sent'] or r['evdev_dropped']:
+                break
+            best = r['rate']
+            rate *= 2
+        return best, runs
+
+
+def _print_summary(name, s):
+    if not s['count']:
+        print(f'  {name:<14} no events')
+        return
+    print(f'  {name:<14} p50 {s["p50"]:8.1f}us  p90 {s["p90"]:8.1f}us  p99 {s["p99"]:8.1f}us  max {s["max"]:8.1f}us')
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Measure the latency and throughput of the kernel HID stack through UHID')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Number of reports for the latency measurement (default: %(default)s)')
+    parser.add_argument('--rate', type=int, default=500,
+                        help='Initial rate of the throughput measurement in reports per second (default: %(default)s)')
+    parser.add_argument('--max-rate', type=int, default=64000,
+                        help='Highest rate to try (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='Duration of each throughput run in seconds (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE', type=str, default=None,
+                        help='Write the results as JSON to this file, - for stdout')
+    options = parser.parse_args(args)
+
+    UHIDDevice.start_dispatcher()
+    try:
+        with LatencyMouse() as device:
+            device.create_kernel_device()
+            device.wait_ready(timeout=5)
+            harness = Harness(device)
+            try:
+                latency = harness.latency(options.count)
+                best, runs = harness.max_rate(options.rate, options.duration, options.max_rate)
+            finally:
+                harness.close()
+    finally:
+        UHIDDevice.stop_dispatcher()
+
+    if options.json != '-':
+        print(f'latency over {latency["count"]} reports, {latency["lost"]} lost:')
+        _print_summary('hidraw', latency['hidraw'])
+        _print_summary('evdev', latency['evdev'])
+        _print_summary('evdev (kernel)', latency['evdev_kernel'])
+        print('throughput:')
+        for r in runs:
+            print(f'  {r["requested_rate"]:>7}/s: sent {r["sent"]}, hidraw {r["hidraw"]}, evdev {r["evdev"]}'
+                  f'{" (dropped)" if r["evdev_dropped"] else ""}')
+        print(f'max sustained rate: {best:.0f} reports/s')
+
+    if options.json is not None:
+        output = {
+            'kernel': platform.release(),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'latency': latency,
+            'throughput': runs,
+            'max_sustained_rate': best,
+        }
+        if options.json == '-':
+            json.dump(output, sys.stdout, indent=2)
+            print()
+        else:
+            with open(options.json, 'w') as f:
+                json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,7 @@ import re
 import sys
 import hidtools.hid
 import hidtools.hidraw
+from hidtools.recording import UnsupportedCompression, compression_from_data, open_recording
 import logging
 import yaml
 logging.basicConfig(format='%(levelname)s: %(name)s: %(message)s',
@@ -74,6 +75,21 @@ def open_binary(path):
     return None
 
 
+def open_compressed(path):
+    with open(path, 'rb') as fd:
+        if compression_from_data(fd.read(8)) is None:
+            return None
+
+    logger.debug(f'{path} is a compressed file')
+    with open_recording(path) as fd:
+        lines = fd.readlines()
+
+    rdesc = interpret_file_hidrecorder(lines)
+    if rdesc is None:
+        rdesc = interpret_file_libinput_record(''.join(lines))
+    return rdesc
+
+
 def interpret_file_hidrecorder(lines):
     r_lines = [l for l in lines if l.startswith('R: ')]
     if not r_lines:
@@ -117,6 +133,9 @@ def open_report_descriptor(path):
         return open_devnode_rdesc(path)
     if re.match('/dev/hidraw[0-9]+', abspath):
         return open_hidraw(path)
+    rdesc = open_compressed(path)
+    if rdesc is not None:
+        return rdesc
     rdesc = open_binary(path)
     if rdesc is not None:
         return rdesc
@@ -163,6 +182,8 @@ def main(argv=sys.argv):
         print(f'{e}', file=sys.stderr)
     except Oops as e:
         print(f'{e}', file=sys.stderr)
+    except UnsupportedCompression as e:
+        print(f'{e}', file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import hidtools.hid
+from hidtools.fingerprint import DescriptorFingerprint
+from hidtools.index import RecordingIndex, RecordingIndexError
+from hidtools.recording import UnsupportedCompression, open_recording
+
+
+def recording_files(paths):
+    """
+    Yield the given files and the files in the given directories,
+    recursively.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    yield os.path.join(root, f)
+        else:
+            yield path
+
+
+def add(index, args):
+    added = skipped = failed = 0
+    for path in recording_files(args.recording):
+        try:
+            if index.add(path, store_events=args.events, force=args.force) is None:
+                skipped += 1
+            else:
+                added += 1
+        except (OSError, UnicodeDecodeError, ValueError, UnsupportedCompression) as e:
+            print(f'{path}: {e}', file=sys.stderr)
+            failed += 1
+    print(f'{added} recordings added, {skipped} unchanged, {failed} failed', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def query(index, args):
+    devices = index.find_devices(application=args.application, usage=args.usage,
+                                 name=args.name, vid=args.vid, pid=args.pid,
+                                 descriptor=args.descriptor, layout=args.layout)
+    for d in devices:
+        ids = ''
+        if d['bus'] is not None:
+            ids = f'{d["bus"]:x} {d["vid"]:04x} {d["pid"]:04x} '
+        descriptor = d['hash'][:12] if d['hash'] else '-'
+        print(f'{d["path"]}:{d["device_index"]}\t{ids}{descriptor} {d["events"]} events\t{d["name"]}')
+    return 0 if devices else 1
+
+
+def events(index, args):
+    row = index.db.execute('SELECT d.id FROM devices d JOIN recordings r ON d.recording_id = r.id '
+                           'WHERE r.path = ? AND d.device_index = ?',
+                           (os.path.abspath(args.recording), args.device)).fetchone()
+    if row is None:
+        print(f'{args.recording}: device {args.device} is not in the index', file=sys.stderr)
+        return 1
+
+    count = 0
+    for timestamp, report in index.iter_events(row['id']):
+        sec, usec = divmod(round(timestamp * 1000000), 1000000)
+        print(f'E: {sec:06d}.{usec:06d} {len(report)} {" ".join(f"{b:02x}" for b in report)}')
+        count += 1
+    if not count:
+        print(f'{args.recording}: no events stored for device {args.device}', file=sys.stderr)
+        return 1
+    return 0
+
+
+def descriptor_from_recording(path, device):
+    """
+    Return the :class:`hidtools.hid.ReportDescriptor` of the device with
+    the given index in the recording, or ``None``.
+    """
+    idx = 0
+    with open_recording(path) as f:
+        for line in f:
+            if line.startswith('D:'):
+                idx = int(line[2:])
+            elif line.startswith('R:') and idx == device:
+                return hidtools.hid.ReportDescriptor.from_string(line[2:].strip())
+    return None
+
+
+def similar(index, args):
+    if args.descriptor is not None:
+        fingerprint = index.fingerprint(args.descriptor)
+        if fingerprint is None:
+            print(f'descriptor {args.descriptor} is not in the index or is ambiguous', file=sys.stderr)
+            return 1
+    elif args.recording is not None:
+        try:
+            rdesc = descriptor_from_recording(args.recording, args.device)
+        except (OSError, ValueError, UnsupportedCompression, hidtools.hid.ParseError) as e:
+            print(f'{args.recording}: {e}', file=sys.stderr)
+            return 1
+        if rdesc is None:
+            print(f'{args.recording}: no report descriptor for device {args.device}', file=sys.stderr)
+            return 1
+        fingerprint = DescriptorFingerprint.from_rdesc(rdesc)
+    else:
+        print('a recording or --descriptor is required', file=sys.stderr)
+        return 1
+
+    results = index.similar_descriptors(fingerprint, args.threshold, args.limit)
+    for similarity, row in results:
+        names = sorted({d['name'] for d in index.find_devices(descriptor=row['hash'])})
+        example = f'\t{names[0]}' if names else ''
+        if len(names) > 1:
+            example += f' (+{len(names) - 1})'
+        print(f'{similarity:.2f} {row["hash"][:12]} layout {row["digest"][:12]} {row["devices"]} devices{example}')
+    return 0 if results else 1
+
+
+def stats(index, args):
+    for name, count in index.stats().items():
+        print(f'{name}: {count}')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index HID recordings in a SQLite database')
+    parser.add_argument('--database', metavar='path', type=str, default='hid-recordings.sqlite',
+                        help='The database file (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    p = subparsers.add_parser('add', help='Add recordings to the index')
+    p.add_argument('recording', metavar='recording.hid', nargs='+', type=str,
+                   help='Path to a recording, optionally compressed, or to a directory of recordings')
+    p.add_argument('--events', action='store_true', default=False,
+                   help='Also store the events, compressed')
+    p.add_argument('--force', action='store_true', default=False,
+                   help='Add the recordings again even if they did not change')
+    p.set_defaults(func=add)
+
+    p = subparsers.add_parser('query', help='List the recorded devices matching all criteria')
+    p.add_argument('--application', metavar='name', type=str, default=None,
+                   help='An application collection, e.g. "Touch Pad" or "Digitizers Touch Pad"')
+    p.add_argument('--usage', metavar='name', type=str, default=None,
+                   help='A usage of any field, e.g. "Contact Count"')
+    p.add_argument('--name', metavar='pattern', type=str, default=None,
+                   help='A pattern for the device name, e.g. "*Logitech*"')
+    p.add_argument('--vid', metavar='vid', type=lambda v: int(v, 16), default=None,
+                   help='The vendor ID in hex')
+    p.add_argument('--pid', metavar='pid', type=lambda v: int(v, 16), default=None,
+                   help='The product ID in hex')
+    p.add_argument('--descriptor', metavar='hash', type=str, default=None,
+                   help='The hash of the report descriptor, or a prefix of it')
+    p.add_argument('--layout', metavar='digest', type=str, default=None,
+                   help='The layout fingerprint of the report descriptor, or a prefix of it')
+    p.set_defaults(func=query)
+
+    p = subparsers.add_parser('similar', help='List the report descriptors with a similar layout')
+    p.add_argument('recording', metavar='recording.hid', nargs='?', type=str, default=None,
+                   help='A recording with the report descriptor to compare to')
+    p.add_argument('--device', metavar='index', type=int, default=0,
+                   help='The device index in the recording (default: %(default)s)')
+    p.add_argument('--descriptor', metavar='hash', type=str, default=None,
+                   help='The hash of a report descriptor in the index to compare to, or a prefix of it')
+    p.add_argument('--threshold', metavar='similarity', type=float, default=0.8,
+                   help='The minimum similarity between 0 and 1 (default: %(default)s)')
+    p.add_argument('--limit', metavar='N', type=int, default=20,
+                   help='Print at most N descriptors (default: %(default)s)')
+    p.set_defaults(func=similar)
+
+    p = subparsers.add_parser('events', help='Print the stored events of a recorded device')
+    p.add_argument('recording', metavar='recording.hid', type=str,
+                   help='Path to the recording')
+    p.add_argument('--device', metavar='index', type=int, default=0,
+                   help='The device index in the recording (default: %(default)s)')
+    p.set_defaults(func=events)
+
+    p = subparsers.add_parser('stats', help='Print the size of the index')
+    p.set_defaults(func=stats)
+
+    args = parser.parse_args()
+
+    try:
+        with RecordingIndex(args.database) as index:
+            sys.exit(args.func(index, args))
+    except (RecordingIndexError, sqlite3.Error) as e:
+        print(f'{args.database}: {e}', file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 6):
+        sys.exit('Python 3.6 or later required')
+
+    main()
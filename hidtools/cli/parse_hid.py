@@ -21,6 +21,10 @@
 import argparse
 import sys
 import hidtools.hid
+import hidtools.instrumentation as instrumentation
+from hidtools.export import (EXPORT_FORMATS, CsvWriter, ExportError, NpzWriter,
+                             RecordingExporter, export_format_from_filename)
+from hidtools.recording import UnsupportedCompression, open_recordings
 from parse import parse as _parse
 
 
@@ -92,7 +96,7 @@ def parse_hid(f_in, f_out, print_events=True):
             if win8:
                 f_out.write("**** win 8 certified ****\n")
         elif line.startswith("D:"):
-            r = _parse('D:{d:d}', line)
+            r = _parse('D:{d:d}', line.strip())
             assert(r is not None)
             device_index = r['d']
         elif line.startswith("E:"):
@@ -109,23 +113,81 @@ def parse_hid(f_in, f_out, print_events=True):
             f_out.write(line)
 
 
+def export_recording(f_in, path, export_format=None):
+    """
+    Export the recording read from ``f_in`` to ``path`` as table with one
+    column per usage, see :mod:`hidtools.export`.
+
+    :param str path: the file to write to, ``-`` for stdout (CSV and TSV
+        only)
+    :param str export_format: one of :data:`hidtools.export.EXPORT_FORMATS`,
+        guessed from ``path`` if ``None``
+    :returns: the :class:`hidtools.export.RecordingExporter`
+    """
+    if export_format is None:
+        export_format = export_format_from_filename(path)
+
+    exporter = RecordingExporter()
+    if export_format == 'npz':
+        if path == '-':
+            raise ExportError('npz cannot be written to stdout')
+        exporter.export(f_in, NpzWriter(path))
+    else:
+        delimiter = '\t' if export_format == 'tsv' else ','
+        if path == '-':
+            exporter.export(f_in, CsvWriter(sys.stdout, delimiter))
+        else:
+            with open(path, 'w') as f_out:
+                exporter.export(f_in, CsvWriter(f_out, delimiter))
+    return exporter
+
+
 def main():
     parser = argparse.ArgumentParser(description='Parse a HID recording and display it in human-readable format')
-    parser.add_argument('recording', metavar='recording.hid', nargs='?',
-                        help='Path to device recording (stdin if missing)',
-                        type=argparse.FileType('r'), default=sys.stdin)
+    parser.add_argument('recording', metavar='recording.hid', nargs='*',
+                        help='Path to device recording, optionally compressed, or to all segments '
+                             'of a rotated recording (stdin if missing)',
+                        type=str, default=['-'])
     parser.add_argument('--report-descriptor-only', action='store_true',
                         help='Only print the Report Descriptor',
                         default=False)
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help='Print the counters and timings of the parsing stages to stderr at the end')
+    parser.add_argument('--export', metavar='file', type=str, default=None,
+                        help='Write the events as a table with one column per usage to the file '
+                             'instead of printing them, - for stdout')
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS, default=None,
+                        help='The format of --export (default: guessed from the file extension, '
+                             'csv otherwise). npz requires numpy.')
     args = parser.parse_args()
-    with args.recording as f:
+    if args.stats:
+        instrumentation.enable()
+    try:
+        recording = open_recordings(args.recording)
+    except (OSError, UnsupportedCompression) as e:
+        print(f'{e}', file=sys.stderr)
+        sys.exit(1)
+
+    with recording as f:
         try:
-            parse_hid(f, sys.stdout, not args.report_descriptor_only)
+            if args.export is not None:
+                exporter = export_recording(f, args.export, args.export_format)
+                if exporter.skipped:
+                    print(f'{exporter.skipped} events do not match any report and were skipped',
+                          file=sys.stderr)
+            else:
+                parse_hid(f, sys.stdout, not args.report_descriptor_only)
+        except ExportError as e:
+            print(f'{e}', file=sys.stderr)
+            sys.exit(1)
         except KeyboardInterrupt:
             pass
         except BrokenPipeError:
             pass
 
+    if args.stats:
+        print(f'# stats total: {instrumentation.summary_line()}', file=sys.stderr)
+
 
 if __name__ == "__main__":
     main()
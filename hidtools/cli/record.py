@@ -17,12 +17,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import datetime
+import fnmatch
+import functools
+import io
+import queue
 import select
 import argparse
 import sys
 import os
+import threading
+import time
 
-from hidtools.hidraw import HidrawDevice
+import hidtools.instrumentation as instrumentation
+from hidtools.hidraw import HIDRAW_BUFFER_SIZE, READ_SIZE, HidrawDevice, HidrawEvent, OverrunDetector
+from hidtools.instrumentation import timed
+from hidtools.recording import (COMPRESSION_FORMATS, RotatingOutput,
+                                UnsupportedCompression, open_recording)
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+@timed('record.read', lambda args, r: len(r))
+def _read_report(fileno):
+    return os.read(fileno, READ_SIZE)
 
 
 def list_devices():
@@ -59,59 +80,583 @@ def list_devices():
         sys.exit(1)
 
 
+def parse_size(size):
+    """
+    Parse a size in bytes with an optional K, M or G suffix.
+    """
+    multipliers = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    multiplier = 1
+    if size and size[-1].upper() in multipliers:
+        multiplier = multipliers[size[-1].upper()]
+        size = size[:-1]
+    try:
+        return int(size) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid size: {size}')
+
+
+def hidraw_nodes():
+    """
+    Return the sorted list of ``/dev/hidraw*`` nodes currently present.
+    """
+    nodes = [f for f in os.listdir('/dev/') if f.startswith('hidraw')]
+    return [f'/dev/{f}' for f in sorted(nodes, key=lambda f: int(f[6:]))]
+
+
+class RecordingWriter(threading.Thread):
+    """
+    The writer stage of the recorder. The reader only timestamps the raw
+    reports and queues them with :meth:`queue_event`, this thread formats
+    them and writes them to the output in batches. Where the output is a
+    compressed file (see :func:`hidtools.recording.open_recording`), the
+    compression happens in this thread too.
+
+    The queue is bounded, if the writer cannot keep up the reader drops
+    events instead of blocking, see :attr:`dropped`.
+
+    Annotations queued with :meth:`queue_annotation` are written as
+    comments between the events, e.g. to mark where events were lost.
+
+    If the output is a :class:`hidtools.recording.RotatingOutput`, the
+    writer starts a new segment once the current one is over its limits
+    and repeats the description of all devices at the start of the new
+    segment.
+
+    :param File output: the file to write the recording to
+    :param bool print_index: if True, always print the ``D:`` lines even
+        if only one device is being recorded
+    :param int annotate_every: annotate every Nth event of each device
+        with its human-readable version, ``0`` disables annotations
+        entirely. Annotations can be regenerated later from the raw
+        events with ``parse_hid``.
+    :param int max_queue_size: the maximum number of events waiting to
+        be written
+
+    .. attribute:: written
+
+        The number of events written so far
+
+    .. attribute:: dropped
+
+        The number of events dropped because the queue was full
+
+    .. attribute:: max_queue_depth
+
+        The highest number of items observed in the queue
+    """
+    _HEADER = 0
+    _EVENT = 1
+    _REMOVE = 2
+    _ANNOTATION = 3
+    _STOP = 4
+
+    def __init__(self, output, print_index=False, annotate_every=1, max_queue_size=65536):
+        super().__init__(name='hid-recorder writer', daemon=True)
+        self.output = output
+        self.print_index = print_index
+        self.annotate_every = annotate_every
+        self.time_offset = None
+        self.written = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+        self._queue = queue.Queue(max_queue_size)
+        self._devices = {}
+        self._event_counts = {}
+        self._last_index = -1
+
+    @property
+    def queue_depth(self):
+        """
+        The number of items currently waiting to be written
+        """
+        return self._queue.qsize()
+
+    def queue_device(self, idx, device):
+        """
+        Queue the description of a newly added device. This call blocks
+        if the queue is full, device descriptions are never dropped.
+        """
+        self._queue.put((RecordingWriter._HEADER, idx, device))
+
+    def queue_device_removal(self, idx):
+        """
+        Queue the removal of the device with the given index. The device
+        is no longer described in subsequent segments of the recording.
+        """
+        self._queue.put((RecordingWriter._REMOVE, idx, None))
+
+    def queue_event(self, idx, timestamp, data):
+        """
+        Queue a report read from the device with the given index.
+
+        :param int idx: the device index
+        :param float timestamp: the time of the event as returned by
+            :func:`time.time`
+        :param bytes data: the report as read from the device
+        :returns: False if the event was dropped because the queue is full
+        """
+        try:
+            self._queue.put_nowait((RecordingWriter._EVENT, idx, (timestamp, data)))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def queue_annotation(self, idx, timestamp, text, block=False):
+        """
+        Queue a comment line for the recording.
+
+        :param int idx: the device index the annotation refers to
+        :param float timestamp: the time as returned by :func:`time.time`,
+            printed like the event timestamps. ``None`` to omit it.
+        :param str text: the comment, without the leading ``#``
+        :param bool block: if False, do not wait for room in the queue
+        :returns: False if the queue is full and ``block`` is False
+        """
+        try:
+            self._queue.put((RecordingWriter._ANNOTATION, idx, (timestamp, text)), block)
+        except queue.Full:
+            return False
+        return True
+
+    def stop(self):
+        """
+        Write all pending items and terminate the thread.
+        """
+        self._queue.put((RecordingWriter._STOP, None, None))
+        self.join()
+
+    def _format_device(self, idx, device):
+        self._devices[idx] = device
+        self._event_counts[idx] = 0
+        output = io.StringIO()
+        if self.print_index:
+            print(f'D: {idx}', file=output)
+        device.dump(output)
+        self._last_index = idx
+        return output.getvalue()
+
+    def _format_segment_header(self):
+        output = io.StringIO()
+        if self.time_offset is not None:
+            start = datetime.datetime.fromtimestamp(self.time_offset)
+            print(f'# Segment {self.output.index}, timestamps are relative to {start.isoformat()}', file=output)
+        for idx, device in self._devices.items():
+            if self.print_index:
+                print(f'D: {idx}', file=output)
+            device.dump(output, from_the_beginning=True)
+            self._last_index = idx
+        return output.getvalue()
+
+    def _format_event(self, idx, timestamp, data):
+        if self.time_offset is None:
+            self.time_offset = timestamp
+        sec, usec = divmod(round((timestamp - self.time_offset) * 1000000), 1000000)
+
+        output = ''
+        if self._last_index != idx:
+            output = f'D: {idx}\n'
+            self._last_index = idx
+
+        annotate = False
+        if self.annotate_every:
+            count = self._event_counts[idx]
+            annotate = count % self.annotate_every == 0
+            self._event_counts[idx] = count + 1
+
+        device = self._devices[idx]
+        self.written += 1
+        return output + device.format_event(HidrawEvent(sec, usec, data), annotate)
+
+    def _format_annotation(self, idx, timestamp, text):
+        if timestamp is None:
+            return f'# {text}\n'
+        offset = self.time_offset if self.time_offset is not None else timestamp
+        sec, usec = divmod(round((timestamp - offset) * 1000000), 1000000)
+        return f'# {sec:06d}.{usec:06d} {text}\n'
+
+    @timed('record.write', lambda args, r: len(args[1]))
+    def _write(self, data):
+        self.output.write(data)
+
+    def run(self):
+        q = self._queue
+        running = True
+        rotate = isinstance(self.output, RotatingOutput)
+        while running:
+            depth = q.qsize()
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+
+            batch = [q.get()]
+            # drain everything that is already available so it gets
+            # written with a single call
+            try:
+                while len(batch) < 1024:
+                    batch.append(q.get_nowait())
+            except queue.Empty:
+                pass
+
+            chunks = []
+            for kind, idx, payload in batch:
+                if kind == RecordingWriter._EVENT:
+                    chunks.append(self._format_event(idx, *payload))
+                elif kind == RecordingWriter._HEADER:
+                    chunks.append(self._format_device(idx, payload))
+                elif kind == RecordingWriter._ANNOTATION:
+                    chunks.append(self._format_annotation(idx, *payload))
+                elif kind == RecordingWriter._REMOVE:
+                    del self._devices[idx]
+                else:
+                    running = False
+            self._write(''.join(chunks))
+
+            if rotate and running and self.output.should_rotate():
+                self.output.rotate()
+                self.output.write(self._format_segment_header())
+
+            if q.empty():
+                self.output.flush()
+
+
+class HidRecorder(object):
+    """
+    Records any number of hidraw devices into a single output file.
+
+    Devices are multiplexed through :func:`select.epoll` so the cost of a
+    wakeup does not depend on the number of devices being recorded. Each
+    device is given a device index in the order it was added, the index
+    is printed as ``D:`` line whenever the output switches between devices.
+
+    Reading and writing are decoupled, the recording loop only reads and
+    timestamps the reports, formatting and writing the output is done by
+    the :class:`RecordingWriter` thread.
+
+    The devices are read nonblocking and drained on each wakeup, the
+    number of reports pending is passed to an
+    :class:`hidtools.hidraw.OverrunDetector` per device. Likely losses
+    are annotated in the recording with an ``# ... OVERRUN`` comment and
+    a summary per device is written at the end of the recording.
+
+    :param File output: the file to write the recording to
+    :param bool print_index: if True, always print the ``D:`` lines even
+        if only one device is being recorded
+    :param str name_filter: a shell-style pattern (see :mod:`fnmatch`),
+        devices whose name do not match are ignored
+    :param int annotate_every: see :class:`RecordingWriter`
+
+    .. attribute:: writer
+
+        The :class:`RecordingWriter` for this recording
+
+    .. attribute:: detectors
+
+        A dict of device index to a tuple of ``(name, detector)`` with the
+        :class:`hidtools.hidraw.OverrunDetector` of each device recorded
+        so far, including the removed ones
+    """
+    def __init__(self, output, print_index=False, name_filter=None, annotate_every=1):
+        self.writer = RecordingWriter(output, print_index, annotate_every)
+        self.name_filter = name_filter
+        self._epoll = select.epoll()
+        self._devices = {}  # fileno -> (index, path, HidrawDevice, OverrunDetector)
+        self.detectors = {}
+        self._pending_annotations = []
+        self._paths = set()
+        self._next_index = 0
+        self._monitor = None
+
+    def add_device(self, fd):
+        """
+        Add the hidraw device to the recording and dump its description.
+
+        :param File fd: a file object pointing to a ``/dev/hidrawX`` node
+        :returns: the device index or ``None`` if the device was filtered
+        """
+        device = HidrawDevice(fd)
+        if self.name_filter is not None and not fnmatch.fnmatch(device.name, self.name_filter):
+            fd.close()
+            return None
+
+        idx = self._next_index
+        self._next_index += 1
+
+        self.writer.queue_device(idx, device)
+
+        detector = OverrunDetector()
+        self.detectors[idx] = (device.name, detector)
+
+        os.set_blocking(fd.fileno(), False)
+        self._epoll.register(fd.fileno(), select.EPOLLIN)
+        self._devices[fd.fileno()] = (idx, fd.name, device, detector)
+        self._paths.add(fd.name)
+        return idx
+
+    def add_path(self, path):
+        """
+        Open the given hidraw node and add it to the recording, unless it
+        is already recorded.
+
+        :returns: the device index or ``None`` if the device was not added
+        """
+        if path in self._paths:
+            return None
+        try:
+            fd = open(path)
+        except FileNotFoundError:
+            # device was removed before we could get to it
+            return None
+        try:
+            return self.add_device(fd)
+        except FileNotFoundError:
+            fd.close()
+            return None
+        except BaseException:
+            fd.close()
+            raise
+
+    def remove_device(self, fileno):
+        """
+        Remove the device from the recording, usually because it was
+        unplugged.
+        """
+        idx, path, device, _ = self._devices.pop(fileno)
+        self.writer.queue_device_removal(idx)
+        self._paths.discard(path)
+        self._epoll.unregister(fileno)
+        device.device.close()
+
+    @property
+    def device_count(self):
+        """
+        The number of devices currently being recorded
+        """
+        return len(self._devices)
+
+    def enable_hotplug(self):
+        """
+        Watch for new hidraw devices and add them to the recording as they
+        appear. Requires pyudev.
+        """
+        if pyudev is None:
+            raise ImportError('hotplug is not supported due to missing pyudev dependency')
+
+        context = pyudev.Context()
+        self._monitor = pyudev.Monitor.from_netlink(context)
+        self._monitor.filter_by('hidraw')
+        self._monitor.start()
+        self._epoll.register(self._monitor.fileno(), select.EPOLLIN)
+
+    def _process_udev_events(self):
+        for udev_device in iter(functools.partial(self._monitor.poll, 0), None):
+            if udev_device.action == 'add' and udev_device.device_node is not None:
+                try:
+                    self.add_path(udev_device.device_node)
+                except OSError as e:
+                    # e.g. udev did not apply its rules to the node yet
+                    # (EACCES) or the device is already gone (ENODEV),
+                    # that shouldn't end the recording
+                    print(f'Skipping {udev_device.device_node}: {e}', file=sys.stderr)
+
+    def _annotate(self, idx, overrun):
+        level = 'OVERRUN' if overrun.is_loss else 'WARNING'
+        self._pending_annotations.append((idx, overrun.timestamp, f'{level} device {idx}: {overrun}'))
+        self._flush_annotations()
+
+    def _flush_annotations(self):
+        # annotations are not dropped, they are retried on the next
+        # wakeup if the queue is full
+        pending = self._pending_annotations
+        while pending and self.writer.queue_annotation(*pending[0]):
+            pending.pop(0)
+
+    def _process_device(self, fileno, mask):
+        idx, _, _, detector = self._devices[fileno]
+
+        if mask & select.EPOLLIN:
+            if self._pending_annotations:
+                self._flush_annotations()
+
+            start = None
+            depth = truncated = dropped = 0
+            try:
+                # drain the node, a queue deeper than the kernel can hold
+                # means we lost reports. Reports arriving while we drain
+                # wake us up again.
+                for _ in range(HIDRAW_BUFFER_SIZE):
+                    data = _read_report(fileno)
+                    now = time.time()
+                    if start is None:
+                        start = now
+                    depth += 1
+                    if len(data) >= READ_SIZE:
+                        truncated += 1
+                    if not self.writer.queue_event(idx, now, data):
+                        dropped += 1
+            except BlockingIOError:
+                pass
+            except OSError:
+                # device has been unplugged
+                self.remove_device(fileno)
+                return
+
+            if depth:
+                for overrun in detector.update(start, depth, truncated):
+                    self._annotate(idx, overrun)
+            if dropped:
+                self._annotate(idx, detector.dropped(start, dropped))
+        elif mask & (select.EPOLLHUP | select.EPOLLERR):
+            self.remove_device(fileno)
+
+    def summary(self):
+        """
+        :returns: a list of lines summarizing the reads and overruns of
+            each device
+        """
+        return [f'device {idx} ({name}): {detector.summary()}'
+                for idx, (name, detector) in sorted(self.detectors.items())]
+
+    @property
+    def lost(self):
+        """
+        The estimated number of reports lost over all devices
+        """
+        return sum(detector.lost for _, detector in self.detectors.values())
+
+    @property
+    def overruns(self):
+        """
+        The number of overruns where reports were likely lost, over all
+        devices
+        """
+        return sum(detector.overruns for _, detector in self.detectors.values())
+
+    def record(self):
+        """
+        Record events until interrupted. Any events pending on
+        interruption are written out before returning.
+        """
+        monitor_fd = self._monitor.fileno() if self._monitor is not None else None
+
+        self.writer.start()
+        try:
+            while True:
+                for fileno, mask in self._epoll.poll():
+                    if fileno == monitor_fd:
+                        self._process_udev_events()
+                    else:
+                        self._process_device(fileno, mask)
+        finally:
+            self._flush_annotations()
+            summary = self.summary()
+            for line in summary:
+                self.writer.queue_annotation(None, None, f'Summary {line}', block=True)
+            self.writer.stop()
+
+            for line in summary:
+                print(f'# {line}', file=sys.stderr)
+            if self.writer.dropped:
+                print(f'{self.writer.dropped} events dropped, the writer could not keep up '
+                      f'(max queue depth: {self.writer.max_queue_depth})', file=sys.stderr)
+            if self.overruns:
+                lost = f', ~{self.lost} reports lost' if self.lost else ''
+                print(f'WARNING: the recording is likely incomplete, {self.overruns} overruns{lost}',
+                      file=sys.stderr)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Record a HID device')
     parser.add_argument('device', metavar='/dev/hidrawX',
                         nargs="*", type=argparse.FileType('r'),
                         help='Path to the hidraw device node')
     parser.add_argument('--output', metavar='output-file',
-                        nargs=1, default=[sys.stdout],
-                        type=argparse.FileType('w'),
+                        nargs=1, default=['-'], type=str,
                         help='The file to record to (default: stdout)')
+    parser.add_argument('--compress', choices=COMPRESSION_FORMATS, default=None,
+                        help='Compress the recording (default: guessed from the output file extension)')
+    parser.add_argument('--all', action='store_true', default=False,
+                        help='Record all hidraw devices, including devices plugged in later')
+    parser.add_argument('--filter', metavar='pattern', type=str, default=None,
+                        help='Only record the devices whose name matches the shell-style pattern (implies --all)')
+    parser.add_argument('--no-annotations', action='store_true', default=False,
+                        help='Only record the raw events, without the human-readable comments')
+    parser.add_argument('--annotate-every', metavar='N', type=int, default=1,
+                        help='Only add the human-readable comment to every Nth event of a device (default: 1)')
+    parser.add_argument('--rotate-size', metavar='size', type=parse_size, default=None,
+                        help='Start a new segment once the output file reaches the size in bytes, '
+                             'K, M and G suffixes are allowed (requires --output)')
+    parser.add_argument('--rotate-time', metavar='seconds', type=float, default=None,
+                        help='Start a new segment every given number of seconds (requires --output)')
+    parser.add_argument('--stats', metavar='seconds', type=float, default=None,
+                        help='Print the counters and timings of the read, format and write stages '
+                             'to stderr every given number of seconds')
     args = parser.parse_args()
 
-    devices = {}
-    last_index = -1
-    poll = select.poll()
-    is_first_event = True
+    rotate = args.rotate_size is not None or args.rotate_time is not None
+    if rotate and args.output[0] == '-':
+        parser.error('--rotate-size and --rotate-time require --output')
+
+    annotate_every = 0 if args.no_annotations else max(args.annotate_every, 0)
 
     # argparse always gives us a list for nargs 1
-    output = args.output[0]
+    try:
+        if rotate:
+            output = RotatingOutput(args.output[0], args.rotate_size, args.rotate_time, args.compress)
+        else:
+            output = open_recording(args.output[0], 'w', args.compress)
+    except UnsupportedCompression as e:
+        print(f'{e}', file=sys.stderr)
+        sys.exit(1)
+    except OSError as e:
+        parser.error(f"can't open '{args.output[0]}': {e}")
+
+    record_all = args.all or args.filter is not None
 
     try:
-        if not args.device:
-            args.device = [open(list_devices())]
+        if record_all:
+            recorder = HidRecorder(output, print_index=True, name_filter=args.filter,
+                                   annotate_every=annotate_every)
+            hotplug = True
+            try:
+                # enable hotplug first so we don't miss devices added while
+                # we go through the existing ones
+                recorder.enable_hotplug()
+            except ImportError as e:
+                hotplug = False
+                print(f'{e}, new devices will be ignored', file=sys.stderr)
+            for path in hidraw_nodes():
+                recorder.add_path(path)
+            if recorder.device_count == 0 and not hotplug:
+                print('No devices found', file=sys.stderr)
+                sys.exit(1)
+        else:
+            if not args.device:
+                args.device = [open(list_devices())]
 
-        for idx, fd in enumerate(args.device):
-            device = HidrawDevice(fd)
-            if len(args.device) > 1:
-                print(f'D: {idx}', file=output)
-            device.dump(output)
-            poll.register(fd, select.POLLIN)
-            devices[fd.fileno()] = (idx, device)
-
-        if len(devices) == 1:
-            last_index = 0
-
-        while True:
-            events = poll.poll()
-            for fd, event in events:
-                idx, device = devices[fd]
-                device.read_events()
-                if last_index != idx:
-                    print(f'D: {idx}', file=output)
-                    last_index = idx
-                device.dump(output)
-
-                if is_first_event:
-                    is_first_event = False
-                    for idx, d in devices.values():
-                        d.time_offset = device.time_offset
+            recorder = HidRecorder(output, print_index=len(args.device) > 1,
+                                   annotate_every=annotate_every)
+            for fd in args.device:
+                recorder.add_device(fd)
+
+        stats = None
+        if args.stats:
+            instrumentation.enable()
+            stats = instrumentation.PeriodicSummary(args.stats)
+            stats.start()
+        try:
+            recorder.record()
+        finally:
+            if stats is not None:
+                stats.stop()
 
     except PermissionError:
         print('Insufficient permissions, please run me as root.', file=sys.stderr)
     except KeyboardInterrupt:
         pass
+    finally:
+        # required for compressed recordings to write the end of stream
+        if output is not sys.stdout:
+            output.close()
 
 
 if __name__ == '__main__':
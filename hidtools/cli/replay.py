@@ -22,7 +22,9 @@ from datetime import datetime, timedelta
 import argparse
 import sys
 import time
+import hidtools.instrumentation as instrumentation
 import hidtools.uhid
+from hidtools.recording import open_recordings
 from parse import parse, findall
 
 from hidtools.device.sony_gamepad import PS3Controller
@@ -41,12 +43,15 @@ class HIDReplay(object):
 
     def __init__(self, filename):
         self._devices = {}
-        self.filename = filename
+        # a list of filenames is a recording split into segments
+        if isinstance(filename, str):
+            filename = [filename]
+        self.filenames = filename
         self.replayed_count = 0
 
         devices = {}
         dev = None
-        with open(filename) as f:
+        with open_recordings(self.filenames) as f:
 
             class DeviceInfo(object):
                 def __init__(self):
@@ -98,8 +103,7 @@ class HIDReplay(object):
 
             uhid_dev.create_kernel_device()
 
-        while not self.ready:
-            hidtools.uhid.UHIDDevice.dispatch(1000)
+        hidtools.uhid.UHIDDevice.wait_ready_all(self._devices.values(), timeout=30)
 
     def determine_device_by_info(self, info):
         device_id = (info['vid'], info['pid'])
@@ -110,7 +114,7 @@ class HIDReplay(object):
     @property
     def ready(self):
         for d in self._devices.values():
-            if not d.device_nodes:
+            if not d.is_ready():
                 return False
         return True
 
@@ -124,14 +128,14 @@ class HIDReplay(object):
     def inject_events(self, wait_max_seconds=2):
         t = None
         timestamp_offset = 0
-        with open(self.filename) as f:
+        with open_recordings(self.filenames) as f:
             idx = 0
             dev = None
             if idx in self._devices:
                 dev = self._devices[idx]
             for l in f:
                 if l.startswith('D:'):
-                    r = parse('D: {idx:d}', l)
+                    r = parse('D: {idx:d}', l.strip())
                     assert r is not None
                     dev = self._devices[r['idx']]
                 elif l.startswith('E:'):
@@ -175,22 +179,36 @@ class HIDReplay(object):
 
 def main():
     parser = argparse.ArgumentParser(description='Replay a HID recording')
-    parser.add_argument('recording', metavar='recording.hid',
-                        type=str, help='Path to device recording')
+    parser.add_argument('recording', metavar='recording.hid', nargs='+',
+                        type=str, help='Path to device recording, or to all segments of a rotated recording')
     parser.add_argument('--verbose', action='store_true',
                         default=False, help='Show debugging information')
+    parser.add_argument('--stats', metavar='seconds', type=float, default=None,
+                        help='Print the counters and timings of the event injection '
+                             'to stderr every given number of seconds')
     args = parser.parse_args()
     if args.verbose:
         base_logger.setLevel(logging.DEBUG)
 
+    stats = None
+    if args.stats:
+        instrumentation.enable()
+        stats = instrumentation.PeriodicSummary(args.stats)
+        stats.start()
+
     try:
         with HIDReplay(args.recording) as replay:
             while True:
                 replay.replay_one_sequence()
     except PermissionError:
         print('Insufficient permissions, please run me as root.', file=sys.stderr)
+    except hidtools.uhid.UHIDNotReadyException as e:
+        print(f'Failed to create the devices: {e}', file=sys.stderr)
     except KeyboardInterrupt:
         pass
+    finally:
+        if stats is not None:
+            stats.stop()
 
 
 if __name__ == '__main__':
@@ -100,12 +100,16 @@ class BaseDevice(UHIDDevice):
         self.application = application
         self.input_nodes = {}
         self.led_classes = {}
+        self.hidraw_node = None
         self._opened_files = []
         if rdesc is None:
             self.rdesc = hid.ReportDescriptor.from_human_descr(rdesc_str)
         else:
             self.rdesc = rdesc
 
+    def is_ready(self):
+        return self._ready and self.application in self.input_nodes
+
     def match_evdev_rule(self, application, evdev):
         '''Replace this in subclasses if the device has multiple reports
         of the same type and we need to filter based on the actual evdev
@@ -156,6 +160,12 @@ class BaseDevice(UHIDDevice):
         led = LED(device)
         self.led_classes[led.sys_path.name] = led
 
+    def udev_hidraw_event(self, device):
+        '''Remember the ``/dev/hidrawX`` node of this device in
+        :attr:`hidraw_node`, e.g. to open it with
+        :class:`hidtools.hidraw.HidrawDevice`.'''
+        self.hidraw_node = device.properties.get('DEVNAME')
+
     def udev_event(self, event):
         if event.action != 'add':
             return
@@ -168,6 +178,8 @@ class BaseDevice(UHIDDevice):
             return self.udev_input_event(device)
         elif subsystem == 'leds':
             return self.udev_led_event(device)
+        elif subsystem == 'hidraw':
+            return self.udev_hidraw_event(device)
 
         logger.debug(f'{subsystem}: {device}')
 
@@ -193,6 +205,48 @@ class BaseDevice(UHIDDevice):
         for name in to_remove:
             del(self.input_nodes[name])
 
+    def neutral_reports(self):
+        '''The input reports that bring the device back to its neutral
+        state, sent by :meth:`reset`.
+
+        By default an all-zero report for each input report, which
+        releases pressed buttons, keys and touches. Devices whose neutral
+        state is not zero, e.g. gamepads with centred axes, must override
+        this.
+
+        :returns: a list of reports, each a list of 8-bit integers
+        '''
+        reports = []
+        for report in self.parsed_rdesc.input_reports.values():
+            data = [0] * report.size
+            if report.numbered:
+                data[0] = report.report_ID
+            reports.append(data)
+        return reports
+
+    def reset(self):
+        '''Bring the kernel device back to a neutral state so it can be
+        reused, see :class:`hidtools.device.pool.DevicePool`.
+
+        This turns off the LEDs and sends the :meth:`neutral_reports`,
+        then drops all pending events from the event nodes.
+
+        Subclasses that keep state from feature or output reports should
+        reset it here.
+        '''
+        for led in self.led_classes.values():
+            led.brightness = 0
+
+        for data in self.neutral_reports():
+            self.call_input_event(data)
+
+        # process the output reports triggered by the LEDs
+        self.dispatch(10)
+
+        for evdev in self.input_nodes.values():
+            for _ in evdev.events():
+                pass
+
     def next_sync_events(self):
         return list(self.evdev.events())
 
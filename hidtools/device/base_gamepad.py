@@ -61,6 +61,8 @@ class BaseGamepad(BaseDevice):
         self.left = (127, 127)
         self.right = (127, 127)
         self.hat_switch = 15
+        # (reportID, application) -> [report bytearray, fields, values]
+        self._report_states = {}
 
         self.fields = []
         for r in self.parsed_rdesc.input_reports.values():
@@ -120,14 +122,59 @@ class BaseGamepad(BaseDevice):
 
         reportID = reportID or self.default_reportID
 
-        gamepad = GamepadData()
-        for i, b in self._buttons.items():
-            gamepad.__setattr__(f'b{i}', int(b) if b is not None else 0)
-
-        self.store_axes('left_stick', gamepad, left)
-        self.store_axes('right_stick', gamepad, right)
-        gamepad.hatswitch = hat_switch
-        return super().create_report(gamepad, reportID=reportID, application=application)
+        values = {f'b{i}': int(b) if b is not None else 0 for i, b in self._buttons.items()}
+        # subclasses may override store_axes() to remap or scale the axes
+        axes = GamepadData()
+        for which, data in (('left_stick', left), ('right_stick', right)):
+            self.store_axes(which, axes, data)
+        values.update(vars(axes))
+        values['hatswitch'] = hat_switch
+
+        return self._update_report(values, reportID, application)
+
+    def _update_report(self, values, reportID, application):
+        # The report for each report ID/application is kept around and
+        # only the fields whose value changed are updated in place. The
+        # first report is built with the generic create_report().
+        key = (reportID, application)
+        state = self._report_states.get(key)
+        if state is None:
+            if application is not None:
+                rdesc = self.parsed_rdesc.get_report_from_application(application)
+            else:
+                rdesc = self.parsed_rdesc.input_reports[reportID or -1]
+
+            gamepad = GamepadData()
+            for name, value in values.items():
+                setattr(gamepad, name, value)
+            report = bytearray(rdesc.create_report([gamepad], None))
+            self._report_states[key] = [report, rdesc.fields_by_attribute(), values]
+            return list(report)
+
+        report, fields, previous = state
+        try:
+            for name, value in values.items():
+                if previous.get(name) != value:
+                    for field in fields.get(name, ()):
+                        field.fill_values(report, [value])
+                    previous[name] = value
+        except Exception:
+            # the report may be half-updated, start over next time
+            del self._report_states[key]
+            raise
+        return list(report)
+
+    def neutral_reports(self):
+        """
+        The all-zero reports of :meth:`BaseDevice.neutral_reports()
+        <hidtools.device.base_device.BaseDevice.neutral_reports>`
+        followed by a report with the sticks centred, the hat switch in
+        its null state and all buttons released.
+        """
+        reports = super().neutral_reports()
+        reports.append(self.create_report(left=(127, 127), right=(127, 127), hat_switch=15,
+                                          buttons={b: False for b in self.buttons}))
+        return reports
 
     def event(self, *, left=(None, None), right=(None, None), hat_switch=None, buttons=None):
         """
@@ -0,0 +1,132 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Scripted motion for gamepads: trajectories for the sticks, button
+patterns, and a player that sends the resulting reports at a fixed rate::
+
+    import hidtools.device.gamepad_motion as motion
+
+    gamepad = SaitekGamepad()
+    ...
+    frames = motion.frames(1000,
+                           left=motion.circle(1000, radius=100, turns=4),
+                           right=motion.random_walk(1000, seed=0),
+                           buttons=motion.button_pattern(1000, [1, 2], period=50))
+    reports = motion.encode(gamepad, frames)
+    stats = motion.play(gamepad, reports, rate=1000)
+
+A trajectory is a list of ``(x, y)`` tuples, one per frame, so recorded
+curves can be used as-is.
+'''
+
+import math
+import random
+
+from hidtools.device.playback import PlaybackStats, play_batches  # noqa
+
+
+def _clamp(value, minimum, maximum):
+    return max(minimum, min(maximum, value))
+
+
+def sweep(n, start=(0, 0), end=(255, 255)):
+    '''A linear movement from ``start`` to ``end`` in ``n`` frames.'''
+    if n == 1:
+        return [tuple(end)]
+    (x0, y0), (x1, y1) = start, end
+    return [(round(x0 + (x1 - x0) * i / (n - 1)), round(y0 + (y1 - y0) * i / (n - 1)))
+            for i in range(n)]
+
+
+def circle(n, center=(127, 127), radius=127, turns=1):
+    '''``turns`` circles around ``center`` in ``n`` frames.'''
+    cx, cy = center
+    step = 2 * math.pi * turns / n
+    return [(round(cx + radius * math.cos(i * step)), round(cy + radius * math.sin(i * step)))
+            for i in range(n)]
+
+
+def random_walk(n, start=(127, 127), step=4, minimum=0, maximum=255, seed=None):
+    '''A random walk of at most ``step`` per axis and frame, confined to
+    ``[minimum, maximum]``. Use ``seed`` for a reproducible walk.'''
+    rng = random.Random(seed)
+    x, y = start
+    points = []
+    for _ in range(n):
+        x = _clamp(x + rng.randint(-step, step), minimum, maximum)
+        y = _clamp(y + rng.randint(-step, step), minimum, maximum)
+        points.append((x, y))
+    return points
+
+
+def button_pattern(n, buttons, period=2, duty=0.5):
+    '''Press the ``buttons`` one after the other, each for ``duty`` of
+    ``period`` frames.
+
+    :returns: a list of ``n`` dicts of button/bool as taken by
+        :meth:`BaseGamepad.create_report()
+        <hidtools.device.base_gamepad.BaseGamepad.create_report>`
+    '''
+    pressed = max(1, round(period * duty))
+    pattern = []
+    for i in range(n):
+        current = buttons[(i // period) % len(buttons)]
+        pattern.append({b: b == current and i % period < pressed for b in buttons})
+    return pattern
+
+
+def frames(n, left=None, right=None, buttons=None, hat_switch=None):
+    '''Combine trajectories and patterns into ``n`` frames of keyword
+    arguments for :meth:`BaseGamepad.create_report()
+    <hidtools.device.base_gamepad.BaseGamepad.create_report>`. Each
+    argument is a sequence with one element per frame or ``None`` to
+    leave that part unchanged.'''
+    parts = {'left': left, 'right': right, 'buttons': buttons, 'hat_switch': hat_switch}
+    parts = {k: v for k, v in parts.items() if v is not None}
+    for k, v in parts.items():
+        if len(v) < n:
+            raise ValueError(f'{k} has {len(v)} elements, {n} are needed')
+    return [{k: v[i] for k, v in parts.items()} for i in range(n)]
+
+
+def encode(gamepad, frames):
+    '''Encode the frames into reports for the gamepad.
+
+    This updates the gamepad's state like calling :meth:`event()
+    <hidtools.device.base_gamepad.BaseGamepad.event>` for each frame
+    would, but no report is sent yet.
+
+    :returns: a list of ``bytes``, one report per frame
+    '''
+    create_report = gamepad.create_report
+    return [bytes(create_report(**frame)) for frame in frames]
+
+
+def play(device, reports, rate, spin=0.0005):
+    '''Send the reports through the device at ``rate`` reports per second,
+    see :func:`hidtools.device.playback.play_batches` for the pacing.
+
+    :param device: the uhid device
+    :param list reports: the reports, e.g. from :func:`encode`
+    :param float rate: the number of reports per second
+    :param float spin: below this many seconds until the next report is
+        due, busy-wait instead of sleeping
+    :returns: a :class:`PlaybackStats
+        <hidtools.device.playback.PlaybackStats>`
+    '''
+    return play_batches(device, [[r] for r in reports], rate, spin)
@@ -0,0 +1,576 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Benjamin Tissoires <benjamin.tissoires@gmail.com>
+# Copyright (c) 2017 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Multitouch devices: touchscreens and touchpads following the
+Microsoft Windows 8 specification, plus a frame encoder to replay
+synthetic gestures::
+
+    from hidtools.device.multitouch import MinWin8TSParallel, TOUCH_FIELDS
+    import hidtools.device.multitouch as multitouch
+
+    uhdev = MinWin8TSParallel(10)
+    ...
+    frames = multitouch.swipe(240, fingers=10, start=(100, 100), end=(1000, 100))
+    reports = uhdev.encode_frames(frames)
+    stats = multitouch.play(uhdev, reports, rate=240)
+
+A frame is the list of the touches down at one point in time, each touch
+is a tuple with the values named by the ``fields`` argument of
+:meth:`Digitizer.encode_frames`, :data:`TOUCH_FIELDS` by default.
+'''
+
+import sys
+
+from hidtools.device.base_device import BaseDevice
+from hidtools.device.playback import play_batches
+
+#: The default fields of the touch tuples in a frame
+TOUCH_FIELDS = ('contactid', 'x', 'y', 'tipswitch', 'confidence')
+
+
+class Data(object):
+    pass
+
+
+class Touch(object):
+    def __init__(self, id, x, y):
+        self.contactid = id
+        self.x = x
+        self.y = y
+        self.cx = x
+        self.cy = y
+        self.tipswitch = True
+        self.confidence = True
+        self.tippressure = 15
+        self.azimuth = 0
+        self.inrange = True
+        self.width = 10
+        self.height = 10
+
+
+class Pen(Touch):
+    def __init__(self, x, y):
+        super().__init__(0, x, y)
+        self.barrel = False
+        self.invert = False
+        self.eraser = False
+        self.x_tilt = False
+        self.y_tilt = False
+        self.twist = 0
+
+
+class Digitizer(BaseDevice):
+    @classmethod
+    def msCertificationBlob(cls, reportID):
+        return f'''
+        Usage Page (Digitizers)
+        Usage (Touch Screen)
+        Collection (Application)
+         Report ID ({reportID})
+         Usage Page (0xff00)
+         Usage (0xc5)
+         Logical Minimum (0)
+         Logical Maximum (255)
+         Report Size (8)
+         Report Count (256)
+         Feature (Data,Var,Abs)
+        End Collection
+    '''
+
+    def __init__(self, name, rdesc_str=None, rdesc=None, application='Touch Screen', physical='Finger', max_contacts=None, input_info=(3, 1, 2), quirks=None):
+        super().__init__(name, application, rdesc_str, rdesc, input_info)
+        self.scantime = 0
+        self._frame_encoders = {}
+        self.quirks = quirks
+        if max_contacts is None:
+            max_contacts = sys.maxsize
+            for features in self.parsed_rdesc.feature_reports.values():
+                for feature in features:
+                    if feature.usage_name in ['Contact Max']:
+                        max_contacts = feature.logical_max
+            for inputs in self.parsed_rdesc.input_reports.values():
+                for i in inputs:
+                    if (i.usage_name in ['Contact Count'] and
+                       i.logical_max > 0 and
+                       max_contacts > i.logical_max):
+                        max_contacts = i.logical_max
+            if max_contacts == sys.maxsize:
+                max_contacts = 1
+        self.max_contacts = max_contacts
+        self.physical = physical
+        self.cur_application = application
+
+        for features in self.parsed_rdesc.feature_reports.values():
+            for feature in features:
+                if feature.usage_name == 'Inputmode':
+                    self.cur_application = 'Mouse'
+
+        self.fields = []
+        for r in self.parsed_rdesc.input_reports.values():
+            if r.application_name == self.application:
+                physicals = [f.physical_name for f in r]
+                if self.physical not in physicals and None not in physicals:
+                    continue
+                self.fields = [f.usage_name for f in r]
+
+    @property
+    def max_contacts(self):
+        """
+        The maximum number of contacts, also reported by the Contact Max
+        feature reports
+        """
+        return self._max_contacts
+
+    @max_contacts.setter
+    def max_contacts(self, max_contacts):
+        # the Contact Max feature reports are answered from the reply
+        # table, rebuild them for the new value
+        self._max_contacts = max_contacts
+        self.contactmax = max_contacts
+        for rdesc in self.parsed_rdesc.feature_reports.values():
+            if 'Contact Max' in [f.usage_name for f in rdesc]:
+                self.add_get_report_reply(rdesc.report_ID, rdesc.create_report([self], None))
+
+    def get_report(self, req, rnum, rtype):
+        # the Contact Max feature reports are answered from the reply
+        # table, see max_contacts
+        return (1, [])
+
+    @property
+    def touches_in_a_report(self):
+        return self.fields.count('Contact Id')
+
+    def input_report(self):
+        """
+        The :class:`HidReport <hidtools.hid.HidReport>` :meth:`event`
+        sends for the current application. Override this if
+        :meth:`create_report` is overridden to use another report.
+        """
+        return self.parsed_rdesc.get_report_from_application(self.cur_application)
+
+    def encode_frames(self, frames, fields=TOUCH_FIELDS, global_data=None, incr_scantime=True):
+        """
+        Encode the reports for many frames in one call.
+
+        For each frame, this gives the same reports as calling
+        :meth:`event` with a :class:`Touch` for each tuple, but without
+        sending them and much faster: the position of each field is
+        looked up once, and a report is built by shifting the values
+        into place. The touches of a frame are spread over as many
+        reports as needed, with the contact count in the first one only,
+        which covers both the parallel and the hybrid reporting modes.
+
+        The values the tuples do not have are those of a default
+        :class:`Touch`, ``cx`` and ``cy`` follow ``x`` and ``y``. Other
+        fields, e.g. the buttons of a touchpad, are taken from
+        ``global_data``, or are 0.
+
+        :param list frames: for each frame, a list of touch tuples
+        :param tuple fields: the attribute names of the tuple values
+        :param global_data: an object with the values of the fields that
+            are not touch fields, the contact count and scan time are
+            filled in
+        :param bool incr_scantime: ``True`` to increment the scan time
+            for each frame
+        :returns: for each frame, a list of the reports as ``bytes``
+        """
+        report = self.input_report()
+        key = (report, tuple(fields))
+        encoder = self._frame_encoders.get(key)
+        if encoder is None:
+            encoder = _FrameEncoder(report, fields)
+            self._frame_encoders[key] = encoder
+
+        rs = []
+        for frame in frames:
+            if incr_scantime:
+                self.scantime += 1
+            rs.append(encoder.encode(frame[:self.max_contacts], self.scantime, global_data))
+        return rs
+
+    def event(self, slots, global_data=None, contact_count=None, incr_scantime=True):
+        if incr_scantime:
+            self.scantime += 1
+        rs = []
+        # make sure we have only the required number of available slots
+        slots = slots[:self.max_contacts]
+
+        if global_data is None:
+            global_data = Data()
+        if contact_count is None:
+            global_data.contactcount = len(slots)
+        else:
+            global_data.contactcount = contact_count
+        global_data.scantime = self.scantime
+
+        while len(slots):
+            r = self.create_report(application=self.cur_application, data=slots, global_data=global_data)
+            self.call_input_event(r)
+            rs.append(r)
+            global_data.contactcount = 0
+        return rs
+
+    def set_report(self, req, rnum, rtype, data):
+        if rtype != self.UHID_FEATURE_REPORT:
+            return 1
+
+        rdesc = None
+        for v in self.parsed_rdesc.feature_reports.values():
+            if v.report_ID == rnum:
+                rdesc = v
+
+        if rdesc is None:
+            return 1
+
+        if 'Inputmode' not in [f.usage_name for f in rdesc]:
+            return 0
+
+        Inputmode_seen = False
+        for f in rdesc:
+            if 'Inputmode' == f.usage_name:
+                values = f.get_values(data)
+                assert len(values) == 1
+                value = values[0]
+
+                if not Inputmode_seen:
+                    Inputmode_seen = True
+                    if value == 0:
+                        self.cur_application = 'Mouse'
+                    elif value == 2:
+                        self.cur_application = 'Touch Screen'
+                    elif value == 3:
+                        self.cur_application = 'Touch Pad'
+                else:
+                    if value != 0:
+                        # Elan bug where the device doesn't work properly
+                        # if we set twice an Input Mode in the same Feature
+                        self.cur_application = 'Mouse'
+
+        return 0
+
+
+class PTP(Digitizer):
+    def __init__(self, name, type='Click Pad', rdesc_str=None, rdesc=None, application='Touch Pad', physical='Pointer', max_contacts=None, input_info=None):
+        self.type = type.lower().replace(' ', '')
+        if self.type == 'clickpad':
+            self.buttontype = 0
+        else:  # pressurepad
+            self.buttontype = 1
+        self.clickpad_state = False
+        self.left_state = False
+        self.right_state = False
+        super().__init__(name, rdesc_str, rdesc, application, physical, max_contacts, input_info)
+
+    def event(self, slots=None, click=None, left=None, right=None, contact_count=None, incr_scantime=True):
+        # update our internal state
+        if click is not None:
+            self.clickpad_state = click
+        if left is not None:
+            self.left_state = left
+        if right is not None:
+            self.right_state = right
+
+        # now create the global data
+        global_data = Data()
+        global_data.b1 = 1 if self.clickpad_state else 0
+        global_data.b2 = 1 if self.left_state else 0
+        global_data.b3 = 1 if self.right_state else 0
+
+        if slots is None:
+            slots = [Data()]
+
+        return super().event(slots, global_data, contact_count, incr_scantime)
+
+    def encode_frames(self, frames, fields=TOUCH_FIELDS, click=None, left=None, right=None, incr_scantime=True):
+        """
+        Like :meth:`Digitizer.encode_frames`, with the button state of
+        :meth:`event`. A frame that is ``None`` gives a report with the
+        buttons only, like :meth:`event` without slots.
+        """
+        if click is not None:
+            self.clickpad_state = click
+        if left is not None:
+            self.left_state = left
+        if right is not None:
+            self.right_state = right
+
+        global_data = Data()
+        global_data.b1 = 1 if self.clickpad_state else 0
+        global_data.b2 = 1 if self.left_state else 0
+        global_data.b3 = 1 if self.right_state else 0
+
+        frames = [[None] if f is None else f for f in frames]
+        return super().encode_frames(frames, fields, global_data, incr_scantime)
+
+
+class MinWin8TSParallel(Digitizer):
+    def __init__(self, max_slots):
+        self.max_slots = max_slots
+        self.phys_max = 120, 90
+        rdesc_finger_str = f'''
+            Usage Page (Digitizers)
+            Usage (Finger)
+            Collection (Logical)
+             Report Size (1)
+             Report Count (1)
+             Logical Minimum (0)
+             Logical Maximum (1)
+             Usage (Tip Switch)
+             Input (Data,Var,Abs)
+             Report Size (7)
+             Logical Maximum (127)
+             Input (Cnst,Var,Abs)
+             Report Size (8)
+             Logical Maximum (255)
+             Usage (Contact Id)
+             Input (Data,Var,Abs)
+             Report Size (16)
+             Unit Exponent (-1)
+             Unit (Centimeter,SILinear)
+             Logical Maximum (4095)
+             Physical Minimum (0)
+             Physical Maximum ({self.phys_max[0]})
+             Usage Page (Generic Desktop)
+             Usage (X)
+             Input (Data,Var,Abs)
+             Physical Maximum ({self.phys_max[1]})
+             Usage (Y)
+             Input (Data,Var,Abs)
+             Usage Page (Digitizers)
+             Usage (Azimuth)
+             Logical Maximum (360)
+             Unit (Degrees,SILinear)
+             Report Size (16)
+             Input (Data,Var,Abs)
+            End Collection
+'''
+        rdesc_str = f'''
+           Usage Page (Digitizers)
+           Usage (Touch Screen)
+           Collection (Application)
+            Report ID (1)
+            {rdesc_finger_str * self.max_slots}
+            Unit Exponent (-4)
+            Unit (Seconds,SILinear)
+            Logical Maximum (65535)
+            Physical Maximum (65535)
+            Usage Page (Digitizers)
+            Usage (Scan Time)
+            Input (Data,Var,Abs)
+            Report Size (8)
+            Logical Maximum (255)
+            Usage (Contact Count)
+            Input (Data,Var,Abs)
+            Report ID (2)
+            Logical Maximum ({self.max_slots})
+            Usage (Contact Max)
+            Feature (Data,Var,Abs)
+          End Collection
+          {Digitizer.msCertificationBlob(68)}
+'''
+        super().__init__(f'uhid test parallel {self.max_slots}', rdesc_str)
+
+
+class MinWin8TSHybrid(Digitizer):
+    def __init__(self):
+        self.max_slots = 10
+        self.phys_max = 120, 90
+        rdesc_finger_str = f'''
+            Usage Page (Digitizers)
+            Usage (Finger)
+            Collection (Logical)
+             Report Size (1)
+             Report Count (1)
+             Logical Minimum (0)
+             Logical Maximum (1)
+             Usage (Tip Switch)
+             Input (Data,Var,Abs)
+             Report Size (7)
+             Logical Maximum (127)
+             Input (Cnst,Var,Abs)
+             Report Size (8)
+             Logical Maximum (255)
+             Usage (Contact Id)
+             Input (Data,Var,Abs)
+             Report Size (16)
+             Unit Exponent (-1)
+             Unit (Centimeter,SILinear)
+             Logical Maximum (4095)
+             Physical Minimum (0)
+             Physical Maximum ({self.phys_max[0]})
+             Usage Page (Generic Desktop)
+             Usage (X)
+             Input (Data,Var,Abs)
+             Physical Maximum ({self.phys_max[1]})
+             Usage (Y)
+             Input (Data,Var,Abs)
+            End Collection
+'''
+        rdesc_str = f'''
+           Usage Page (Digitizers)
+           Usage (Touch Screen)
+           Collection (Application)
+            Report ID (1)
+            {rdesc_finger_str * 2}
+            Unit Exponent (-4)
+            Unit (Seconds,SILinear)
+            Logical Maximum (65535)
+            Physical Maximum (65535)
+            Usage Page (Digitizers)
+            Usage (Scan Time)
+            Input (Data,Var,Abs)
+            Report Size (8)
+            Logical Maximum (255)
+            Usage (Contact Count)
+            Input (Data,Var,Abs)
+            Report ID (2)
+            Logical Maximum ({self.max_slots})
+            Usage (Contact Max)
+            Feature (Data,Var,Abs)
+          End Collection
+          {Digitizer.msCertificationBlob(68)}
+'''
+        super().__init__('uhid test hybrid', rdesc_str)
+
+
+class _FrameEncoder(object):
+    """
+    Encodes the reports of :meth:`Digitizer.encode_frames` for one
+    report and one set of touch tuple fields.
+
+    The layout of the report is resolved into a list of ``(index,
+    attribute, source, key, field, start, mask, minimum, maximum)``
+    tuples where ``source`` is where the value comes from for a touch:
+    ``'touch'`` with the tuple position as ``key``, ``'const'`` with the
+    value as ``key`` or ``None`` for the global data. Values in
+    ``[minimum, maximum]`` can be shifted into place directly.
+    """
+    def __init__(self, report, fields):
+        self.report = report
+        self.template = report.report_ID if report.numbered else 0
+
+        positions = {f: i for i, f in enumerate(fields)}
+        defaults = vars(Touch(0, 0, 0))
+        if 'cx' not in positions and 'x' in positions:
+            positions['cx'] = positions['x']
+        if 'cy' not in positions and 'y' in positions:
+            positions['cy'] = positions['y']
+
+        self.entries = []
+        self.groups = 0
+        for index, attribute, field in report.data_layout():
+            self.groups = max(self.groups, index + 1)
+            if attribute in positions:
+                source, key = 'touch', positions[attribute]
+            elif attribute in defaults:
+                source, key = 'const', defaults[attribute]
+            else:
+                source, key = None, None
+
+            mask = (1 << field.size) - 1
+            if field.count != 1:
+                # let fill_values() handle arrays
+                minimum, maximum = 1, 0
+            elif field.is_null or field.usage_name in ['Contact Id', 'Contact Max', 'Contact Count']:
+                minimum, maximum = min(0, field.logical_min), mask
+            elif field.logical_min < 0:
+                minimum, maximum = field.logical_min, field.logical_max
+            else:
+                minimum, maximum = field.logical_min, min(field.logical_max, mask)
+
+            self.entries.append((index, attribute, source, key, field, field.start, mask, minimum, maximum))
+
+    def _slow_bits(self, field, value):
+        # the generic path, for values out of the fast range: this raises
+        # the same errors as create_report()
+        try:
+            value[0]
+        except TypeError:
+            value = [value]
+        r = [0] * self.report.size
+        field.fill_values(r, value)
+        return int.from_bytes(bytes(r), 'little')
+
+    def encode(self, touches, scantime, global_data):
+        count = len(touches)
+        globals_ = {'contactcount': count, 'scantime': scantime}
+        size = self.report.size
+        groups = self.groups
+        reports = []
+
+        for first in range(0, count, groups):
+            chunk = touches[first:first + groups]
+            n = len(chunk)
+            r = self.template
+            for index, attribute, source, key, field, start, mask, minimum, maximum in self.entries:
+                touch = chunk[index] if index < n else None
+                if touch is not None and source == 'touch':
+                    value = touch[key]
+                elif touch is not None and source == 'const':
+                    value = key
+                elif attribute in globals_:
+                    value = globals_[attribute]
+                else:
+                    value = getattr(global_data, attribute, 0)
+                try:
+                    fast = minimum <= value <= maximum
+                except TypeError:
+                    fast = False
+                if fast:
+                    r |= (value & mask) << start
+                else:
+                    r |= self._slow_bits(field, value)
+            reports.append(r.to_bytes(size, 'little'))
+            globals_['contactcount'] = 0
+
+        return reports
+
+
+def swipe(n, fingers=10, start=(100, 100), end=(1000, 100), spacing=(0, 50), release=True):
+    """
+    A swipe of ``fingers`` touches in a row, moving from ``start`` to
+    ``end`` in ``n`` frames, for :meth:`Digitizer.encode_frames` with
+    :data:`TOUCH_FIELDS`.
+
+    :param tuple spacing: the offset between two fingers
+    :param bool release: ``True`` to lift the fingers in an extra frame
+    """
+    (x0, y0), (x1, y1), (dx, dy) = start, end, spacing
+    frames = []
+    for i in range(n):
+        t = i / (n - 1) if n > 1 else 1
+        x, y = round(x0 + (x1 - x0) * t), round(y0 + (y1 - y0) * t)
+        frames.append([(f, x + f * dx, y + f * dy, True, True) for f in range(fingers)])
+    if release and frames:
+        frames.append([(c, x, y, False, True) for c, x, y, _, _ in frames[-1]])
+    return frames
+
+
+def play(device, frames, rate, spin=0.0005):
+    """
+    Send the reports of each frame from :meth:`Digitizer.encode_frames`
+    through the device at ``rate`` frames per second. The reports of a
+    frame are always sent together, see
+    :func:`hidtools.device.playback.play_batches` for the pacing.
+
+    :returns: a :class:`PlaybackStats
+        <hidtools.device.playback.PlaybackStats>` where ``sent`` counts
+        frames
+    """
+    return play_batches(device, frames, rate, spin)
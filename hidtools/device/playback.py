@@ -0,0 +1,100 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Send batches of reports through a uhid device at a fixed rate, shared
+by the scripted motion of :mod:`hidtools.device.gamepad_motion` and
+:mod:`hidtools.device.multitouch`.'''
+
+import time
+
+
+class PlaybackStats(object):
+    '''The result of :func:`play_batches`.
+
+    .. attribute:: sent
+
+        The number of batches sent
+
+    .. attribute:: duration
+
+        The time it took in seconds
+
+    .. attribute:: max_lateness
+
+        The longest time in seconds a batch was sent after its due time
+    '''
+    def __init__(self, sent, duration, max_lateness):
+        self.sent = sent
+        self.duration = duration
+        self.max_lateness = max_lateness
+
+    @property
+    def rate(self):
+        '''The effective rate in batches per second'''
+        return self.sent / self.duration if self.duration else 0.0
+
+    def __repr__(self):
+        return f'<PlaybackStats sent={self.sent} duration={self.duration:.3f}s rate={self.rate:.0f}/s max_lateness={self.max_lateness * 1000:.3f}ms>'
+
+
+def play_batches(device, batches, rate, spin=0.0005, on_send=None):
+    '''Send the batches of reports through the device at ``rate`` batches
+    per second.
+
+    The batches are due at fixed times from the start, so a late batch
+    does not delay the following ones. The reports of all batches that are
+    due are sent together with :meth:`call_input_events()
+    <hidtools.uhid.UHIDDevice.call_input_events>`, which keeps up with
+    rates beyond what the scheduler can wake us up for.
+
+    The kernel's requests are not processed while playing unless the
+    dispatcher thread runs, see :meth:`start_dispatcher()
+    <hidtools.uhid.UHIDDevice.start_dispatcher>`.
+
+    :param device: the uhid device
+    :param list batches: a list of lists of reports, the reports of one
+        batch are always sent together
+    :param float rate: the number of batches per second
+    :param float spin: below this many seconds until the next batch is
+        due, busy-wait instead of sleeping
+    :param on_send: a callable taking the index of the first and one past
+        the last batch, called right before these batches are sent
+    :returns: a :class:`PlaybackStats`
+    '''
+    interval = 1.0 / rate
+    clock = time.perf_counter
+    start = clock()
+    sent = 0
+    max_lateness = 0.0
+
+    while sent < len(batches):
+        now = clock()
+        due = min(len(batches), int((now - start) / interval) + 1)
+        if due > sent:
+            max_lateness = max(max_lateness, now - (start + sent * interval))
+            if on_send is not None:
+                on_send(sent, due)
+            device.call_input_events([r for batch in batches[sent:due] for r in batch])
+            sent = due
+            continue
+
+        remaining = start + sent * interval - now
+        if remaining > spin:
+            time.sleep(remaining - spin)
+
+    return PlaybackStats(sent, clock() - start, max_lateness)
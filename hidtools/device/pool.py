@@ -0,0 +1,117 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import logging
+
+logger = logging.getLogger('hidtools.device.pool')
+
+
+class DevicePool(object):
+    '''A pool of kernel devices that are kept alive between users.
+
+    Creating a kernel device and waiting for udev to process it is slow,
+    a pool hands out an existing device with the same type, name, report
+    descriptor and info if one is available instead::
+
+        pool = DevicePool()
+
+        with pool.device(MyDevice()) as uhdev:
+            uhdev.call_input_event(...)
+
+        # this one is the kernel device from above
+        with pool.device(MyDevice()) as uhdev:
+            ...
+
+        pool.clear()
+
+    Devices are reset with :meth:`BaseDevice.reset()
+    <hidtools.device.base_device.BaseDevice.reset>` before they are handed
+    out again.
+
+    :param timeout: the time to wait for a new device to be ready, in
+        seconds
+    '''
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        self._free = {}
+
+    @staticmethod
+    def key(device):
+        '''The default key for a device, devices with the same key are
+        interchangeable.'''
+        return (type(device), device.name, device.phys, bytes(device.rdesc), device.info)
+
+    def acquire(self, device, key=None):
+        '''Return a kernel device matching the given device.
+
+        If the pool has a device with the same key, ``device`` is
+        discarded and the pooled device is reset and returned. Otherwise
+        the kernel device for ``device`` is created and ``device`` is
+        returned once it is ready.
+
+        :param device: a :class:`BaseDevice
+            <hidtools.device.base_device.BaseDevice>` whose kernel device
+            has not been created yet
+        :param key: a hashable identifying interchangeable devices,
+            defaults to :meth:`key`
+        :raises: :class:`UHIDNotReadyException
+            <hidtools.uhid.UHIDNotReadyException>` if a new device is
+            not ready within the timeout
+        '''
+        if key is None:
+            key = self.key(device)
+
+        free = self._free.get(key)
+        if free:
+            # the device was never created, this only closes its fd
+            device.destroy()
+            device = free.pop()
+            logger.debug(f'reusing {device.name}')
+            device.reset()
+            device._pool_key = key
+            return device
+
+        device.create_kernel_device()
+        try:
+            device.wait_ready(self.timeout)
+        except Exception:
+            device.destroy()
+            raise
+        device._pool_key = key
+        return device
+
+    def release(self, device):
+        '''Give a device obtained with :meth:`acquire` back to the pool.'''
+        self._free.setdefault(device._pool_key, []).append(device)
+
+    @contextlib.contextmanager
+    def device(self, device, key=None):
+        '''Context manager around :meth:`acquire` and :meth:`release`.'''
+        device = self.acquire(device, key)
+        try:
+            yield device
+        finally:
+            self.release(device)
+
+    def clear(self):
+        '''Destroy all devices currently in the pool.'''
+        for devices in self._free.values():
+            for device in devices:
+                device.destroy()
+        self._free.clear()
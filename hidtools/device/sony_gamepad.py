@@ -176,35 +176,26 @@ class PS3Controller(BaseGamepad):
         self.current_mode = 'plugged-in'
         self.rumble = PS3Rumble()
         self.hw_leds = PS3LEDs()
+        self.add_get_report_reply(0xf2, self._get_report_f2)
+        self.add_get_report_reply(0xf5, [0x01, 0x00, 0x18, 0x5e, 0x0f, 0x71, 0xa4, 0xbb])
 
-    def get_report(self, req, rnum, rtype):
-        rdesc = None
-        for v in self.parsed_rdesc.feature_reports.values():
-            if v.report_ID == rnum:
-                rdesc = v
-
-        logger.debug(f'get_report {rdesc}, {req}, {rnum}, {rtype}')
+    def _get_report_f2(self, rnum, rtype):
+        # undocumented report in the HID report descriptor:
+        # the MAC address of the device is stored in the bytes 4-9
+        # rest has been dumped on a Sixaxis controller
+        r = [0xf2, 0xff, 0xff, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03, 0x40, 0x80, 0x18, 0x01, 0x8a]
 
-        if rnum == 0xf2:
-            # undocumented report in the HID report descriptor:
-            # the MAC address of the device is stored in the bytes 4-9
-            # rest has been dumped on a Sixaxis controller
-            r = [0xf2, 0xff, 0xff, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03, 0x40, 0x80, 0x18, 0x01, 0x8a]
+        # store the uniq value in the report
+        for id, v in enumerate(self.uniq.split(':')):
+            r[4 + id] = int(v, 16)
 
-            # store the uniq value in the report
-            for id, v in enumerate(self.uniq.split(':')):
-                r[4 + id] = int(v, 16)
-
-            # change the mode to operational
-            self.current_mode = 'operational'
-            return (0, r)
-
-        if rnum == 0xf5:
-            return (0, [0x01, 0x00, 0x18, 0x5e, 0x0f, 0x71, 0xa4, 0xbb])
-
-        if rdesc is None:
-            return (1, [])
+        # change the mode to operational
+        self.current_mode = 'operational'
+        return (0, r)
 
+    def get_report(self, req, rnum, rtype):
+        # 0xf2 and 0xf5 are answered directly, see __init__
+        logger.debug(f'get_report {req}, {rnum}, {rtype}')
         return (1, [])
 
     def set_report(self, req, rnum, rtype, data):
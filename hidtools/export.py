@@ -0,0 +1,346 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''
+Export of recordings as tables with one column per usage, for loading
+into e.g. pandas::
+
+    with open_recording('mouse.hid') as f, open('mouse.csv', 'w') as out:
+        RecordingExporter().export(f, CsvWriter(out))
+
+    df = pandas.read_csv('mouse.csv')
+
+Each row is one event, with its ``timestamp`` in seconds, the ``device``
+index, the ``report_id`` (0 for devices without report IDs) and the
+values of the fields of the report. The columns of the fields are named
+after the attributes :meth:`hidtools.hid.HidReport.create_report` uses,
+e.g. ``x``, ``b1`` or ``contactid``. Where a usage repeats in a report, e.g. one ``contactid``
+per touch, the following ones are suffixed with their index, e.g.
+``contactid.1``. Array fields have one column per element, e.g.
+``keyboard[0]``. Columns that are not part of the report of an event are
+empty (CSV) or NaN (npz).
+
+The recording is decoded in chunks of rows, the writers only keep one
+chunk of decoded rows in memory. The npz writer accumulates the columns
+in compact arrays until it is closed, it requires numpy.
+'''
+
+import array
+import math
+import re
+
+import hidtools.hid
+from hidtools.fingerprint import report_fingerprint
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+EXPORT_FORMATS = ('npz', 'csv', 'tsv')
+"""The formats supported for exporting recordings"""
+
+# the columns at the start of every row
+FIXED_COLUMNS = ('timestamp', 'device', 'report_id')
+
+_invalid_chars = re.compile(r'[^A-Za-z0-9_.\[\]]')
+
+
+class ExportError(Exception):
+    """
+    An exception raised when a recording cannot be exported in the
+    requested format.
+    """
+    pass
+
+
+def export_format_from_filename(filename):
+    """
+    Guess the export format from the extension of ``filename``, defaults
+    to ``'csv'``.
+    """
+    for fmt in EXPORT_FORMATS:
+        if filename.lower().endswith(f'.{fmt}'):
+            return fmt
+    return 'csv'
+
+
+def report_columns(report):
+    """
+    Return the columns of a :class:`hidtools.hid.HidReport`, as a list of
+    ``(name, field, index)`` tuples, one for each value of the non-const
+    fields. ``index`` is the index of the value in
+    :meth:`hidtools.hid.HidField.get_values`.
+    """
+    columns = []
+    names = set()
+    for index, attribute, field in report.data_layout():
+        if field.is_array:
+            page = field.usage_page_name or 'array'
+            attribute = page.replace(' ', '').lower()
+        name = attribute if index == 0 else f'{attribute}.{index}'
+        name = _invalid_chars.sub('_', name)
+
+        if field.count == 1 and not field.is_array:
+            elements = [name]
+        else:
+            elements = [f'{name}[{i}]' for i in range(field.count)]
+
+        for i, element in enumerate(elements):
+            # e.g. vendor fields repeating the same usage
+            unique, n = element, 1
+            while unique in names:
+                n += 1
+                unique = f'{element}#{n}'
+            names.add(unique)
+            columns.append((unique, field, i))
+    return columns
+
+
+class _ReportDecoder(object):
+    # The positions of the values of a report, decoded from the report as
+    # one integer. Equivalent to HidField.get_values() for each column.
+    def __init__(self, report, column_index):
+        self.entries = []
+        self.positions = []
+        for name, field, i in report_columns(report):
+            start = field.start + field.size * i
+            signed = field.logical_min < 0 and field.size > 1
+            self.entries.append((start, field.size, (1 << field.size) - 1, signed))
+            self.positions.append(column_index(name))
+
+    def decode(self, data):
+        value = int.from_bytes(bytes(data), 'little')
+        nbits = len(data) * 8
+        values = []
+        for start, size, mask, signed in self.entries:
+            if start + size > nbits:
+                values.append(None)
+                continue
+            v = (value >> start) & mask
+            if signed and v >> (size - 1):
+                v -= 1 << size
+            values.append(v)
+        return values
+
+
+class RecordingExporter(object):
+    """
+    Decodes the events of a recording in the ``hid-recorder`` format with
+    the report descriptor of their device and passes them to a writer in
+    chunks of rows.
+
+    :param int chunk_size: the number of rows per chunk
+
+    .. attribute:: columns
+
+        The names of all columns so far, starting with
+        :data:`FIXED_COLUMNS`
+
+    .. attribute:: rows
+
+        The number of rows exported so far
+
+    .. attribute:: skipped
+
+        The number of events that do not match any report of their device
+    """
+    def __init__(self, chunk_size=4096):
+        self.chunk_size = chunk_size
+        self.columns = list(FIXED_COLUMNS)
+        self.rows = 0
+        self.skipped = 0
+        self._column_index = {name: i for i, name in enumerate(self.columns)}
+        self._rdescs = {}
+        self._decoders = {}
+        # decoders by report_fingerprint(), devices with the same reports,
+        # e.g. many recordings of one model, share them
+        self._decoder_cache = {}
+        self._chunk = []
+
+    def _get_column(self, name):
+        try:
+            return self._column_index[name]
+        except KeyError:
+            self._column_index[name] = len(self.columns)
+            self.columns.append(name)
+            return self._column_index[name]
+
+    def add_device(self, index, rdesc):
+        """
+        Add the :class:`hidtools.hid.ReportDescriptor` of the device with
+        the given index, its columns are added to :attr:`columns`.
+        """
+        self._rdescs[index] = rdesc
+        for report in rdesc.input_reports.values():
+            key = report_fingerprint(report)
+            try:
+                decoder = self._decoder_cache[key]
+            except KeyError:
+                decoder = _ReportDecoder(report, self._get_column)
+                self._decoder_cache[key] = decoder
+            self._decoders[(index, report)] = decoder
+
+    def add_event(self, index, timestamp, data, writer):
+        """
+        Decode one event of the device with the given index and pass the
+        chunk to ``writer`` once it is full.
+
+        :param int index: the device index
+        :param float timestamp: the timestamp in seconds
+        :param list data: the report as list of bytes
+        """
+        report = self._rdescs[index].get(data[0], len(data))
+        if report is None:
+            self.skipped += 1
+            return
+        decoder = self._decoders[(index, report)]
+        report_id = report.report_ID if report.numbered else 0
+        self._chunk.append((timestamp, index, report_id, decoder.positions, decoder.decode(data)))
+        if len(self._chunk) >= self.chunk_size:
+            self.flush(writer)
+
+    def flush(self, writer):
+        """
+        Pass the pending rows to ``writer``.
+        """
+        if not self._chunk:
+            return
+        chunk = self._chunk
+        self._chunk = []
+
+        columns = [[None] * len(chunk) for _ in self.columns]
+        timestamps, devices, report_ids = columns[:3]
+        for row, (timestamp, index, report_id, positions, values) in enumerate(chunk):
+            timestamps[row] = timestamp
+            devices[row] = index
+            report_ids[row] = report_id
+            for p, v in zip(positions, values):
+                columns[p][row] = v
+
+        writer.write_chunk(list(self.columns), columns)
+        self.rows += len(chunk)
+
+    def export(self, f_in, writer):
+        """
+        Export the recording read from ``f_in`` with ``writer`` and close
+        the writer.
+
+        :param File f_in: the recording, e.g. from
+            :func:`hidtools.recording.open_recording`
+        :param writer: a :class:`CsvWriter` or :class:`NpzWriter`
+        :returns: the number of rows written
+        """
+        index = 0
+        try:
+            for line in f_in:
+                if line.startswith('E:'):
+                    _, time, size, report = line.split(' ', 3)
+                    data = [int(b, 16) for b in report.split()]
+                    self.add_event(index, float(time), data, writer)
+                elif line.startswith('D:'):
+                    index = int(line[2:])
+                elif line.startswith('R:'):
+                    rdesc = hidtools.hid.ReportDescriptor.from_string(line[2:].strip())
+                    self.add_device(index, rdesc)
+            self.flush(writer)
+        finally:
+            writer.close()
+        return self.rows
+
+
+class CsvWriter(object):
+    """
+    Writes the exported rows as CSV, or TSV with ``delimiter='\\t'``.
+    The header is written with the first chunk, a device that adds columns
+    after that raises :class:`ExportError`.
+
+    :param File file: the text file to write to
+    :param str delimiter: the column separator
+    """
+    def __init__(self, file, delimiter=','):
+        self.file = file
+        self.delimiter = delimiter
+        self._columns = None
+
+    def write_chunk(self, names, columns):
+        if self._columns is None:
+            self._columns = names
+            self.file.write(self.delimiter.join(names) + '\n')
+        elif len(names) != len(self._columns):
+            new = ', '.join(names[len(self._columns):])
+            raise ExportError(f'columns {new} were added after the header was written, '
+                              f'export to npz instead')
+
+        def fmt(v):
+            if v is None:
+                return ''
+            if isinstance(v, float):
+                return f'{v:.6f}'
+            return str(v)
+
+        self.file.write(''.join(self.delimiter.join(map(fmt, row)) + '\n' for row in zip(*columns)))
+
+    def close(self):
+        self.file.flush()
+
+
+class NpzWriter(object):
+    """
+    Writes the exported rows as NumPy ``.npz`` file with one array per
+    column, load it with ``pandas.DataFrame(dict(numpy.load(path)))``.
+
+    Columns without missing values are stored as ``int64``, the others as
+    ``float64`` with NaN where the value is missing. ``timestamp`` is
+    always ``float64``.
+
+    :param str path: the path of the ``.npz`` file
+    :param bool compress: if True, compress the file
+    """
+    def __init__(self, path, compress=True):
+        if numpy is None:
+            raise ExportError('npz export requires numpy, export to csv or tsv instead')
+        self.path = path
+        self.compress = compress
+        self.rows = 0
+        self._columns = {}
+
+    def write_chunk(self, names, columns):
+        nrows = len(columns[0])
+        for name, values in zip(names, columns):
+            try:
+                column = self._columns[name]
+            except KeyError:
+                # a device added after the first chunk, backfill the rows
+                # so far
+                column = array.array('d', [math.nan]) * self.rows
+                self._columns[name] = column
+            column.extend(math.nan if v is None else v for v in values)
+        self.rows += nrows
+
+    def close(self):
+        arrays = {}
+        for name, column in self._columns.items():
+            a = numpy.frombuffer(column, dtype=numpy.float64)
+            if name != 'timestamp' and not numpy.isnan(a).any():
+                a = a.astype(numpy.int64)
+            arrays[name] = a
+        save = numpy.savez_compressed if self.compress else numpy.savez
+        save(self.path, **arrays)
@@ -0,0 +1,318 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''
+Structural fingerprints of report descriptors, to find devices with the
+same or a similar report layout::
+
+    fp = DescriptorFingerprint.from_rdesc(rdesc)
+    index = SimilarityIndex()
+    index.add('mouse.hid', fp)
+    ...
+    for similarity, key in index.query(other_fp, threshold=0.8):
+        print(f'{similarity:.2f} {key}')
+
+The fingerprint is computed from the parsed reports and fields, not from
+the descriptor bytes. Descriptors that only differ in how they express
+the same layout, e.g. redundant or reordered global items, usage ranges
+instead of lists of usages, or padding split over several items, have the
+same fingerprint.
+
+Two descriptors are similar if their fields are: the similarity is the
+Jaccard index of the sets of fields of both descriptors, where a field is
+its report type, application, usage, size, count, logical range and
+flags. :class:`SimilarityIndex` finds similar descriptors in a corpus with
+MinHash signatures and locality-sensitive hashing, only the candidates
+sharing a band of their signature are compared.
+'''
+
+import array
+import hashlib
+import struct
+
+# the MinHash functions are (a * h + b) mod _PRIME over the 61-bit hash h
+# of each token
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 61) - 1
+
+_REPORT_TYPES = (('input', 'input_reports'), ('output', 'output_reports'), ('feature', 'feature_reports'))
+
+
+def _token_hash(token):
+    digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+    return struct.unpack('<Q', digest)[0] & _MASK
+
+
+def _minhash_functions(permutations, seed=0x4849):
+    # deterministic, signatures are stored by hid-index
+    functions = []
+    for i in range(permutations):
+        digest = hashlib.blake2b(f'{seed}:{i}'.encode('utf-8'), digest_size=16).digest()
+        a, b = struct.unpack('<QQ', digest)
+        functions.append(((a & _MASK) | 1, b & _MASK))
+    return functions
+
+
+def report_layout(report):
+    """
+    Return the canonical layout of a :class:`hidtools.hid.HidReport` as a
+    tuple of fields, each a tuple of:
+
+    - the collection, numbered in the order the collections appear in
+      the report
+    - the usage, or the tuple of usages of an array field
+    - the size in bits and the count
+    - the logical minimum and maximum
+    - the item flags (Data/Constant, Array/Variable, Absolute/Relative...)
+
+    Adjacent constant fields are merged into one padding field
+    ``('pad', size)``. Adjacent variable fields that only differ by their
+    position, e.g. a 64 byte vendor blob with a single usage, are merged
+    into one field with their total count.
+    """
+    fields = []
+    collections = {}
+    padding = 0
+    for field in report:
+        if field.is_const:
+            padding += field.size * field.count
+            continue
+        if padding:
+            fields.append(('pad', padding))
+            padding = 0
+        collection = collections.setdefault(field.collection, len(collections))
+        if field.is_array:
+            fields.append((collection, tuple(field.usages), field.size, field.count,
+                           field.logical_min, field.logical_max, field.type))
+            continue
+        entry = (collection, field.usage, field.size, field.count,
+                 field.logical_min, field.logical_max, field.type)
+        if fields and fields[-1][:3] == entry[:3] and fields[-1][4:] == entry[4:]:
+            entry = fields.pop()
+            entry = entry[:3] + (entry[3] + field.count,) + entry[4:]
+        fields.append(entry)
+    if padding:
+        fields.append(('pad', padding))
+    return tuple(fields)
+
+
+def report_fingerprint(report):
+    """
+    The fingerprint of a single :class:`hidtools.hid.HidReport`, a hex
+    string. Reports with the same fingerprint have the same report ID,
+    application and :func:`report_layout`, they are decoded the same way.
+    """
+    layout = (report.report_ID, report.application, report_layout(report))
+    return hashlib.sha256(repr(layout).encode('utf-8')).hexdigest()
+
+
+def _field_tokens(kind, report):
+    # one token per field, without the report ID and the position in the
+    # report so that a moved or renumbered report is still similar
+    app = f'{report.application:x}' if report.application is not None else '-'
+    yield f'{kind} app {app}'
+    for field in report_layout(report):
+        if field[0] == 'pad':
+            continue
+        _, usage, size, count, lmin, lmax, flags = field
+        if isinstance(usage, tuple):
+            usage = f'{usage[0]:x}-{usage[-1]:x}/{len(usage)}' if usage else '-'
+        else:
+            usage = f'{usage:x}'
+        yield f'{kind} {app} {usage} {size}x{count} {lmin}..{lmax} {flags:x}'
+
+
+class DescriptorFingerprint(object):
+    """
+    The structural fingerprint of a :class:`hidtools.hid.ReportDescriptor`.
+
+    .. attribute:: digest
+
+        A hex string identifying the layout of all reports, descriptors
+        with the same ``digest`` have the same reports
+
+    .. attribute:: reports
+
+        A dict of ``(report type, report ID)`` to the
+        :func:`report_fingerprint` of each report, the report type is
+        ``'input'``, ``'output'`` or ``'feature'``
+
+    .. attribute:: tokens
+
+        The frozenset of strings describing the fields, see
+        :meth:`similarity`
+    """
+    def __init__(self, digest, tokens, reports=None):
+        self.digest = digest
+        self.tokens = frozenset(tokens)
+        self.reports = reports or {}
+
+    @classmethod
+    def from_rdesc(cls, rdesc):
+        """
+        Compute the fingerprint of a
+        :class:`hidtools.hid.ReportDescriptor`.
+        """
+        reports = {}
+        tokens = set()
+        seen = {}
+        for kind, attribute in _REPORT_TYPES:
+            for report_id, report in sorted(getattr(rdesc, attribute).items()):
+                reports[(kind, report_id)] = report_fingerprint(report)
+                for token in _field_tokens(kind, report):
+                    # the same field repeated, e.g. one per touch
+                    n = seen.get(token, 0) + 1
+                    seen[token] = n
+                    tokens.add(f'{token} #{n}')
+
+        digest = hashlib.sha256(repr(sorted(reports.items())).encode('utf-8')).hexdigest()
+        return cls(digest, tokens, reports)
+
+    def similarity(self, other):
+        """
+        The Jaccard index of the :attr:`tokens` of both fingerprints,
+        1.0 for identical layouts and 0.0 for layouts without any field
+        in common.
+        """
+        if self.digest == other.digest:
+            return 1.0
+        union = len(self.tokens | other.tokens)
+        if not union:
+            return 0.0
+        return len(self.tokens & other.tokens) / union
+
+    def __eq__(self, other):
+        return isinstance(other, DescriptorFingerprint) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f'<DescriptorFingerprint {self.digest[:12]}: {len(self.reports)} reports, {len(self.tokens)} fields>'
+
+
+class SimilarityIndex(object):
+    """
+    An index of :class:`DescriptorFingerprint` to find the identical and
+    similar layouts in a corpus.
+
+    Each fingerprint gets a MinHash signature of ``permutations`` values,
+    split into ``bands``. Two fingerprints are candidates if all values of
+    at least one band match, which is likely for a similarity over
+    ``(1 / bands) ** (bands / permutations)``, about 0.5 with the
+    defaults. Candidates are then ranked by their exact similarity.
+
+    :param int permutations: the length of the signatures
+    :param int bands: the number of bands, must divide ``permutations``
+    """
+    def __init__(self, permutations=64, bands=16):
+        if permutations % bands:
+            raise ValueError('bands must divide permutations')
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self._functions = _minhash_functions(permutations)
+        self._entries = {}  # key -> (fingerprint, signature)
+        self._by_digest = {}
+        self._buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def signature(self, fingerprint):
+        """
+        The MinHash signature of a fingerprint as ``array('Q')``, e.g. to
+        store it and pass it to :meth:`add` later.
+        """
+        hashes = [_token_hash(t) for t in fingerprint.tokens]
+        if not hashes:
+            return array.array('Q', [_MASK] * self.permutations)
+        return array.array('Q', [min((a * h + b) % _PRIME for h in hashes)
+                                 for a, b in self._functions])
+
+    def _bands(self, signature):
+        rows = self.rows
+        for i in range(self.bands):
+            yield i, tuple(signature[i * rows:(i + 1) * rows])
+
+    def add(self, key, fingerprint, signature=None):
+        """
+        Add a fingerprint to the index.
+
+        :param key: any hashable identifying the descriptor, e.g. its
+            hash or a path, returned by :meth:`query`
+        :param DescriptorFingerprint fingerprint: the fingerprint
+        :param signature: the :meth:`signature` of the fingerprint, if
+            already known
+        """
+        if key in self._entries:
+            self.remove(key)
+        if signature is None:
+            signature = self.signature(fingerprint)
+        elif len(signature) != self.permutations:
+            raise ValueError(f'signature of {len(signature)} values, {self.permutations} expected')
+        self._entries[key] = (fingerprint, signature)
+        self._by_digest.setdefault(fingerprint.digest, set()).add(key)
+        for i, band in self._bands(signature):
+            self._buckets[i].setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        """
+        Remove the fingerprint added with ``key``.
+        """
+        fingerprint, signature = self._entries.pop(key)
+        self._by_digest[fingerprint.digest].discard(key)
+        for i, band in self._bands(signature):
+            self._buckets[i][band].discard(key)
+
+    def identical(self, fingerprint):
+        """
+        :returns: the set of keys with the same layout as ``fingerprint``
+        """
+        return set(self._by_digest.get(fingerprint.digest, ()))
+
+    def query(self, fingerprint, threshold=0.8, limit=None, signature=None):
+        """
+        Find the fingerprints similar to ``fingerprint``.
+
+        :param float threshold: the minimum similarity, see
+            :meth:`DescriptorFingerprint.similarity`
+        :param int limit: the maximum number of results
+        :param signature: the :meth:`signature` of the fingerprint, if
+            already known
+        :returns: a list of ``(similarity, key)`` tuples, most similar
+            first
+        """
+        if signature is None:
+            signature = self.signature(fingerprint)
+
+        candidates = self.identical(fingerprint)
+        for i, band in self._bands(signature):
+            candidates.update(self._buckets[i].get(band, ()))
+
+        results = []
+        for key in candidates:
+            similarity = fingerprint.similarity(self._entries[key][0])
+            if similarity >= threshold:
+                results.append((similarity, key))
+        results.sort(key=lambda r: (-r[0], str(r[1])))
+        return results[:limit] if limit is not None else results
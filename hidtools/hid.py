@@ -21,6 +21,7 @@
 import copy
 import sys
 from hidtools.hut import HUT
+from hidtools.instrumentation import timed
 from hidtools.util import twos_comp, to_twos_comp
 from parse import parse as _parse
 import logging
@@ -1148,6 +1149,60 @@ class HidReport(object):
 
         return r
 
+    def data_layout(self):
+        """
+        Return where :meth:`create_report` takes the value of each field
+        from, as a list of ``(index, attribute, field)`` tuples, one for
+        each non-const :class:`HidField`. ``index`` is the index of the
+        data object in the ``data`` list and ``attribute`` the attribute
+        name (e.g. ``'x'`` or ``'b1'``). Where the data object does not
+        exist or does not have the attribute, the value is taken from
+        ``global_data``, or is 0.
+
+        The layout only depends on the report descriptor, so it allows
+        encoding many reports without going through
+        :meth:`create_report` for each.
+        """
+        self.prev_seen_usages = []
+        self.prev_collection = None
+        layout = []
+        index = 0
+
+        for item in self:
+            if item.is_const:
+                continue
+
+            usage = self._fix_xy_usage_for_mt_devices(item.usage_name)
+            if (self.prev_collection is not None and
+               self.prev_collection != item.collection and
+               usage in self.prev_seen_usages):
+                # create_report() moves on to the next data object here
+                index += 1
+                self.prev_seen_usages.clear()
+
+            layout.append((index, usage.replace(' ', '').lower(), item))
+            self.prev_collection = item.collection
+            self.prev_seen_usages.append(usage)
+
+        return layout
+
+    def fields_by_attribute(self):
+        """
+        Return the fields that :meth:`create_report` fills from the
+        attributes of the first data object, as a dict of attribute name
+        (e.g. ``'x'`` or ``'b1'``) to a list of :class:`HidField`.
+
+        This allows updating a report created with :meth:`create_report`
+        in place with :meth:`HidField.fill_values` when only some values
+        change.
+        """
+        fields = {}
+        for index, attribute, field in self.data_layout():
+            if index == 0:
+                fields.setdefault(attribute, []).append(field)
+        return fields
+
+    @timed('report.format_report', lambda args, r: len(args[1]))
     def format_report(self, data, split_lines=True):
         """
         Format the HID Report provided as a list of 8-bit integers into a
@@ -1335,6 +1390,7 @@ class ReportDescriptor(object):
         del self.current_report
         del self.collection
 
+    @timed('rdesc.get')
     def get(self, reportID, reportSize):
         """
         Return the input report with the given Report ID or ``None``
@@ -1651,6 +1707,7 @@ class ReportDescriptor(object):
 
         return rdesc.create_report(data, global_data)
 
+    @timed('rdesc.format_report', lambda args, r: len(args[1]))
     def format_report(self, data, split_lines=True):
         """
         Format the HID Report provided as a list of 8-bit integers into a
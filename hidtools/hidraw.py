@@ -18,13 +18,24 @@
 #
 
 import array
+import collections
 import datetime
 import fcntl
 import io
 import os
+import statistics
 import struct
 import sys
 from hidtools.hid import ReportDescriptor
+from hidtools.instrumentation import timed
+
+# The number of reports the kernel queues for each reader of a hidraw
+# node (drivers/hid/hidraw.c). The ring buffer keeps one slot empty, once
+# HIDRAW_BUFFER_SIZE - 1 reports are pending new reports are discarded.
+HIDRAW_BUFFER_SIZE = 64
+
+# the size of the buffer passed to os.read()
+READ_SIZE = 4096
 
 
 def _ioctl(fd, EVIOC, code, return_type, buf=None):
@@ -146,6 +157,225 @@ class HidrawEvent(object):
         self.bytes = bytes
 
 
+class Overrun(object):
+    """
+    A likely loss of reports, as detected by :class:`OverrunDetector`.
+
+    .. attribute:: timestamp
+
+        The time the overrun was detected, in seconds
+
+    .. attribute:: kind
+
+        One of ``'queue-full'`` (the kernel queue was full, reports were
+        discarded), ``'high-watermark'`` (the kernel queue was almost
+        full, nothing was lost yet), ``'truncated'`` (a report was larger
+        than the read buffer) or ``'dropped'`` (the reports were read but
+        dropped by the reader itself)
+
+    .. attribute:: depth
+
+        The number of reports pending when reading, ``None`` where not
+        applicable
+
+    .. attribute:: lost
+
+        The estimated number of reports lost, ``None`` if unknown
+    """
+    def __init__(self, timestamp, kind, depth=None, lost=None):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.depth = depth
+        self.lost = lost
+
+    @property
+    def is_loss(self):
+        """
+        True if reports were (likely) lost, False for a mere warning
+        """
+        return self.kind != 'high-watermark'
+
+    def __str__(self):
+        capacity = HIDRAW_BUFFER_SIZE - 1
+        lost = f', ~{self.lost} reports lost' if self.lost else ''
+        if self.kind == 'queue-full':
+            return f'kernel queue full ({self.depth}/{capacity} reports pending){lost}'
+        elif self.kind == 'high-watermark':
+            return f'kernel queue almost full ({self.depth}/{capacity} reports pending)'
+        elif self.kind == 'truncated':
+            return f'report truncated to {READ_SIZE} bytes'
+        else:
+            return f'{self.lost} reports dropped by the reader'
+
+
+class OverrunDetector(object):
+    """
+    Detects when a reader of a hidraw node falls behind the device and
+    reports are likely lost. The kernel queues at most
+    ``HIDRAW_BUFFER_SIZE - 1`` reports per reader and silently discards
+    new reports once that queue is full, the reader has to infer the
+    losses from what it reads.
+
+    The reader calls :meth:`update` each time it drained the node, with
+    the number of reports that were pending. A full queue means reports
+    were discarded, the number of lost reports is estimated from the
+    time since the previous read and the nominal interval of the device.
+    The nominal interval is the median of the recent intervals between
+    reports that were read one at a time, i.e. while the reader kept up.
+
+    :param int capacity: the number of reports the kernel queues
+    :param float high_watermark: the fraction of ``capacity`` from which
+        a pending queue is reported as ``'high-watermark'``
+    :param int window: the number of intervals the nominal interval is
+        computed from
+
+    .. attribute:: reads
+
+        The number of times the node was drained
+
+    .. attribute:: reports
+
+        The number of reports read
+
+    .. attribute:: max_depth
+
+        The highest number of reports pending at once
+
+    .. attribute:: max_gap
+
+        The longest interval between two reads in seconds
+
+    .. attribute:: gaps
+
+        The number of intervals between two reads longer than four times
+        the nominal interval. These are idle periods of the device or
+        losses before the reports reach hidraw, they are not counted as
+        overruns.
+
+    .. attribute:: counts
+
+        A dict of :attr:`Overrun.kind` to the number of such overruns
+
+    .. attribute:: lost
+
+        The estimated number of reports lost in total
+    """
+    GAP_FACTOR = 4
+    MIN_SAMPLES = 8
+
+    def __init__(self, capacity=HIDRAW_BUFFER_SIZE - 1, high_watermark=0.75, window=256):
+        self.capacity = capacity
+        self.high_watermark = max(2, int(capacity * high_watermark))
+        self.reads = 0
+        self.reports = 0
+        self.max_depth = 0
+        self.max_gap = 0.0
+        self.gaps = 0
+        self.counts = {}
+        self.lost = 0
+        self._intervals = collections.deque(maxlen=window)
+        self._last = None
+
+    @property
+    def nominal_interval(self):
+        """
+        The nominal interval between two reports of the device in seconds,
+        ``None`` until enough reports have been read
+        """
+        if len(self._intervals) < OverrunDetector.MIN_SAMPLES:
+            return None
+        return statistics.median(self._intervals)
+
+    @property
+    def overruns(self):
+        """
+        The number of overruns where reports were (likely) lost
+        """
+        return sum(n for kind, n in self.counts.items() if kind != 'high-watermark')
+
+    def _add(self, overrun):
+        self.counts[overrun.kind] = self.counts.get(overrun.kind, 0) + 1
+        if overrun.is_loss:
+            self.lost += overrun.lost or 0
+        return overrun
+
+    def update(self, timestamp, depth, truncated=0):
+        """
+        Account for one read of the node.
+
+        :param float timestamp: the time of the read in seconds, on the
+            same clock as the timestamps of the recorded events
+        :param int depth: the number of reports read before the node had
+            no more data
+        :param int truncated: the number of reports that filled the whole
+            read buffer
+        :returns: a list of :class:`Overrun`, usually empty
+        """
+        result = []
+        gap = timestamp - self._last if self._last is not None else None
+        interval = self.nominal_interval
+
+        self.reads += 1
+        self.reports += depth
+        self.max_depth = max(self.max_depth, depth)
+
+        if gap is not None:
+            self.max_gap = max(self.max_gap, gap)
+            if depth == 1 and gap > 0:
+                self._intervals.append(gap)
+            if interval and gap > interval * OverrunDetector.GAP_FACTOR:
+                self.gaps += 1
+
+        if depth >= self.capacity:
+            lost = None
+            if interval and gap is not None:
+                # we read everything that was pending at the previous
+                # read, anything the device sent since that did not fit
+                # in the queue is gone
+                lost = max(0, round(gap / interval) - depth) or None
+            result.append(self._add(Overrun(timestamp, 'queue-full', depth, lost)))
+        elif depth >= self.high_watermark:
+            result.append(self._add(Overrun(timestamp, 'high-watermark', depth)))
+
+        if truncated:
+            result.append(self._add(Overrun(timestamp, 'truncated', depth, truncated)))
+
+        self._last = timestamp
+        return result
+
+    def dropped(self, timestamp, count):
+        """
+        Account for ``count`` reports that were read but dropped by the
+        reader, e.g. because its own queue was full.
+
+        :returns: the :class:`Overrun`
+        """
+        return self._add(Overrun(timestamp, 'dropped', None, count))
+
+    def summary(self):
+        """
+        A one-line summary of the reads and overruns
+        """
+        interval = self.nominal_interval
+        rate = f' at ~{1 / interval:.0f}Hz' if interval else ''
+        details = [f'{self.reports} reports{rate}',
+                   f'max queue depth {self.max_depth}/{self.capacity}',
+                   f'max gap {self.max_gap * 1000:.1f}ms']
+        if self.gaps:
+            details.append(f'{self.gaps} gaps over {OverrunDetector.GAP_FACTOR}x the nominal interval')
+        if self.overruns:
+            kinds = ', '.join(f'{n} {kind}' for kind, n in sorted(self.counts.items())
+                              if kind != 'high-watermark')
+            lost = f', ~{self.lost} reports lost' if self.lost else ''
+            details.append(f'{self.overruns} overruns ({kinds}){lost}')
+        else:
+            details.append('no overruns')
+        warnings = self.counts.get('high-watermark', 0)
+        if warnings:
+            details.append(f'{warnings} times near full')
+        return ', '.join(details)
+
+
 class HidrawDevice(object):
     """
     A device as exposed by the kernel ``hidraw`` module. ``hidraw`` allows
@@ -220,18 +450,33 @@ class HidrawDevice(object):
         either make sure the device is set nonblocking or to handle any
         :class:`KeyboardInterrupt` if this call does end up blocking.
 
+        If the device is nonblocking, all pending reports are read.
+
         :returns: a tuple of ``(index, count)`` of the :attr:`events` added.
         """
 
         index = max(0, len(self.events) - 1)
+        self.events.extend(self._read_events())
+        count = len(self.events) - index
+
+        return index, count
+
+    @timed('hidraw.read_events', lambda args, r: sum(len(e.bytes) for e in r))
+    def _read_events(self):
+        events = []
+        fd = self.device.fileno()
+        drain = not os.get_blocking(fd)
 
         loop = True
         while loop:
-            data = os.read(self.device.fileno(), 4096)
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                break
             if not data:
                 break
-            if len(data) < 4096:
-                loop = False
+            if len(data) < READ_SIZE:
+                loop = drain
 
             now = datetime.datetime.now()
             if self.time_offset is None:
@@ -239,16 +484,27 @@ class HidrawDevice(object):
             tdelta = now - self.time_offset
             bytes = struct.unpack('B' * len(data), data)
 
-            self.events.append(HidrawEvent(tdelta.seconds, tdelta.microseconds, bytes))
-
-        count = len(self.events) - index
-
-        return index, count
+            events.append(HidrawEvent(tdelta.seconds, tdelta.microseconds, bytes))
 
-    def _dump_event(self, event, file):
-        report_id = event.bytes[0]
+        return events
 
-        rdesc = self.report_descriptor.get(report_id, len(event.bytes))
+    @timed('hidraw.format_event', lambda args, r: len(args[1].bytes))
+    def format_event(self, event, annotate=True):
+        """
+        Format the given event in the recording format, i.e. the ``E:``
+        line preceded by the human-readable version of the report as
+        comment (if the report can be found in the report descriptor).
+
+        :param HidrawEvent event: the event to format
+        :param bool annotate: if False, skip the human-readable comment
+            and only format the ``E:`` line
+        :returns: the formatted string, terminated by a newline
+        """
+        lines = []
+        rdesc = None
+        if annotate:
+            report_id = event.bytes[0]
+            rdesc = self.report_descriptor.get(report_id, len(event.bytes))
         if rdesc is not None:
             indent_2nd_line = 2
             output = rdesc.format_report(event.bytes)
@@ -267,11 +523,16 @@ class HidrawDevice(object):
                     indent_2nd_line = slash + 1
             indent = f'\n#{" " * indent_2nd_line}'
             output = indent.join(output.split('\n'))
-            print(f'# {output}', file=file)
+            lines.append(f'# {output}\n')
 
         data = map(lambda x: f'{x:02x}', event.bytes)
-        print(f'E: {event.sec:06d}.{event.usec:06d} {len(event.bytes)} {" ".join(data)}', file=file, flush=True)
+        lines.append(f'E: {event.sec:06d}.{event.usec:06d} {len(event.bytes)} {" ".join(data)}\n')
+        return ''.join(lines)
+
+    def _dump_event(self, event, file):
+        print(self.format_event(event), end='', file=file, flush=True)
 
+    @timed('hidraw.dump')
     def dump(self, file=sys.stdout, from_the_beginning=False):
         """
         Format this device in a file format in the form of ::
@@ -0,0 +1,542 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''
+A SQLite index of recordings in the ``hid-recorder`` format, to find
+recordings by device or by the applications and usages of their report
+descriptors without parsing the recordings again::
+
+    with RecordingIndex('recordings.sqlite') as index:
+        index.add('touchpad.hid')
+        for device in index.find_devices(application='Touch Pad'):
+            print(device['path'], device['name'])
+
+Report descriptors are stored once, identified by the SHA-256 of their
+bytes, together with their structural fingerprint (see
+:mod:`hidtools.fingerprint`) to find descriptors with the same or a
+similar layout. The events themselves are only stored if requested, as one
+compressed blob per device, see :meth:`RecordingIndex.iter_events`.
+'''
+
+import array
+import hashlib
+import os
+import sqlite3
+import struct
+import time
+import zlib
+
+import hidtools.hid
+from hidtools.fingerprint import DescriptorFingerprint, SimilarityIndex
+from hidtools.hut import HUT
+from hidtools.recording import open_recording
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS descriptors (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS applications (
+    descriptor_id INTEGER NOT NULL REFERENCES descriptors(id) ON DELETE CASCADE,
+    report_type TEXT NOT NULL,
+    report_id INTEGER NOT NULL,
+    usage INTEGER,
+    usage_page TEXT,
+    name TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS applications_name ON applications(name);
+CREATE TABLE IF NOT EXISTS usages (
+    descriptor_id INTEGER NOT NULL REFERENCES descriptors(id) ON DELETE CASCADE,
+    usage INTEGER NOT NULL,
+    usage_page TEXT,
+    name TEXT COLLATE NOCASE,
+    UNIQUE (descriptor_id, usage)
+);
+CREATE INDEX IF NOT EXISTS usages_name ON usages(name);
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    added REAL NOT NULL,
+    events INTEGER NOT NULL,
+    first_timestamp REAL,
+    last_timestamp REAL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    recording_id INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    device_index INTEGER NOT NULL,
+    name TEXT,
+    phys TEXT,
+    bus INTEGER,
+    vid INTEGER,
+    pid INTEGER,
+    descriptor_id INTEGER REFERENCES descriptors(id),
+    events INTEGER NOT NULL,
+    first_timestamp REAL,
+    last_timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS devices_recording ON devices(recording_id);
+CREATE INDEX IF NOT EXISTS devices_descriptor ON devices(descriptor_id);
+CREATE INDEX IF NOT EXISTS devices_ids ON devices(vid, pid);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    descriptor_id INTEGER PRIMARY KEY REFERENCES descriptors(id) ON DELETE CASCADE,
+    digest TEXT NOT NULL,
+    tokens BLOB NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_digest ON fingerprints(digest);
+CREATE TABLE IF NOT EXISTS events (
+    device_id INTEGER PRIMARY KEY REFERENCES devices(id) ON DELETE CASCADE,
+    data BLOB NOT NULL
+);
+'''
+
+# one stored event: the timestamp in microseconds and the report length,
+# followed by the report
+_EVENT_HEADER = struct.Struct('<qH')
+
+_REPORT_TYPES = (('input', 'input_reports'), ('output', 'output_reports'), ('feature', 'feature_reports'))
+
+
+class RecordingIndexError(Exception):
+    """
+    An exception raised when the index cannot be used, e.g. because it
+    was created by a newer version.
+    """
+    pass
+
+
+def descriptor_hash(rdesc):
+    """
+    The hash identifying a report descriptor in the index: the SHA-256 of
+    its bytes, as hex string.
+
+    :param rdesc: the report descriptor bytes, a list of ints or
+        ``bytes``
+    """
+    return hashlib.sha256(bytes(rdesc)).hexdigest()
+
+
+def _usage_names(usage):
+    page = usage >> 16
+    try:
+        page_name = HUT[page].page_name
+    except KeyError:
+        return None, None
+    try:
+        return page_name, HUT[page][usage & 0xffff].name
+    except KeyError:
+        return page_name, None
+
+
+class _DeviceInfo(object):
+    # what a recording tells about one device
+    def __init__(self, index, store_events):
+        self.index = index
+        self.name = None
+        self.phys = None
+        self.bus = self.vid = self.pid = None
+        self.rdesc = None
+        self.events = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._compressor = zlib.compressobj(9) if store_events else None
+        self._blob = []
+
+    def add_event(self, line):
+        _, timestamp, size, data = line.split(' ', 3)
+        # sec.usec, avoid going through floats for the stored timestamp
+        sec, usec = timestamp.split('.')
+        usec = int(sec) * 1000000 + int(usec)
+        if self.first_timestamp is None:
+            self.first_timestamp = usec
+        self.last_timestamp = usec
+        self.events += 1
+        if self._compressor is not None:
+            report = bytes.fromhex(data)
+            self._blob.append(self._compressor.compress(_EVENT_HEADER.pack(usec, len(report)) + report))
+
+    @property
+    def blob(self):
+        if self._compressor is None or not self.events:
+            return None
+        return b''.join(self._blob) + self._compressor.flush()
+
+
+class RecordingIndex(object):
+    """
+    A SQLite database of recordings, the devices they contain and their
+    report descriptors.
+
+    The tables are:
+
+    - ``recordings``: one row per recording file, with its ``path``,
+      ``size``, ``mtime``, total number of ``events`` and the
+      ``first_timestamp`` and ``last_timestamp`` of its events
+    - ``devices``: one row per device of a recording, with its ``name``,
+      ``phys``, ``bus``, ``vid``, ``pid``, ``descriptor_id`` and its own
+      event count and time range
+    - ``descriptors``: the deduplicated report descriptors, with their
+      ``hash`` (see :func:`descriptor_hash`) and bytes
+    - ``applications``: the application collection of every report of a
+      descriptor, with the ``report_type`` (``'input'``, ``'output'`` or
+      ``'feature'``), the ``report_id``, the numerical ``usage`` and the
+      ``usage_page`` and ``name``, e.g. ``'Digitizers'`` and
+      ``'Touch Pad'``
+    - ``usages``: the distinct usages of the fields of a descriptor
+    - ``fingerprints``: the :class:`hidtools.fingerprint.DescriptorFingerprint`
+      of each descriptor that could be parsed, with its layout ``digest``
+    - ``events``: the events of a device if stored, see
+      :meth:`iter_events`
+
+    The connection is available as :attr:`db` for any other query.
+
+    :param str path: the database file, created if needed
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA foreign_keys = ON')
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            self.db.close()
+            raise RecordingIndexError(f'{path} uses schema version {version}, only {SCHEMA_VERSION} is supported')
+        with self.db:
+            self.db.executescript(_SCHEMA)
+            self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        self._descriptor_ids = {}
+        self._similarity = None
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details):
+        self.close()
+
+    def _add_descriptor(self, rdesc):
+        digest = descriptor_hash(rdesc)
+        try:
+            return self._descriptor_ids[digest]
+        except KeyError:
+            pass
+
+        row = self.db.execute('SELECT id FROM descriptors WHERE hash = ?', (digest,)).fetchone()
+        if row is not None:
+            self._descriptor_ids[digest] = row[0]
+            return row[0]
+
+        cursor = self.db.execute('INSERT INTO descriptors (hash, size, data) VALUES (?, ?, ?)',
+                                 (digest, len(rdesc), bytes(rdesc)))
+        descriptor_id = cursor.lastrowid
+
+        try:
+            parsed = hidtools.hid.ReportDescriptor.from_bytes(list(rdesc))
+        except Exception:
+            # keep the descriptor, it just can't be searched by usage
+            parsed = None
+
+        if parsed is not None:
+            applications = []
+            usages = {}
+            for report_type, attribute in _REPORT_TYPES:
+                for report_id, report in getattr(parsed, attribute).items():
+                    page, name = (None, None)
+                    if report.application is not None:
+                        page, name = _usage_names(report.application)
+                    applications.append((descriptor_id, report_type, report_id, report.application, page, name))
+                    for field in report:
+                        for usage in field.usages or [field.usage]:
+                            if usage not in usages and usage is not None:
+                                usages[usage] = _usage_names(usage)
+            self.db.executemany('INSERT INTO applications VALUES (?, ?, ?, ?, ?, ?)', applications)
+            self.db.executemany('INSERT INTO usages VALUES (?, ?, ?, ?)',
+                                ((descriptor_id, usage, page, name) for usage, (page, name) in usages.items()))
+            self._add_fingerprint(descriptor_id, parsed)
+
+        # add() restores the cache if the transaction is rolled back
+        self._descriptor_ids[digest] = descriptor_id
+        return descriptor_id
+
+    def _parse_recording(self, path, store_events):
+        devices = {}
+        index = 0
+        with open_recording(path) as f:
+            for line in f:
+                tag = line[:2]
+                if tag == 'E:':
+                    try:
+                        device = devices[index]
+                    except KeyError:
+                        device = devices.setdefault(index, _DeviceInfo(index, store_events))
+                    device.add_event(line)
+                    continue
+                elif tag == 'D:':
+                    index = int(line[2:])
+                    continue
+
+                if tag not in ('N:', 'P:', 'I:', 'R:'):
+                    continue
+                try:
+                    device = devices[index]
+                except KeyError:
+                    device = devices.setdefault(index, _DeviceInfo(index, store_events))
+                value = line[3:].rstrip('\n')
+                if tag == 'N:':
+                    device.name = value
+                elif tag == 'P:':
+                    device.phys = value
+                elif tag == 'I:':
+                    bus, vid, pid = (int(v, 16) for v in value.split()[:3])
+                    device.bus, device.vid, device.pid = bus, vid, pid
+                elif tag == 'R:':
+                    size, data = value.split(' ', 1)
+                    device.rdesc = bytes.fromhex(data)
+                    if len(device.rdesc) != int(size):
+                        raise ValueError(f'{path}: report descriptor length mismatch')
+        return sorted(devices.values(), key=lambda d: d.index)
+
+    def add(self, path, store_events=False, force=False):
+        """
+        Add a recording to the index. A recording already in the index is
+        only added again if its size or modification time changed, or if
+        ``force`` is True.
+
+        :param str path: the recording, optionally compressed (see
+            :func:`hidtools.recording.open_recording`)
+        :param bool store_events: if True, also store the events
+        :returns: the id of the recording in the ``recordings`` table, or
+            ``None`` if it was already indexed
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute('SELECT id, size, mtime FROM recordings WHERE path = ?', (path,)).fetchone()
+        if row is not None and not force and row['size'] == st.st_size and row['mtime'] == st.st_mtime:
+            return None
+
+        devices = self._parse_recording(path, store_events)
+
+        def seconds(usec):
+            return usec / 1000000 if usec is not None else None
+
+        timestamps = [t for d in devices for t in (d.first_timestamp, d.last_timestamp) if t is not None]
+        first = min(timestamps) if timestamps else None
+        last = max(timestamps) if timestamps else None
+
+        known = dict(self._descriptor_ids)
+        try:
+            with self.db:
+                if row is not None:
+                    self.db.execute('DELETE FROM recordings WHERE id = ?', (row['id'],))
+                cursor = self.db.execute(
+                    'INSERT INTO recordings (path, size, mtime, added, events, first_timestamp, last_timestamp) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (path, st.st_size, st.st_mtime, time.time(), sum(d.events for d in devices),
+                     seconds(first), seconds(last)))
+                recording_id = cursor.lastrowid
+
+                for d in devices:
+                    descriptor_id = self._add_descriptor(d.rdesc) if d.rdesc is not None else None
+                    cursor = self.db.execute(
+                        'INSERT INTO devices (recording_id, device_index, name, phys, bus, vid, pid, '
+                        'descriptor_id, events, first_timestamp, last_timestamp) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (recording_id, d.index, d.name, d.phys, d.bus, d.vid, d.pid, descriptor_id,
+                         d.events, seconds(d.first_timestamp), seconds(d.last_timestamp)))
+                    blob = d.blob
+                    if blob is not None:
+                        self.db.execute('INSERT INTO events VALUES (?, ?)', (cursor.lastrowid, blob))
+        except BaseException:
+            # the descriptors added in the rolled back transaction are gone
+            self._descriptor_ids = known
+            self._similarity = None
+            raise
+
+        return recording_id
+
+    def _add_fingerprint(self, descriptor_id, rdesc):
+        fingerprint = DescriptorFingerprint.from_rdesc(rdesc)
+        index = self._similarity if self._similarity is not None else SimilarityIndex()
+        signature = index.signature(fingerprint)
+        tokens = zlib.compress('\n'.join(sorted(fingerprint.tokens)).encode('utf-8'))
+        self.db.execute('INSERT INTO fingerprints VALUES (?, ?, ?, ?)',
+                        (descriptor_id, fingerprint.digest, tokens, signature.tobytes()))
+        if self._similarity is not None:
+            self._similarity.add(descriptor_id, fingerprint, signature)
+
+    def _load_fingerprint(self, row):
+        tokens = zlib.decompress(row['tokens']).decode('utf-8').split('\n')
+        return DescriptorFingerprint(row['digest'], tokens), array.array('Q', row['signature'])
+
+    def _similarity_index(self):
+        if self._similarity is not None:
+            return self._similarity
+
+        index = SimilarityIndex()
+        for row in self.db.execute('SELECT * FROM fingerprints'):
+            fingerprint, signature = self._load_fingerprint(row)
+            if len(signature) != index.permutations:
+                signature = None
+            index.add(row['descriptor_id'], fingerprint, signature)
+        self._similarity = index
+        return index
+
+    def fingerprint(self, descriptor):
+        """
+        The fingerprint of a descriptor in the index.
+
+        :param str descriptor: the hash of the descriptor or a unique
+            prefix of it
+        :returns: the :class:`hidtools.fingerprint.DescriptorFingerprint`
+            or ``None`` if the descriptor is unknown or could not be parsed
+        """
+        rows = self.db.execute('SELECT f.* FROM fingerprints f JOIN descriptors s ON f.descriptor_id = s.id '
+                               'WHERE s.hash LIKE ? LIMIT 2', (f'{descriptor}%',)).fetchall()
+        if len(rows) != 1:
+            return None
+        return self._load_fingerprint(rows[0])[0]
+
+    def similar_descriptors(self, fingerprint, threshold=0.8, limit=None):
+        """
+        Find the descriptors with a layout similar to ``fingerprint``,
+        see :class:`hidtools.fingerprint.SimilarityIndex`.
+
+        :param DescriptorFingerprint fingerprint: the fingerprint to
+            compare to, see :meth:`fingerprint` for a descriptor in the
+            index
+        :param float threshold: the minimum similarity
+        :param int limit: the maximum number of results
+        :returns: a list of ``(similarity, row)`` tuples, most similar
+            first. ``row`` is a :class:`sqlite3.Row` with the ``id`` and
+            ``hash`` of the descriptor, its layout ``digest`` and the
+            number of ``devices`` using it.
+        """
+        results = []
+        for similarity, descriptor_id in self._similarity_index().query(fingerprint, threshold, limit):
+            row = self.db.execute('SELECT s.id, s.hash, f.digest, '
+                                  '(SELECT COUNT(*) FROM devices WHERE descriptor_id = s.id) AS devices '
+                                  'FROM descriptors s JOIN fingerprints f ON f.descriptor_id = s.id '
+                                  'WHERE s.id = ?', (descriptor_id,)).fetchone()
+            results.append((similarity, row))
+        return results
+
+    def remove(self, path):
+        """
+        Remove a recording from the index. The descriptors are kept.
+        """
+        with self.db:
+            self.db.execute('DELETE FROM recordings WHERE path = ?', (os.path.abspath(path),))
+
+    def find_devices(self, application=None, usage=None, name=None, vid=None, pid=None, descriptor=None,
+                     layout=None):
+        """
+        Find the devices of the recordings in the index. All given
+        criteria must match.
+
+        :param str application: the name of an application collection of
+            the device, e.g. ``'Touch Pad'``, optionally preceded by the
+            usage page, e.g. ``'Digitizers Touch Pad'``, case-insensitive
+        :param str usage: the name of a usage of any field of the device,
+            e.g. ``'Contact Count'``, optionally preceded by the usage page
+        :param str name: a pattern for the device name, with the
+            ``*`` and ``?`` wildcards (see SQLite's ``GLOB``)
+        :param int vid: the vendor ID
+        :param int pid: the product ID
+        :param str descriptor: the hash of the report descriptor, or a
+            prefix of it
+        :param str layout: the
+            :attr:`hidtools.fingerprint.DescriptorFingerprint.digest` of the
+            report descriptor, or a prefix of it
+        :returns: a list of :class:`sqlite3.Row` with the columns of the
+            ``devices`` table, the ``path`` of the recording and the
+            ``hash`` of the descriptor
+        """
+        conditions = []
+        params = []
+        for table, value in (('applications', application), ('usages', usage)):
+            if value is not None:
+                conditions.append(f'd.descriptor_id IN (SELECT descriptor_id FROM {table} '
+                                  f'WHERE name = ? OR usage_page || \' \' || name = ? COLLATE NOCASE)')
+                params += [value, value]
+        if name is not None:
+            conditions.append('d.name GLOB ?')
+            params.append(name)
+        if vid is not None:
+            conditions.append('d.vid = ?')
+            params.append(vid)
+        if pid is not None:
+            conditions.append('d.pid = ?')
+            params.append(pid)
+        if descriptor is not None:
+            conditions.append('s.hash LIKE ?')
+            params.append(f'{descriptor}%')
+        if layout is not None:
+            conditions.append('d.descriptor_id IN (SELECT descriptor_id FROM fingerprints WHERE digest LIKE ?)')
+            params.append(f'{layout}%')
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        query = ('SELECT d.*, r.path, s.hash FROM devices d '
+                 'JOIN recordings r ON d.recording_id = r.id '
+                 'LEFT JOIN descriptors s ON d.descriptor_id = s.id '
+                 f'{where} ORDER BY r.path, d.device_index')
+        return self.db.execute(query, params).fetchall()
+
+    def iter_events(self, device_id):
+        """
+        Iterate over the stored events of a device.
+
+        :param int device_id: the id of the device in the ``devices``
+            table
+        :returns: an iterator of ``(timestamp, report)`` tuples with the
+            timestamp in seconds and the report as ``bytes``, empty if
+            the events were not stored
+        """
+        row = self.db.execute('SELECT data FROM events WHERE device_id = ?', (device_id,)).fetchone()
+        if row is None:
+            return
+        data = zlib.decompress(row[0])
+        offset = 0
+        header_size = _EVENT_HEADER.size
+        while offset < len(data):
+            usec, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += header_size
+            yield usec / 1000000, data[offset:offset + length]
+            offset += length
+
+    def stats(self):
+        """
+        :returns: a dict with the number of ``recordings``, ``devices``,
+            ``descriptors`` and ``events`` in the index
+        """
+        result = {}
+        for table in ('recordings', 'devices', 'descriptors'):
+            result[table] = self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        result['events'] = self.db.execute('SELECT COALESCE(SUM(events), 0) FROM recordings').fetchone()[0]
+        return result
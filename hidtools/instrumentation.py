@@ -0,0 +1,283 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''
+Opt-in counters and timings for the hot paths of hidtools.
+
+The functions decorated with :func:`timed` count their calls, the bytes
+they handle and how long they take, per stage. Nothing is recorded until
+:func:`enable` is called, a disabled stage only costs a function call and
+a flag check::
+
+    import hidtools.instrumentation as instrumentation
+
+    instrumentation.enable()
+    ...
+    for name, stats in instrumentation.snapshot().items():
+        print(name, stats['count'], stats['p99_us'])
+    print(instrumentation.summary_line())
+
+The durations are kept in a histogram of power-of-two buckets of
+microseconds, so the percentiles are upper bounds.
+'''
+
+import functools
+import sys
+import threading
+import time
+
+# checked by every instrumented call, see enable()
+_enabled = False
+_stages = {}
+_stages_lock = threading.Lock()
+
+# buckets[i] counts the durations of less than 2**i microseconds, and at
+# least 2**(i-1) microseconds for i > 0
+_BUCKETS = 32
+
+
+class Stage(object):
+    '''
+    The counters of one stage.
+
+    .. attribute:: name
+
+        The stage name, e.g. ``'hidraw.read_events'``
+
+    .. attribute:: count
+
+        The number of calls
+
+    .. attribute:: bytes
+
+        The number of bytes handled
+
+    .. attribute:: total
+
+        The total duration in seconds
+
+    .. attribute:: max
+
+        The longest duration in seconds
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.bytes = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.buckets = [0] * _BUCKETS
+
+    def add(self, elapsed, nbytes=0):
+        '''Record one call of ``elapsed`` seconds handling ``nbytes``.'''
+        bucket = min(int(elapsed * 1000000).bit_length(), _BUCKETS - 1)
+        with self._lock:
+            self.count += 1
+            self.bytes += nbytes
+            self.total += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+            self.buckets[bucket] += 1
+
+    def snapshot(self):
+        '''
+        The counters as a dict of ``count``, ``bytes``, ``total`` (in
+        seconds), ``mean_us``, ``max_us``, ``p50_us``, ``p90_us``,
+        ``p99_us`` and ``buckets``.
+        '''
+        with self._lock:
+            count, nbytes, total, maximum = self.count, self.bytes, self.total, self.max
+            buckets = list(self.buckets)
+
+        return {
+            'count': count,
+            'bytes': nbytes,
+            'total': total,
+            'mean_us': total / count * 1000000 if count else 0.0,
+            'max_us': maximum * 1000000,
+            'p50_us': _percentile(buckets, count, 50),
+            'p90_us': _percentile(buckets, count, 90),
+            'p99_us': _percentile(buckets, count, 99),
+            'buckets': buckets,
+        }
+
+
+def _percentile(buckets, count, p):
+    threshold = count * p / 100
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if n and seen >= threshold:
+            return 1 << i
+    return 0
+
+
+def stage(name):
+    '''Return the :class:`Stage` with the given name, creating it if
+    needed.'''
+    try:
+        return _stages[name]
+    except KeyError:
+        with _stages_lock:
+            return _stages.setdefault(name, Stage(name))
+
+
+def timed(name, size=None):
+    '''
+    Decorator recording the calls of a function in the stage ``name``
+    while the instrumentation is enabled.
+
+    :param str name: the stage name
+    :param size: a callable taking the arguments tuple and the return
+        value of the function and returning the number of bytes handled
+    '''
+    s = stage(name)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            s.add(elapsed, size(args, result) if size is not None else 0)
+            return result
+        return wrapper
+    return decorator
+
+
+def enable():
+    '''Start recording.'''
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    '''Stop recording, the counters are kept.'''
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    '''Reset the counters of all stages.'''
+    for s in list(_stages.values()):
+        s.reset()
+
+
+def snapshot():
+    '''
+    The counters of all stages that were called at least once, as a dict
+    of stage name to :meth:`Stage.snapshot`.
+    '''
+    result = {}
+    for name, s in sorted(_stages.items()):
+        snap = s.snapshot()
+        if snap['count']:
+            result[name] = snap
+    return result
+
+
+def _format_bytes(n):
+    for unit in ['B', 'K', 'M']:
+        if n < 1024:
+            return f'{n:.0f}{unit}'
+        n /= 1024
+    return f'{n:.1f}G'
+
+
+def summary_line(current=None, previous=None, interval=None):
+    '''
+    Format a snapshot in a single line, one ``name: ...`` entry per
+    stage with the number of calls, the bytes, the mean and the p99
+    duration.
+
+    If ``previous`` and ``interval`` are given, the calls and bytes are
+    those since the ``previous`` snapshot, per second, and the mean and
+    p99 are those of the calls since the ``previous`` snapshot.
+
+    :param dict current: a snapshot, defaults to :func:`snapshot`
+    :param dict previous: an earlier snapshot
+    :param float interval: the seconds between both snapshots
+    '''
+    if current is None:
+        current = snapshot()
+
+    entries = []
+    for name, s in current.items():
+        count, nbytes, total, buckets = s['count'], s['bytes'], s['total'], s['buckets']
+        if previous is not None and name in previous:
+            count -= previous[name]['count']
+            nbytes -= previous[name]['bytes']
+            total -= previous[name]['total']
+            buckets = [n - p for n, p in zip(buckets, previous[name]['buckets'])]
+        if not count:
+            continue
+
+        mean = total / count * 1000000
+        if previous is not None and interval:
+            calls = f'{count / interval:.0f}/s'
+            data = f' {_format_bytes(nbytes / interval)}/s' if nbytes else ''
+        else:
+            calls = f'{count}x'
+            data = f' {_format_bytes(nbytes)}' if nbytes else ''
+        p99 = _percentile(buckets, count, 99)
+        entries.append(f'{name}: {calls}{data} mean {mean:.1f}us p99<{p99}us')
+
+    return ' | '.join(entries) if entries else 'no activity'
+
+
+class PeriodicSummary(threading.Thread):
+    '''
+    A thread printing :func:`summary_line` every ``interval`` seconds,
+    with the rates over that interval. :meth:`stop` prints the totals.
+
+    :param float interval: the seconds between two lines
+    :param File file: where to print the lines to
+    '''
+    def __init__(self, interval, file=sys.stderr):
+        super().__init__(name='hidtools instrumentation', daemon=True)
+        self.interval = interval
+        self.file = file
+        self._stop_event = threading.Event()
+
+    def run(self):
+        previous = snapshot()
+        last = time.monotonic()
+        while not self._stop_event.wait(self.interval):
+            current = snapshot()
+            now = time.monotonic()
+            print(f'# stats: {summary_line(current, previous, now - last)}', file=self.file, flush=True)
+            previous, last = current, now
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        print(f'# stats total: {summary_line()}', file=self.file, flush=True)
@@ -0,0 +1,360 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class UnsupportedCompression(Exception):
+    """
+    An exception raised when a recording uses a compression format that
+    is unknown or whose module is not available.
+    """
+    pass
+
+
+# magic bytes at the start of a compressed stream
+_MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'bz2': b'BZh',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+
+_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.xz': 'xz',
+    '.bz2': 'bz2',
+    '.zst': 'zstd',
+}
+
+COMPRESSION_FORMATS = tuple(_MAGIC.keys())
+"""The compression formats supported for recordings"""
+
+
+def compression_from_filename(filename):
+    """
+    Guess the compression format from the file name's extension.
+
+    :returns: one of :data:`COMPRESSION_FORMATS` or ``None``
+    """
+    for ext, compression in _EXTENSIONS.items():
+        if filename.endswith(ext):
+            return compression
+    return None
+
+
+def compression_from_data(data):
+    """
+    Detect the compression format from the first bytes of a file.
+
+    :param bytes data: the first few bytes of the file
+    :returns: one of :data:`COMPRESSION_FORMATS` or ``None``
+    """
+    for compression, magic in _MAGIC.items():
+        if data.startswith(magic):
+            return compression
+    return None
+
+
+def _open_compressed(fileobj, mode, compression):
+    if compression == 'gzip':
+        return gzip.open(fileobj, mode)
+    if compression == 'xz':
+        return lzma.open(fileobj, mode)
+    if compression == 'bz2':
+        return bz2.open(fileobj, mode)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise UnsupportedCompression('zstd compression is not supported due to missing zstandard dependency')
+        if 'r' in mode:
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+        return zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+    raise UnsupportedCompression(f'Unknown compression format {compression}')
+
+
+class _CompressedFile(io.TextIOWrapper):
+    # TextIOWrapper around the compression stream that also closes the
+    # underlying file object if we opened it ourselves
+    def __init__(self, stream, rawfile, owns_rawfile):
+        super().__init__(stream, encoding='utf-8')
+        self._rawfile = rawfile
+        self._owns_rawfile = owns_rawfile
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            if self._owns_rawfile:
+                self._rawfile.close()
+            else:
+                self._rawfile.flush()
+
+
+def open_recording(file, mode='r', compression=None):
+    """
+    Open a recording in text mode, transparently handling compression.
+
+    When reading, the compression format is detected from the file's
+    content. When writing, the compression format is taken from the
+    ``compression`` argument or, if that is ``None``, guessed from the
+    file name's extension. ::
+
+        with open_recording('recording.hid.xz') as f:
+            for line in f:
+                ...
+
+    :param file: the path to the file, ``'-'`` for stdin/stdout, or a
+        binary file object. A file object is closed together with the
+        returned file.
+    :param str mode: ``'r'`` to read, ``'w'`` to write
+    :param str compression: one of :data:`COMPRESSION_FORMATS`, only
+        used when writing
+    :returns: a text file object
+    :raises: :class:`UnsupportedCompression` if the compression format is
+        not supported
+    """
+    assert mode in ['r', 'w']
+
+    owns_rawfile = True
+    if file == '-':
+        rawfile = sys.stdin.buffer if mode == 'r' else sys.stdout.buffer
+        owns_rawfile = False
+    elif isinstance(file, str):
+        rawfile = open(file, f'{mode}b')
+        if mode == 'w' and compression is None:
+            compression = compression_from_filename(file)
+    else:
+        rawfile = file
+
+    try:
+        if mode == 'r':
+            if not hasattr(rawfile, 'peek'):
+                rawfile = io.BufferedReader(rawfile)
+            compression = compression_from_data(rawfile.peek(8))
+
+        if compression is None:
+            if not owns_rawfile:
+                return sys.stdin if mode == 'r' else sys.stdout
+            return io.TextIOWrapper(rawfile, encoding='utf-8')
+
+        stream = _open_compressed(rawfile, f'{mode}b', compression)
+        return _CompressedFile(stream, rawfile, owns_rawfile)
+    except:
+        if owns_rawfile:
+            rawfile.close()
+        raise
+
+
+def segment_path(path, index):
+    """
+    Return the file name of the segment with the given index for a
+    rotated recording, e.g. ``recording.hid.xz`` becomes
+    ``recording-0003.hid.xz`` for the segment with index 3.
+    """
+    dirname, basename = os.path.split(path)
+    name, dot, extensions = basename.partition('.')
+    return os.path.join(dirname, f'{name}-{index:04d}{dot}{extensions}')
+
+
+class RotatingOutput(object):
+    """
+    A file-like object writing a recording into a series of segments,
+    see :func:`segment_path` for the segment names.
+
+    The caller is responsible for checking :meth:`should_rotate` at a
+    point where a new segment may start and for writing the required
+    headers after :meth:`rotate`, this object only deals with the files.
+
+    :param str path: the path to the recording, used as template for the
+        segment names
+    :param int max_size: the size in bytes after which a segment should
+        be rotated, ``None`` for no size limit
+    :param float max_duration: the duration in seconds after which a
+        segment should be rotated, ``None`` for no time limit
+    :param str compression: one of :data:`COMPRESSION_FORMATS`, see
+        :func:`open_recording`
+
+    .. attribute:: index
+
+        The index of the current segment
+
+    .. attribute:: segments
+
+        The list of paths of all segments opened so far
+    """
+    def __init__(self, path, max_size=None, max_duration=None, compression=None):
+        self.path = path
+        self.max_size = max_size
+        self.max_duration = max_duration
+        self.compression = compression
+        if self.compression is None:
+            self.compression = compression_from_filename(path)
+        self.index = -1
+        self.segments = []
+        self._rawfile = None
+        self._file = None
+        self._start = None
+        self._open_next()
+
+    def _open_next(self):
+        self.index += 1
+        path = segment_path(self.path, self.index)
+        self._rawfile = open(path, 'wb')
+        self._file = open_recording(self._rawfile, 'w', self.compression)
+        self._start = time.monotonic()
+        self.segments.append(path)
+
+    def should_rotate(self):
+        """
+        :returns: ``True`` if the current segment exceeds the size or
+            duration limit
+        """
+        if self.max_size is not None and self._rawfile.tell() >= self.max_size:
+            return True
+        if self.max_duration is not None and time.monotonic() - self._start >= self.max_duration:
+            return True
+        return False
+
+    def rotate(self):
+        """
+        Close the current segment and start a new one.
+        """
+        self._file.close()
+        self._open_next()
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details):
+        self.close()
+
+
+class SegmentedRecording(object):
+    """
+    A read-only file-like object presenting the segments of a rotated
+    recording as one recording. ::
+
+        with SegmentedRecording(['rec-0000.hid', 'rec-0001.hid']) as f:
+            parse_hid(f, sys.stdout)
+
+    Each segment repeats the description of the devices, these are only
+    passed on the first time a device is seen. The segments are read in
+    the given order and may be compressed, see :func:`open_recording`.
+
+    :param list paths: the paths to the segments
+    """
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self._lines = self._read_lines()
+        self.closed = False
+
+    def _read_lines(self):
+        known_devices = set()
+        current_index = None
+        for path in self.paths:
+            with open_recording(path) as f:
+                # The header of a segment is everything up to the first
+                # event. Descriptions of devices we already know are
+                # dropped, ``None`` is the index of the device in
+                # recordings without ``D:`` lines.
+                idx = None
+                new_devices = set()
+                for line in f:
+                    if line.startswith('E:'):
+                        if idx != current_index:
+                            yield f'D: {idx}\n'
+                            current_index = idx
+                        yield line
+                        break
+                    if line.startswith('D:'):
+                        idx = int(line[2:])
+                        if idx in known_devices:
+                            continue
+                        current_index = idx
+                    elif idx in known_devices:
+                        continue
+                    elif line.startswith('R:'):
+                        new_devices.add(idx)
+                    yield line
+                known_devices |= new_devices
+
+                # devices added after the header, e.g. hotplugged, are
+                # repeated in the header of the next segment
+                for line in f:
+                    if line.startswith('D:'):
+                        current_index = int(line[2:])
+                    elif line.startswith('R:'):
+                        known_devices.add(current_index)
+                    yield line
+
+    def readline(self):
+        return next(self._lines, '')
+
+    def __iter__(self):
+        return self._lines
+
+    def close(self):
+        self._lines.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details):
+        self.close()
+
+
+def open_recordings(files):
+    """
+    Open one or more recordings for reading. A single recording is opened
+    with :func:`open_recording`, multiple recordings are treated as the
+    segments of one recording, see :class:`SegmentedRecording`.
+
+    :param list files: a list of paths
+    :returns: a text file object
+    """
+    if len(files) == 1:
+        return open_recording(files[0])
+    return SegmentedRecording(files)
@@ -18,19 +18,26 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
 import hidtools.hid
 import functools
+import glob
+import logging
 import os
+import re
 import select
 import struct
+import threading
+import time
 import uuid
 
+from hidtools.instrumentation import timed
+
 try:
     import pyudev
 except ImportError:
     raise ImportError('UHID is not supported due to missing pyudev dependency')
 
-import logging
 logger = logging.getLogger('hidtools.hid.uhid')
 
 
@@ -42,6 +49,14 @@ class UHIDIncompleteException(Exception):
     pass
 
 
+class UHIDNotReadyException(TimeoutError):
+    """
+    An exception raised when a UHIDDevice did not become ready within the
+    given timeout.
+    """
+    pass
+
+
 class UHIDDevice(object):
     """
     A uhid device. uhid is a kernel interface to create virtual HID devices
@@ -90,14 +105,46 @@ class UHIDDevice(object):
     UHID_OUTPUT_REPORT = 1
     UHID_INPUT_REPORT = 2
 
+    # The kernel accepts messages shorter than struct uhid_event and
+    # zero-fills the remainder, so we only ever write the used part of a
+    # message: the type, the request header and the actual data. The
+    # messages are built in per-device buffers allocated once.
+    _UHID_DATA_MAX = 4096
+    _UHID_EVENT_SIZE = 4380
+    _input2_header = struct.Struct('< L H')
+    _get_report_reply_header = struct.Struct('< L L H H')
+    _set_report_reply_header = struct.Struct('< L L H')
+    _create2_header = struct.Struct('< L 128s 64s 64s H H L L L L')
+    _get_report_header = struct.Struct('< L L B B')
+    _set_report_header = struct.Struct('< L L B B H')
+    _request_id = struct.Struct('< L')
+    _IOV_MAX = 1024
+
+    # The state shared by all devices is per process, see _init_process()
+    _pid = None
     _polling_functions = {}
-    _poll = select.poll()
+    _poll = None
     _devices = []
+    _devices_by_uniq = {}
+    _devices_by_sys_path = {}
+    _loop = None
+    _lock = threading.RLock()
+    _dispatched = threading.Condition(_lock)
+    _dispatcher = None
+    _wakeup = None
+
+    _uhid_sys_path = '/sys/devices/virtual/misc/uhid'
+
+    # a HID device in a sysfs path, e.g. /sys/devices/.../0003:046D:C52B.0003
+    # The kernel formats them as %04X:%04X:%04X.%04X, the ID grows beyond
+    # 4 digits after 0xFFFF devices.
+    _hid_sys_path_regex = re.compile(r'/[0-9A-F]{4}:[0-9A-F]{4}:[0-9A-F]{4}\.[0-9A-F]{4,}(?=/|$)')
 
     _pyudev_context = None
     _pyudev_monitor = None
 
     @classmethod
+    @timed('uhid.dispatch')
     def dispatch(cls, timeout=None):
         """
         Process any events available on any internally registered file
@@ -107,8 +154,15 @@ class UHIDDevice(object):
         like udev events are processed correctly. There's no indicator of
         when to call :meth:`dispatch` yet, call it whenever you're idle.
 
+        If the dispatcher thread is running, see :meth:`start_dispatcher`,
+        this only waits for the thread to process events.
+
         :returns: True if data was processed, False otherwise
         """
+        cls._init_process()
+        if cls._dispatcher_active():
+            return cls._wait_dispatched(timeout)
+
         had_data = False
         devices = cls._poll.poll(timeout)
         while devices:
@@ -120,33 +174,310 @@ class UHIDDevice(object):
             had_data = True
         return had_data
 
+    @classmethod
+    def _dispatch_once(cls, timeout=None):
+        # a single poll() call, processing whatever is available
+        cls._init_process()
+        if cls._dispatcher_active():
+            return cls._wait_dispatched(timeout)
+
+        had_data = False
+        for fd, mask in cls._poll.poll(timeout):
+            if mask & select.POLLIN:
+                cls._polling_functions[fd]()
+                had_data = True
+        return had_data
+
+    @classmethod
+    def wait_for(cls, condition, timeout=5):
+        """
+        Process the events of all devices until ``condition()`` returns
+        ``True``. Unlike repeated calls to :meth:`dispatch`, this blocks
+        until an event is available and returns as soon as the condition
+        is met.
+
+        :param condition: a callable without arguments
+        :param timeout: the maximum time to wait in seconds
+        :raises: :class:`UHIDNotReadyException` if the condition is not met
+            within the timeout
+        """
+        cls._init_process()
+        if cls._dispatcher_active():
+            with UHIDDevice._dispatched:
+                if not UHIDDevice._dispatched.wait_for(condition, timeout):
+                    raise UHIDNotReadyException(f'timeout after {timeout}s')
+            return
+
+        deadline = time.monotonic() + timeout
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise UHIDNotReadyException(f'timeout after {timeout}s')
+            cls._dispatch_once(remaining * 1000)
+
+    @classmethod
+    def wait_ready_all(cls, devices, timeout=5):
+        """
+        Wait until all the given devices are ready, see :meth:`is_ready`.
+        The devices are brought up concurrently, so the time this takes
+        is that of the slowest device. ::
+
+            devices = [MyDevice() for _ in range(10)]
+            for d in devices:
+                d.create_kernel_device()
+            UHIDDevice.wait_ready_all(devices)
+
+        :param list devices: the devices to wait for, the kernel device must
+            already be created with :meth:`create_kernel_device`
+        :param timeout: the maximum time to wait in seconds
+        :raises: :class:`UHIDNotReadyException` if any device is not ready
+            within the timeout
+        """
+        pending = list(devices)
+
+        def all_ready():
+            pending[:] = [d for d in pending if not d.is_ready()]
+            return not pending
+
+        try:
+            cls.wait_for(all_ready, timeout)
+        except UHIDNotReadyException:
+            names = ', '.join(f'"{d.name}"' for d in pending)
+            raise UHIDNotReadyException(f'devices not ready after {timeout}s: {names}')
+
+    @classmethod
+    def attach_event_loop(cls, loop=None):
+        """
+        Process the events of all devices from an :mod:`asyncio` event loop
+        instead of :meth:`dispatch`. The ``/dev/uhid`` file descriptors of
+        all current and future devices and the udev monitor are
+        registered with the loop, the events are processed as soon as
+        they are available. ::
+
+            UHIDDevice.attach_event_loop()
+            device.create_kernel_device()
+            await device.ready()
+
+        With an event loop attached, the callbacks :meth:`start`,
+        :meth:`stop`, :meth:`open`, :meth:`close`, :meth:`output_report`,
+        :meth:`get_report` and :meth:`set_report` may be coroutines. They
+        are scheduled as tasks on the loop, the replies to GetReport and
+        SetReport are sent once the coroutine returns.
+
+        :param loop: the event loop, defaults to the current event loop
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        cls._init_process()
+        UHIDDevice._loop = loop
+        for fd, fun in cls._polling_functions.items():
+            loop.add_reader(fd, fun)
+
+    @classmethod
+    def detach_event_loop(cls):
+        """
+        Stop processing the events from the :mod:`asyncio` event loop, see
+        :meth:`attach_event_loop`.
+        """
+        if cls._loop is None:
+            return
+        for fd in cls._polling_functions:
+            cls._loop.remove_reader(fd)
+        UHIDDevice._loop = None
+
+    @classmethod
+    def _init_process(cls):
+        # Processes do not share the poll object, the udev monitor or the
+        # devices, a forked child (e.g. a test worker) starts over instead
+        # of receiving a share of the parent's udev events. This is
+        # assigned on UHIDDevice, not on the subclass we're called from.
+        pid = os.getpid()
+        if UHIDDevice._pid == pid:
+            return
+        UHIDDevice._pid = pid
+        UHIDDevice._poll = select.poll()
+        UHIDDevice._polling_functions = {}
+        UHIDDevice._devices = []
+        UHIDDevice._devices_by_uniq = {}
+        UHIDDevice._devices_by_sys_path = {}
+        UHIDDevice._loop = None
+        UHIDDevice._pyudev_context = None
+        UHIDDevice._pyudev_monitor = None
+        # threads do not survive a fork, neither does a lock they held
+        UHIDDevice._lock = threading.RLock()
+        UHIDDevice._dispatched = threading.Condition(UHIDDevice._lock)
+        UHIDDevice._dispatcher = None
+        UHIDDevice._wakeup = None
+
+    @classmethod
+    def start_dispatcher(cls):
+        """
+        Process the events of all devices in a background thread instead
+        of :meth:`dispatch`. The requests from the kernel are answered as
+        soon as they arrive, even while the caller is busy, so drivers
+        that send GetReport or SetReport requests during probe do not
+        time out. ::
+
+            UHIDDevice.start_dispatcher()
+            device.create_kernel_device()
+            device.wait_ready()
+
+        There is one dispatcher thread per process. The callbacks are
+        invoked from that thread with :meth:`lock` held, hold the lock too
+        when accessing state shared with the callbacks from other
+        threads. While the thread is running, :meth:`dispatch` and
+        :meth:`wait_for` only wait for it to process events.
+        """
+        cls._init_process()
+        if UHIDDevice._dispatcher is not None:
+            return
+
+        r, w = os.pipe()
+        os.set_blocking(r, False)
+        os.set_blocking(w, False)
+        UHIDDevice._wakeup = (r, w)
+        UHIDDevice._poll.register(r, select.POLLIN)
+        thread = threading.Thread(target=UHIDDevice._run_dispatcher,
+                                  name='uhid-dispatcher', daemon=True)
+        UHIDDevice._dispatcher = thread
+        thread.start()
+
+    @classmethod
+    def lock(cls):
+        """
+        The lock held while events are processed, see
+        :meth:`start_dispatcher`. ::
+
+            with UHIDDevice.lock():
+                device.state = ...
+        """
+        return UHIDDevice._lock
+
+    @classmethod
+    def stop_dispatcher(cls):
+        """
+        Stop the dispatcher thread, see :meth:`start_dispatcher`.
+        """
+        thread = UHIDDevice._dispatcher
+        if thread is None or UHIDDevice._pid != os.getpid():
+            return
+        UHIDDevice._dispatcher = None
+        cls._wakeup_dispatcher()
+        thread.join()
+        r, w = UHIDDevice._wakeup
+        UHIDDevice._wakeup = None
+        UHIDDevice._poll.unregister(r)
+        os.close(r)
+        os.close(w)
+
+    @classmethod
+    def _dispatcher_active(cls):
+        thread = UHIDDevice._dispatcher
+        return thread is not None and thread is not threading.current_thread()
+
+    @classmethod
+    def _wait_dispatched(cls, timeout):
+        # timeout is in ms like for poll()
+        with UHIDDevice._dispatched:
+            return UHIDDevice._dispatched.wait(None if timeout is None else timeout / 1000)
+
+    @classmethod
+    def _wakeup_dispatcher(cls):
+        # make the dispatcher thread poll() again, e.g. after the fds
+        # changed
+        if UHIDDevice._wakeup is not None:
+            try:
+                os.write(UHIDDevice._wakeup[1], b'\0')
+            except BlockingIOError:
+                # a wakeup is already pending
+                pass
+
+    @classmethod
+    def _run_dispatcher(cls):
+        thread = threading.current_thread()
+        poll = UHIDDevice._poll
+        wakeup = UHIDDevice._wakeup[0]
+        while UHIDDevice._dispatcher is thread:
+            events = poll.poll()
+            with UHIDDevice._dispatched:
+                for fd, mask in events:
+                    if fd == wakeup:
+                        while True:
+                            try:
+                                os.read(wakeup, 64)
+                            except BlockingIOError:
+                                break
+                        continue
+                    fun = UHIDDevice._polling_functions.get(fd)
+                    if fun is None or not mask & select.POLLIN:
+                        continue
+                    # another thread may have drained the fd (see destroy())
+                    # while we were waiting for the lock, don't block on it
+                    if not cls._readable(fd):
+                        continue
+                    try:
+                        fun()
+                    except Exception:
+                        logger.exception('failed to process event')
+                UHIDDevice._dispatched.notify_all()
+
+    @staticmethod
+    def _readable(fd):
+        # poll rather than select, which fails for fds >= FD_SETSIZE
+        poll = select.poll()
+        poll.register(fd, select.POLLIN)
+        return bool(poll.poll(0))
+
     @classmethod
     def _append_fd_to_poll(cls, fd, read_function, mask=select.POLLIN):
-        cls._poll.register(fd, mask)
-        cls._polling_functions[fd] = read_function
+        with UHIDDevice._lock:
+            cls._poll.register(fd, mask)
+            cls._polling_functions[fd] = read_function
+        if cls._loop is not None:
+            cls._loop.add_reader(fd, read_function)
+        cls._wakeup_dispatcher()
 
     @classmethod
     def _remove_fd_from_poll(cls, fd):
-        cls._poll.unregister(fd)
+        with UHIDDevice._lock:
+            cls._poll.unregister(fd)
+            del cls._polling_functions[fd]
+        if cls._loop is not None:
+            cls._loop.remove_reader(fd)
+        cls._wakeup_dispatcher()
 
     @classmethod
     def _init_pyudev(cls):
-        if cls._pyudev_context is None:
-            cls._pyudev_context = pyudev.Context()
-            cls._pyudev_monitor = pyudev.Monitor.from_netlink(cls._pyudev_context)
-            cls._pyudev_monitor.start()
+        if UHIDDevice._pyudev_context is None:
+            UHIDDevice._pyudev_context = pyudev.Context()
+            UHIDDevice._pyudev_monitor = pyudev.Monitor.from_netlink(UHIDDevice._pyudev_context)
+            UHIDDevice._pyudev_monitor.start()
 
-            cls._append_fd_to_poll(cls._pyudev_monitor.fileno(),
-                                   cls._cls_udev_event_callback)
+            cls._append_fd_to_poll(UHIDDevice._pyudev_monitor.fileno(),
+                                   UHIDDevice._cls_udev_event_callback)
 
     @classmethod
     def _cls_udev_event_callback(cls):
-        for event in iter(functools.partial(cls._pyudev_monitor.poll, 0.02), None):
+        for event in iter(functools.partial(cls._pyudev_monitor.poll, 0), None):
             logger.debug(f'udev event: {event.action} -> {event}')
 
-            for d in cls._devices:
-                if d.udev_device is not None and d.udev_device.sys_path in event.sys_path:
+            # Events are routed by the sys path of the HID device they
+            # belong to. We learn about that sys path from the add event
+            # of the HID device itself, which carries our uniq.
+            if event.action == 'add' and event.subsystem == 'hid':
+                d = cls._devices_by_uniq.get(event.properties.get('HID_UNIQ'))
+                if d is not None:
+                    d._udev_device = event
+                    cls._devices_by_sys_path[event.sys_path] = d
+
+            # HID devices may be nested (e.g. receivers with HID devices
+            # for each paired device), so check every HID device in the path
+            sys_path = event.sys_path
+            for m in cls._hid_sys_path_regex.finditer(sys_path):
+                d = cls._devices_by_sys_path.get(sys_path[:m.end()])
+                if d is not None:
                     d._udev_event(event)
+                    break
 
     def __init__(self):
         self._name = None
@@ -163,12 +494,21 @@ class UHIDDevice(object):
         self._udev_device = None
         self._ready = False
         self._is_destroyed = False
+        self._input_buf = bytearray(self._input2_header.size + self._UHID_DATA_MAX)
+        self._input_events_buf = bytearray()
+        self._reply_buf = bytearray(self._get_report_reply_header.size + self._UHID_DATA_MAX)
+        self._event_buf = bytearray(self._UHID_EVENT_SIZE)
+        self._ready_futures = []
+        self._get_report_table = {}
+        self._set_report_table = {}
         self.device_nodes = []
         self.hidraw_nodes = []
         self.uniq = f'uhid_{str(uuid.uuid4())}'
+        self._init_process()
         self._append_fd_to_poll(self._fd, self._process_one_event)
         self._init_pyudev()
         UHIDDevice._devices.append(self)
+        UHIDDevice._devices_by_uniq[self.uniq] = self
 
     def __enter__(self):
         return self
@@ -203,6 +543,72 @@ class UHIDDevice(object):
 
         self.udev_event(event)
 
+        if self._ready_futures and self.is_ready():
+            for future in self._ready_futures:
+                if not future.done():
+                    future.set_result(None)
+            self._ready_futures.clear()
+
+    def is_ready(self):
+        """
+        Return ``True`` once the kernel device has been created and the
+        udev events for its event nodes were processed. Override this in
+        subclasses that need to wait for more than one event node or other
+        conditions.
+        """
+        return self._ready and len(self.device_nodes) > 0
+
+    def wait_ready(self, timeout=5):
+        """
+        Wait until this device is ready, see :meth:`is_ready`. This
+        processes the events of all devices while waiting.
+
+        :param timeout: the maximum time to wait in seconds
+        :raises: :class:`UHIDNotReadyException` if the device is not ready
+            within the timeout
+        """
+        UHIDDevice.wait_ready_all([self], timeout)
+
+    async def ready(self, timeout=None):
+        """
+        Wait until :meth:`is_ready` returns ``True``. This requires an
+        event loop to be attached, see :meth:`attach_event_loop`.
+
+        :param timeout: the maximum time to wait in seconds, or ``None``
+        :raises: :class:`asyncio.TimeoutError` if the device is not ready
+            within the timeout
+        :raises: :class:`RuntimeError` if no event loop is attached
+        """
+        # without the loop processing the udev events, we'd wait forever
+        if UHIDDevice._loop is None:
+            raise RuntimeError('no event loop attached, call UHIDDevice.attach_event_loop() first')
+        if self.is_ready():
+            return
+        future = UHIDDevice._loop.create_future()
+        self._ready_futures.append(future)
+        await asyncio.wait_for(future, timeout)
+
+    def _run_callback(self, result, reply=None, error=None):
+        # Callbacks may be coroutines when running with an event loop,
+        # schedule those and only reply to the kernel once they return.
+        # If the coroutine fails, we reply with the given error instead.
+        if not asyncio.iscoroutine(result):
+            if reply is not None:
+                reply(result)
+            return
+
+        def done(task):
+            try:
+                result = task.result()
+            except Exception:
+                logger.exception('callback failed')
+                result = error
+            if reply is not None:
+                reply(result)
+
+        loop = UHIDDevice._loop or asyncio.get_event_loop()
+        loop.create_task(result).add_done_callback(done)
+
     @property
     def fd(self):
         """
@@ -284,22 +690,26 @@ class UHIDDevice(object):
         return self._info[2]
 
     def _call_set_report(self, req, err):
-        buf = struct.pack('< L L H',
-                          UHIDDevice._UHID_SET_REPORT_REPLY,
-                          req,
-                          err)
-        os.write(self._fd, buf)
+        header = UHIDDevice._set_report_reply_header
+        header.pack_into(self._reply_buf, 0,
+                         UHIDDevice._UHID_SET_REPORT_REPLY,
+                         req,
+                         err)
+        os.write(self._fd, memoryview(self._reply_buf)[:header.size])
 
     def _call_get_report(self, req, data, err):
         data = bytes(data)
-        buf = struct.pack('< L L H H 4096s',
-                          UHIDDevice._UHID_GET_REPORT_REPLY,
-                          req,
-                          err,
-                          len(data),
-                          data)
-        os.write(self._fd, buf)
-
+        header = UHIDDevice._get_report_reply_header
+        end = header.size + len(data)
+        header.pack_into(self._reply_buf, 0,
+                         UHIDDevice._UHID_GET_REPORT_REPLY,
+                         req,
+                         err,
+                         len(data))
+        self._reply_buf[header.size:end] = data
+        os.write(self._fd, memoryview(self._reply_buf)[:end])
+
+    @timed('uhid.call_input_event', lambda args, r: len(args[1]))
     def call_input_event(self, data):
         """
         Send an input event from this device.
@@ -308,12 +718,68 @@ class UHIDDevice(object):
             report for this input event
         """
         data = bytes(data)
-        buf = struct.pack('< L H 4096s',
-                          UHIDDevice._UHID_INPUT2,
-                          len(data),
-                          data)
-        logger.debug(f'inject {buf[:len(data)]}')
-        os.write(self._fd, buf)
+        header = UHIDDevice._input2_header
+        end = header.size + len(data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'inject {data}')
+        # the buffer is shared with callbacks on the dispatcher thread
+        with UHIDDevice._lock:
+            header.pack_into(self._input_buf, 0,
+                             UHIDDevice._UHID_INPUT2,
+                             len(data))
+            self._input_buf[header.size:end] = data
+            os.write(self._fd, memoryview(self._input_buf)[:end])
+
+    @timed('uhid.call_input_events', lambda args, r: sum(len(report) for report in args[1]))
+    def call_input_events(self, reports):
+        """
+        Send multiple input events from this device in one go.
+
+        This is equivalent to calling :meth:`call_input_event` for each
+        report but much cheaper: the messages are built in one buffer that
+        is reused across calls and submitted with :func:`os.writev`. The
+        kernel still processes each message as a separate write, so each
+        report results in one input event.
+
+        :param list reports: a list of reports, each a list of 8-bit
+            integers or a bytes-like object
+        """
+        reports = [bytes(r) for r in reports]
+        with UHIDDevice._lock:
+            self._send_input_events(reports)
+
+    def _send_input_events(self, reports):
+        header = UHIDDevice._input2_header
+        total = len(reports) * header.size + sum(len(r) for r in reports)
+        if len(self._input_events_buf) < total:
+            self._input_events_buf = bytearray(total)
+        buf = self._input_events_buf
+        view = memoryview(buf)
+
+        # only the used part of the struct uhid_input2_req is sent, the
+        # kernel zero-fills the remainder of the message
+        views = []
+        offset = 0
+        for data in reports:
+            end = offset + header.size + len(data)
+            header.pack_into(buf, offset, UHIDDevice._UHID_INPUT2, len(data))
+            buf[offset + header.size:end] = data
+            views.append(view[offset:end])
+            offset = end
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for data in reports:
+                logger.debug(f'inject {data}')
+
+        idx = 0
+        while idx < len(views):
+            written = os.writev(self._fd, views[idx:idx + UHIDDevice._IOV_MAX])
+            # each message is a separate write for the kernel, a short
+            # count means a message was refused. Resubmitting that message
+            # raises the actual error.
+            while written > 0:
+                written -= len(views[idx])
+                idx += 1
 
     @property
     def udev_device(self):
@@ -322,14 +788,23 @@ class UHIDDevice(object):
 
         The device may be None if udev hasn't processed the device yet.
         """
-        if self._udev_device is None:
-            for device in self._pyudev_context.list_devices(subsystem='hid'):
+        if self._udev_device is None and self._ready:
+            # Usually set from the udev add event already. Otherwise look
+            # at the uhid devices with our bus/vid/pid (the kernel names
+            # them BUS:VID:PID.ID) and pick the one with our uniq.
+            pattern = f'{UHIDDevice._uhid_sys_path}/{self.bus:04X}:{self.vid:04X}:{self.pid:04X}.*'
+            for path in glob.glob(pattern):
                 try:
-                    if self.uniq == device.properties['HID_UNIQ']:
-                        self._udev_device = device
-                        break
-                except KeyError:
-                    pass
+                    with open(os.path.join(path, 'uevent')) as f:
+                        if f'HID_UNIQ={self.uniq}\n' not in f.read():
+                            continue
+                    device = pyudev.Devices.from_sys_path(self._pyudev_context, path)
+                except (OSError, pyudev.DeviceNotFoundError):
+                    # the device went away in the meantime
+                    continue
+                self._udev_device = device
+                UHIDDevice._devices_by_sys_path[device.sys_path] = self
+                break
         return self._udev_device
 
     @property
@@ -353,18 +828,18 @@ class UHIDDevice(object):
            self._info is None):
             raise UHIDIncompleteException("missing uhid initialization")
 
-        buf = struct.pack('< L 128s 64s 64s H H L L L L 4096s',
-                          UHIDDevice._UHID_CREATE2,
-                          bytes(self._name, 'utf-8'),  # name
-                          bytes(self._phys, 'utf-8'),  # phys
-                          bytes(self.uniq, 'utf-8'),  # uniq
-                          len(self._rdesc),  # rd_size
-                          self.bus,  # bus
-                          self.vid,  # vendor
-                          self.pid,  # product
-                          0,  # version
-                          0,  # country
-                          bytes(self._rdesc))  # rd_data[HID_MAX_DESCRIPTOR_SIZE]
+        rdesc = bytes(self._rdesc)
+        buf = UHIDDevice._create2_header.pack(UHIDDevice._UHID_CREATE2,
+                                              bytes(self._name, 'utf-8'),  # name
+                                              bytes(self._phys, 'utf-8'),  # phys
+                                              bytes(self.uniq, 'utf-8'),  # uniq
+                                              len(rdesc),  # rd_size
+                                              self.bus,  # bus
+                                              self.vid,  # vendor
+                                              self.pid,  # product
+                                              0,  # version
+                                              0)  # country
+        buf += rdesc  # rd_data[HID_MAX_DESCRIPTOR_SIZE]
 
         logger.debug('creating kernel device')
         n = os.write(self._fd, buf)
@@ -387,11 +862,15 @@ class UHIDDevice(object):
             # this ensures that the callbacks are called correctly
             poll = select.poll()
             poll.register(self._fd, select.POLLIN)
-            while poll.poll(100):
-                fun = self._polling_functions[self._fd]
-                fun()
+            with UHIDDevice._lock:
+                while poll.poll(100):
+                    fun = self._polling_functions[self._fd]
+                    fun()
 
         UHIDDevice._devices.remove(self)
+        del UHIDDevice._devices_by_uniq[self.uniq]
+        if self._udev_device is not None:
+            UHIDDevice._devices_by_sys_path.pop(self._udev_device.sys_path, None)
         self._remove_fd_from_poll(self._fd)
         os.close(self._fd)
         self._is_destroyed = True
@@ -453,11 +932,22 @@ class UHIDDevice(object):
         """
         return 5  # EIO
 
-    def _set_report(self, req, rnum, rtype, size, data):
-        logger.debug('set report {} {} {} {} {} '.format(req, rnum, rtype, size, [f'{d:02x}' for d in data[:size]]))
-        error = self.set_report(req, rnum, rtype, [int(x) for x in data[:size]])
-        if self._ready:
-            self._call_set_report(req, error)
+    def _set_report(self, req, rnum, rtype, data):
+        entry = self._set_report_table.get((rtype, rnum))
+        if entry is not None:
+            error = entry(rnum, rtype, bytes(data)) if callable(entry) else entry
+            if self._ready:
+                self._call_set_report(req, error)
+            return
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('set report {} {} {} {} {} '.format(req, rnum, rtype, len(data), [f'{d:02x}' for d in data]))
+
+        def reply(error):
+            if self._ready:
+                self._call_set_report(req, error)
+
+        self._run_callback(self.set_report(req, rnum, rtype, list(data)), reply, 5)  # EIO
 
     def get_report(self, req, rnum, rtype):
         """
@@ -476,10 +966,81 @@ class UHIDDevice(object):
         return (5, [])  # EIO
 
     def _get_report(self, req, rnum, rtype):
+        entry = self._get_report_table.get((rtype, rnum))
+        if entry is not None:
+            if type(entry) is bytearray:
+                # a complete reply message, only the request id changes
+                if self._ready:
+                    UHIDDevice._request_id.pack_into(entry, 4, req)
+                    os.write(self._fd, entry)
+            else:
+                error, data = entry(rnum, rtype)
+                if self._ready:
+                    self._call_get_report(req, data, error)
+            return
+
         logger.debug('get report {} {} {}'.format(req, rnum, rtype))
-        error, data = self.get_report(req, rnum, rtype)
-        if self._ready:
-            self._call_get_report(req, data, error)
+
+        def reply(result):
+            error, data = result
+            if self._ready:
+                self._call_get_report(req, data, error)
+
+        self._run_callback(self.get_report(req, rnum, rtype), reply, (5, []))  # EIO
+
+    def add_get_report_reply(self, rnum, reply, rtype=UHID_FEATURE_REPORT):
+        """
+        Answer the GetReport requests for the given report directly instead
+        of through :meth:`get_report`. ::
+
+            device.add_get_report_reply(0x03, [0x03, 0x0a])
+            device.add_get_report_reply(0x04, lambda rnum, rtype: (0, device.battery))
+
+        A static reply is built once and only the request id is filled in
+        for each request, which is much cheaper for reports that drivers
+        poll at a high rate.
+
+        :param int rnum: the report ID
+        :param reply: the report data (a list of 8-bit integers or a
+            bytes-like object) to reply with, a callable ``reply(rnum,
+            rtype)`` returning ``(errno, data)`` like :meth:`get_report`,
+            or ``None`` to remove the entry
+        :param rtype: one of :attr:`UHID_FEATURE_REPORT`, :attr:`UHID_INPUT_REPORT`, or :attr:`UHID_OUTPUT_REPORT`
+        """
+        key = (rtype, rnum)
+        if reply is None:
+            self._get_report_table.pop(key, None)
+            return
+
+        if not callable(reply):
+            data = bytes(reply)
+            header = UHIDDevice._get_report_reply_header
+            message = bytearray(header.size + len(data))
+            header.pack_into(message, 0,
+                             UHIDDevice._UHID_GET_REPORT_REPLY,
+                             0,  # id, filled in per request
+                             0,  # err
+                             len(data))
+            message[header.size:] = data
+            reply = message
+        self._get_report_table[key] = reply
+
+    def add_set_report_reply(self, rnum, reply, rtype=UHID_FEATURE_REPORT):
+        """
+        Answer the SetReport requests for the given report directly instead
+        of through :meth:`set_report`, see :meth:`add_get_report_reply`.
+
+        :param int rnum: the report ID
+        :param reply: the errno to reply with, ``0`` on success, a callable
+            ``reply(rnum, rtype, data)`` returning the errno, or ``None`` to
+            remove the entry. ``data`` is a bytes object.
+        :param rtype: one of :attr:`UHID_FEATURE_REPORT`, :attr:`UHID_INPUT_REPORT`, or :attr:`UHID_OUTPUT_REPORT`
+        """
+        key = (rtype, rnum)
+        if reply is None:
+            self._set_report_table.pop(key, None)
+        else:
+            self._set_report_table[key] = reply
 
     def output_report(self, data, size, rtype):
         """
@@ -492,27 +1053,29 @@ class UHIDDevice(object):
         logger.debug('output {} {} {}'.format(rtype, size, [f'{d:02x}' for d in data[:size]]))
 
     def _process_one_event(self):
-        buf = os.read(self._fd, 4380)
-        assert len(buf) == 4380
+        buf = self._event_buf
+        n = os.readv(self._fd, [buf])
+        assert n == UHIDDevice._UHID_EVENT_SIZE
         evtype = struct.unpack_from('< L', buf)[0]
         if evtype == UHIDDevice._UHID_START:
             ev, flags = struct.unpack_from('< L Q', buf)
-            self.start(flags)
+            self._run_callback(self.start(flags))
         elif evtype == UHIDDevice._UHID_OPEN:
-            self._open()
+            self._run_callback(self._open())
         elif evtype == UHIDDevice._UHID_STOP:
-            self._stop()
+            self._run_callback(self._stop())
         elif evtype == UHIDDevice._UHID_CLOSE:
-            self._close()
+            self._run_callback(self._close())
         elif evtype == UHIDDevice._UHID_SET_REPORT:
-            ev, req, rnum, rtype, size, data = struct.unpack_from('< L L B B H 4096s', buf)
-            self._set_report(req, rnum, rtype, size, data)
+            header = UHIDDevice._set_report_header
+            ev, req, rnum, rtype, size = header.unpack_from(buf)
+            self._set_report(req, rnum, rtype, memoryview(buf)[header.size:header.size + size])
         elif evtype == UHIDDevice._UHID_GET_REPORT:
-            ev, req, rnum, rtype = struct.unpack_from('< L L B B', buf)
+            ev, req, rnum, rtype = UHIDDevice._get_report_header.unpack_from(buf)
             self._get_report(req, rnum, rtype)
         elif evtype == UHIDDevice._UHID_OUTPUT:
             ev, data, size, rtype = struct.unpack_from('< L 4096s H B', buf)
-            self._output_report(data, size, rtype)
+            self._run_callback(self._output_report(data, size, rtype))
 
     def create_report(self, data, global_data=None, reportID=None, application=None):
         """
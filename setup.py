@@ -75,6 +75,7 @@ setup(name='hid-tools',
               'hid-decode= hidtools.cli.decode:main',
               'hid-recorder = hidtools.cli.record:main',
               'hid-replay = hidtools.cli.replay:main',
+              'hid-index = hidtools.cli.index:main',
           ]
       },
       classifiers=[
@@ -88,7 +89,8 @@ setup(name='hid-tools',
       include_package_data=True,
       install_requires=['parse', 'pyyaml'],
       extras_require={
-          'uhid': ['pyudev']
+          'uhid': ['pyudev'],
+          'zstd': ['zstandard'],
       },
       tests_require=['hid-tools[uhid]'],
       cmdclass=dict(
@@ -19,30 +19,39 @@
 #
 
 import libevdev
+import logging
 import os
 import pytest
 import sys
-import time
 
 # FIXME: this is really wrong :)
 sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + '/..')  # noqa
 
-import logging
-
 from hidtools.util import twos_comp, to_twos_comp # noqa
-from hidtools.device.base_device import BaseDevice, SysfsFile
+from hidtools.device.base_device import BaseDevice, SysfsFile  # noqa
+from hidtools.device.pool import DevicePool  # noqa
 
 logger = logging.getLogger('hidtools.test.base')
 
+# When running in parallel with pytest-xdist, the names and phys of the
+# devices and the udev rules are namespaced by the worker id.
+worker_id = os.environ.get('PYTEST_XDIST_WORKER')
+name_prefix = f'uhid test {worker_id} ' if worker_id else 'uhid test '
+
+# kernel devices shared by the test classes with use_pool set
+device_pool = DevicePool()
+
 
 class UHIDTestDevice(BaseDevice):
     def __init__(self, name, application, rdesc_str=None, rdesc=None, input_info=None):
         super().__init__(name, application, rdesc_str, rdesc, input_info)
         if name is None:
-            name = f'uhid test {self.__class__.__name__}'
-        if not name.startswith('uhid test '):
-            name = 'uhid test ' + self.name
-        self.name = name
+            name = self.__class__.__name__
+        elif name.startswith('uhid test '):
+            name = name[len('uhid test '):]
+        self.name = name_prefix + name
+        if worker_id:
+            self.phys = f'uhid-test-{worker_id}'
 
 
 class BaseTestCase:
@@ -53,6 +62,11 @@ class BaseTestCase:
         rel_event = libevdev.InputEvent(libevdev.EV_REL)
         msc_event = libevdev.InputEvent(libevdev.EV_MSC.MSC_SCAN)
 
+        # reuse the kernel device across the tests of a class, see
+        # DevicePool. Only set this if the tests do not depend on a
+        # freshly probed device.
+        use_pool = False
+
         def assertInputEventsIn(self, expected_events, effective_events):
             effective_events = effective_events.copy()
             for ev in expected_events:
@@ -107,21 +121,39 @@ class BaseTestCase:
 
         @pytest.fixture(autouse=True)
         def context(self, request):
-            with self.create_device() as self.uhdev:
-                skip_cond = request.node.get_closest_marker('skip_if_uhdev')
-                if skip_cond:
-                    test, message, *rest = skip_cond.args
-
-                    if test(self.uhdev):
-                        pytest.skip(message)
+            if self.use_pool:
+                yield from self._pooled_context(request)
+                return
 
+            with self.create_device() as self.uhdev:
+                self._skip_if_uhdev(request)
                 self.uhdev.create_kernel_device()
-                now = time.time()
-                while not self.uhdev_is_ready() and time.time() - now < 5:
-                    self.uhdev.dispatch(10)
+                self.uhdev.wait_for(self.uhdev_is_ready, timeout=5)
+                assert self.uhdev.evdev is not None
+                yield
+
+        def _pooled_context(self, request):
+            uhdev = self.create_device()
+            self.uhdev = uhdev
+            try:
+                self._skip_if_uhdev(request)
+            except BaseException:
+                uhdev.destroy()
+                raise
+
+            with device_pool.device(uhdev, key=type(self)) as self.uhdev:
+                self.uhdev.wait_for(self.uhdev_is_ready, timeout=5)
                 assert self.uhdev.evdev is not None
                 yield
 
+        def _skip_if_uhdev(self, request):
+            skip_cond = request.node.get_closest_marker('skip_if_uhdev')
+            if skip_cond:
+                test, message, *rest = skip_cond.args
+
+                if test(self.uhdev):
+                    pytest.skip(message)
+
         @pytest.fixture(autouse=True)
         def check_taint(self):
             # we are abusing SysfsFile here, it's in /proc, but meh
@@ -150,14 +182,19 @@ def reload_udev_rules():
     subprocess.run("udevadm hwdb --update".split())
 
 
+def udev_rule_path(uuid):
+    worker = f'{worker_id}-' if worker_id else ''
+    return f'/run/udev/rules.d/91-uhid-test-device-REMOVEME-{worker}{uuid}.rules'
+
+
 def create_udev_rule(uuid):
     os.makedirs('/run/udev/rules.d', exist_ok=True)
-    with open(f'/run/udev/rules.d/91-uhid-test-device-REMOVEME-{uuid}.rules', 'w') as f:
-        f.write('KERNELS=="*input*", ATTRS{name}=="uhid test *", ENV{LIBINPUT_IGNORE_DEVICE}="1"\n')
-        f.write('KERNELS=="*input*", ATTRS{name}=="uhid test * System Multi Axis", ENV{ID_INPUT_TOUCHSCREEN}="", ENV{ID_INPUT_SYSTEM_MULTIAXIS}="1"\n')
+    with open(udev_rule_path(uuid), 'w') as f:
+        f.write(f'KERNELS=="*input*", ATTRS{{name}}=="{name_prefix}*", ENV{{LIBINPUT_IGNORE_DEVICE}}="1"\n')
+        f.write(f'KERNELS=="*input*", ATTRS{{name}}=="{name_prefix}* System Multi Axis", ENV{{ID_INPUT_TOUCHSCREEN}}="", ENV{{ID_INPUT_SYSTEM_MULTIAXIS}}="1"\n')
     reload_udev_rules()
 
 
 def teardown_udev_rule(uuid):
-    os.remove(f'/run/udev/rules.d/91-uhid-test-device-REMOVEME-{uuid}.rules')
+    os.remove(udev_rule_path(uuid))
     reload_udev_rules()
@@ -21,7 +21,7 @@
 import pytest
 import resource
 import uuid
-from base import create_udev_rule, teardown_udev_rule
+from base import create_udev_rule, device_pool, teardown_udev_rule
 
 
 @pytest.fixture(autouse=True, scope="session")
@@ -30,6 +30,7 @@ def udev_rules_setup():
     print("setting up the udev rule")
     create_udev_rule(uid)
     yield
+    device_pool.clear()
     print("tearing down the udev rule")
     teardown_udev_rule(uid)
 
@@ -0,0 +1,46 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + '/../benchmarks')  # noqa
+
+import hid_benchmark  # noqa
+
+
+class TestBenchmark(object):
+    def test_descriptors(self):
+        binary, human = hid_benchmark.find_descriptors()
+        assert binary
+        assert human
+
+    def test_json(self, tmp_path):
+        output = tmp_path / 'results.json'
+        hid_benchmark.main(['--repeat', '1', '--reports', '10', '--events', '10', '--json', str(output)])
+
+        with open(output) as f:
+            results = json.load(f)
+
+        names = [r['name'] for r in results['results']]
+        assert names == [b.name for b in hid_benchmark.BENCHMARKS]
+        for r in results['results']:
+            assert r['ops'] > 0
+            assert r['best'] <= r['median']
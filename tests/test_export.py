@@ -0,0 +1,130 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import csv
+import io
+import math
+import pytest
+
+import hidtools.export
+import hidtools.hid
+from hidtools.export import CsvWriter, ExportError, NpzWriter, RecordingExporter, report_columns
+
+
+mouse = '52 05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 95 01 75 05 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0'
+# a two-finger touchscreen
+touchscreen = '217 05 0d 09 04 a1 01 85 01 05 0d 09 22 a1 02 75 01 95 01 15 00 25 01 09 42 81 02 75 07 25 7f 81 03 75 08 26 ff 00 09 51 81 02 75 10 55 0f 65 11 26 ff 0f 35 00 45 78 05 01 09 30 81 02 45 5a 09 31 81 02 05 0d 09 3f 26 68 01 65 11 75 10 81 02 c0 05 0d 09 22 a1 02 75 01 95 01 15 00 25 01 09 42 81 02 75 07 25 7f 81 03 75 08 26 ff 00 09 51 81 02 75 10 55 0f 65 11 26 ff 0f 35 00 45 78 05 01 09 30 81 02 45 5a 09 31 81 02 05 0d 09 3f 26 68 01 65 11 75 10 81 02 c0 55 0c 66 01 10 27 ff ff 00 00 47 ff ff 00 00 05 0d 09 56 81 02 75 08 26 ff 00 09 54 81 02 85 02 25 02 09 55 b1 02 c0 05 0d 09 04 a1 01 85 44 06 00 ff 09 c5 15 00 26 ff 00 75 08 96 00 01 b1 02 c0'
+keyboard = '45 05 01 09 06 a1 01 05 07 19 e0 29 e7 15 00 25 01 75 01 95 08 81 02 95 01 75 08 81 01 95 06 75 08 15 00 26 a4 00 05 07 19 00 2a a4 00 81 00 c0'
+
+recording = f'''D: 0
+R: {mouse}
+N: test mouse
+I: 3 0001 0001
+D: 1
+R: {keyboard}
+N: test keyboard
+I: 3 0001 0002
+D: 0
+# B1: 1 | X: 1 | Y: -1
+E: 000000.000000 3 01 01 ff
+E: 000000.008000 3 00 02 fe
+D: 1
+E: 000000.010000 8 02 00 04 05 00 00 00 00
+'''
+
+
+class TestExport(object):
+    def export_csv(self, text, **kwargs):
+        output = io.StringIO()
+        exporter = RecordingExporter(**kwargs)
+        exporter.export(io.StringIO(text), CsvWriter(output))
+        return exporter, list(csv.DictReader(io.StringIO(output.getvalue())))
+
+    def test_report_columns(self):
+        rdesc = hidtools.hid.ReportDescriptor.from_string(mouse)
+        names = [name for name, _, _ in report_columns(rdesc.input_reports[-1])]
+        assert names == ['b1', 'b2', 'b3', 'x', 'y']
+
+        rdesc = hidtools.hid.ReportDescriptor.from_string(keyboard)
+        names = [name for name, _, _ in report_columns(rdesc.input_reports[-1])]
+        assert names[-6:] == [f'keyboard[{i}]' for i in range(6)]
+
+    def test_multitouch_columns(self):
+        rdesc = hidtools.hid.ReportDescriptor.from_string(touchscreen)
+        names = [name for name, _, _ in report_columns(rdesc.input_reports[1])]
+        assert names.count('contactid') == 1
+        assert 'contactid.1' in names
+        assert len(names) == len(set(names))
+
+    @pytest.mark.parametrize('chunk_size', [1, 2, 4096])
+    def test_csv(self, chunk_size):
+        exporter, rows = self.export_csv(recording, chunk_size=chunk_size)
+        assert exporter.rows == 3
+        assert len(rows) == 3
+        assert [float(r['timestamp']) for r in rows] == [0.0, 0.008, 0.01]
+        assert [r['device'] for r in rows] == ['0', '0', '1']
+        assert (rows[0]['b1'], rows[0]['x'], rows[0]['y']) == ('1', '1', '-1')
+        assert (rows[1]['b1'], rows[1]['x'], rows[1]['y']) == ('0', '2', '-2')
+        assert rows[0]['leftshift'] == ''
+        assert rows[2]['x'] == ''
+        assert rows[2]['leftshift'] == '1'
+        assert (rows[2]['keyboard[0]'], rows[2]['keyboard[1]']) == ('4', '5')
+
+    def test_values(self):
+        # the exported values match HidField.get_values()
+        rdesc = hidtools.hid.ReportDescriptor.from_string(touchscreen)
+        report = rdesc.input_reports[1]
+        data = [0x01, 0x03, 0x01, 0x34, 0x12, 0xff, 0x0f, 0x02, 0x02, 0x10, 0x00, 0x20, 0x00, 0x56, 0x34, 0x02]
+        data += [0] * (report.size - len(data))
+        text = f'R: {touchscreen}\nE: 000000.000000 {len(data)} {" ".join(f"{b:02x}" for b in data)}\n'
+
+        _, rows = self.export_csv(text)
+        for name, field, index in report_columns(report):
+            assert rows[0][name] == str(field.get_values(data)[index])
+
+    def test_unknown_report(self):
+        exporter, rows = self.export_csv(f'R: {mouse}\nE: 000000.000000 5 01 02 03 04 05\n')
+        assert exporter.skipped == 1
+        assert rows == []
+
+    def test_new_columns(self):
+        text = f'D: 0\nR: {mouse}\nE: 000000.000000 3 01 01 ff\nD: 1\nR: {keyboard}\nE: 000000.010000 8 02 00 04 05 00 00 00 00\n'
+        with pytest.raises(ExportError):
+            self.export_csv(text, chunk_size=1)
+
+    def test_npz(self, tmp_path):
+        if hidtools.export.numpy is None:
+            with pytest.raises(ExportError):
+                NpzWriter(str(tmp_path / 'recording.npz'))
+            return
+
+        numpy = hidtools.export.numpy
+        path = str(tmp_path / 'recording.npz')
+        # device 1 is only known after the first chunk was written
+        text = f'D: 0\nR: {mouse}\nE: 000000.000000 3 01 01 ff\nD: 1\nR: {keyboard}\nE: 000000.010000 8 02 00 04 05 00 00 00 00\n'
+        RecordingExporter(chunk_size=1).export(io.StringIO(text), NpzWriter(path))
+
+        data = numpy.load(path)
+        assert list(data['device']) == [0, 1]
+        assert data['device'].dtype == numpy.int64
+        assert list(data['timestamp']) == [0.0, 0.01]
+        assert data['x'][0] == 1
+        assert math.isnan(data['x'][1])
+        assert math.isnan(data['leftshift'][0])
+        assert data['leftshift'][1] == 1
@@ -0,0 +1,149 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pytest
+
+from hidtools.fingerprint import DescriptorFingerprint, SimilarityIndex, report_fingerprint
+from hidtools.hid import ReportDescriptor
+from hidtools.index import RecordingIndex
+from hidtools.recording import open_recording
+
+
+mouse = ('05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 '
+         '95 01 75 05 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0')
+# the same layout with redundant global items
+mouse_redundant = ('05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 15 00 81 02 '
+                   '95 01 75 05 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 75 08 81 06 c0 c0')
+# the same layout with a list of button usages instead of a range
+mouse_usage_list = ('05 01 09 02 a1 01 09 01 a1 00 05 09 09 01 09 02 09 03 15 00 25 01 95 03 75 01 81 02 '
+                    '95 01 75 05 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0')
+# the same layout with the padding split over two items
+mouse_split_padding = ('05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 '
+                       '95 01 75 03 81 03 75 02 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0')
+# a wheel added
+mouse_wheel = ('05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 '
+               '95 01 75 05 81 03 05 01 09 30 09 31 09 38 15 81 25 7f 75 08 95 03 81 06 c0 c0')
+# 16 bit axes
+mouse_16bit = ('05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 '
+               '95 01 75 05 81 03 05 01 09 30 09 31 16 01 80 26 ff 7f 75 10 95 02 81 06 c0 c0')
+touchpad = ('05 0d 09 05 a1 01 85 01 09 22 a1 02 15 00 25 01 09 42 75 01 95 01 81 02 95 07 81 03 '
+            '75 08 95 01 25 0f 09 51 81 02 c0 05 0d 09 54 25 05 75 08 95 01 81 02 c0')
+
+
+def fingerprint(rdesc):
+    return DescriptorFingerprint.from_rdesc(ReportDescriptor.from_bytes(bytes.fromhex(rdesc)))
+
+
+class TestFingerprint(object):
+    @pytest.mark.parametrize('variant', [mouse_redundant, mouse_usage_list, mouse_split_padding])
+    def test_same_layout(self, variant):
+        assert variant != mouse
+        fp, other = fingerprint(mouse), fingerprint(variant)
+        assert fp.digest == other.digest
+        assert fp == other
+        assert fp.tokens == other.tokens
+        assert fp.similarity(other) == 1.0
+
+    def test_report_fingerprint(self):
+        a = ReportDescriptor.from_bytes(bytes.fromhex(mouse))
+        b = ReportDescriptor.from_bytes(bytes.fromhex(mouse_split_padding))
+        c = ReportDescriptor.from_bytes(bytes.fromhex(mouse_16bit))
+        assert report_fingerprint(a.input_reports[-1]) == report_fingerprint(b.input_reports[-1])
+        assert report_fingerprint(a.input_reports[-1]) != report_fingerprint(c.input_reports[-1])
+
+    def test_similarity(self):
+        fp = fingerprint(mouse)
+        wheel = fingerprint(mouse_wheel)
+        axes = fingerprint(mouse_16bit)
+        tp = fingerprint(touchpad)
+
+        assert fp != wheel
+        assert 0.5 < fp.similarity(wheel) < 1.0
+        assert fp.similarity(wheel) == wheel.similarity(fp)
+        assert fp.similarity(wheel) > fp.similarity(axes) > fp.similarity(tp)
+        assert fp.similarity(tp) == 0.0
+
+
+class TestSimilarityIndex(object):
+    @pytest.fixture
+    def index(self):
+        index = SimilarityIndex()
+        for key, rdesc in (('mouse', mouse), ('redundant', mouse_redundant), ('wheel', mouse_wheel),
+                           ('16bit', mouse_16bit), ('touchpad', touchpad)):
+            index.add(key, fingerprint(rdesc))
+        return index
+
+    def test_identical(self, index):
+        assert len(index) == 5
+        assert index.identical(fingerprint(mouse_usage_list)) == {'mouse', 'redundant'}
+        assert index.identical(fingerprint(touchpad)) == {'touchpad'}
+
+    def test_query(self, index):
+        results = index.query(fingerprint(mouse), threshold=0.5)
+        assert [key for _, key in results[:2]] == ['mouse', 'redundant']
+        assert results[0][0] == results[1][0] == 1.0
+        assert 'wheel' in [key for _, key in results]
+        assert 'touchpad' not in [key for _, key in results]
+
+        assert index.query(fingerprint(mouse), threshold=0.5, limit=1) == results[:1]
+        assert [key for _, key in index.query(fingerprint(touchpad))] == ['touchpad']
+
+    def test_remove(self, index):
+        signature = index.signature(fingerprint(mouse))
+        index.remove('mouse')
+        assert 'mouse' not in index
+        assert index.identical(fingerprint(mouse)) == {'redundant'}
+        assert [key for _, key in index.query(fingerprint(mouse), 1.0, signature=signature)] == ['redundant']
+
+        with pytest.raises(ValueError):
+            index.add('mouse', fingerprint(mouse), signature=signature[:8])
+
+
+class TestIndexFingerprints(object):
+    def write(self, path, rdesc, name):
+        data = bytes.fromhex(rdesc)
+        with open_recording(str(path), 'w') as f:
+            f.write(f'D: 0\nR: {len(data)} {data.hex(" ")}\nN: {name}\n')
+        return str(path)
+
+    def test_similar_descriptors(self, tmp_path):
+        with RecordingIndex(str(tmp_path / 'index.sqlite')) as index:
+            for i, (rdesc, name) in enumerate(((mouse, 'Mouse'), (mouse_redundant, 'Other Mouse'),
+                                               (mouse_wheel, 'Wheel Mouse'), (touchpad, 'Touchpad'))):
+                index.add(self.write(tmp_path / f'{i}.hid', rdesc, name))
+
+            fp = fingerprint(mouse)
+            devices = index.find_devices(layout=fp.digest[:12])
+            assert [d['name'] for d in devices] == ['Mouse', 'Other Mouse']
+            assert len({d['hash'] for d in devices}) == 2
+
+            results = index.similar_descriptors(fp, threshold=0.5)
+            assert {row['hash'] for _, row in results[:2]} == {d['hash'] for d in devices}
+            assert [s for s, _ in results[:2]] == [1.0, 1.0]
+            assert len(results) == 3
+            assert all(row['devices'] == 1 for _, row in results)
+
+            stored = index.fingerprint(devices[0]['hash'][:12])
+            assert stored == fp
+            assert stored.tokens == fp.tokens
+
+        # the similarity index is rebuilt from the database
+        with RecordingIndex(str(tmp_path / 'index.sqlite')) as index:
+            assert len(index.similar_descriptors(fp, threshold=0.5)) == 3
+            assert index.fingerprint('0000') is None
@@ -23,6 +23,7 @@ import libevdev
 import pytest
 
 from hidtools.device.base_gamepad import AsusGamepad, SaitekGamepad
+import hidtools.device.gamepad_motion as motion
 
 import logging
 logger = logging.getLogger('hidtools.test.gamepad')
@@ -180,6 +181,45 @@ class BaseTest:
             self._test_joystick_press('right_stick', (127, 191))
             self._test_joystick_press('right_stick', (None, 255))
 
+        def test_report_updates(self):
+            """the reports updated in place must match fresh reports"""
+            uhdev = self.uhdev
+
+            uhdev.event(left=(10, 20), buttons={1: True})
+            r = uhdev.create_report(right=(30, 40), buttons={1: False, 2: True})
+
+            # drop the kept reports, the next one is built from scratch
+            uhdev._report_states.clear()
+            assert uhdev.create_report() == r
+
+        def test_store_axes_override(self):
+            """create_report() must go through store_axes()"""
+            uhdev = self.uhdev
+
+            r = uhdev.create_report(left=(10, 20))
+            store_axes = uhdev.store_axes
+
+            def swapped(which, gamepad, data):
+                store_axes(which, gamepad, data[::-1])
+
+            uhdev.store_axes = swapped
+            uhdev._report_states.clear()
+            assert uhdev.create_report(left=(20, 10)) == r
+
+        def test_motion(self):
+            uhdev = self.uhdev
+
+            n = 200
+            frames = motion.frames(n, left=motion.sweep(n, (0, 0), (255, 255)),
+                                   buttons=motion.button_pattern(n, [1], period=20))
+            reports = motion.encode(uhdev, frames)
+            stats = motion.play(uhdev, reports, rate=1000)
+            assert stats.sent == n
+
+            uhdev.next_sync_events()
+            axis = uhdev.axes_map['left_stick']['x'].evdev
+            assert uhdev.evdev.value[axis] == 255
+
         @pytest.mark.skip_if_uhdev(lambda uhdev: 'Hat switch' not in uhdev.fields,
                                    'Device not compatible, missing Hat switch usage')
         @pytest.mark.parametrize('hat_value,expected_evdev,evdev_value',
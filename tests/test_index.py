@@ -0,0 +1,119 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import pytest
+
+from hidtools.index import RecordingIndex, descriptor_hash
+from hidtools.recording import open_recording
+
+
+mouse = '50 05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 95 01 75 05 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0'
+touchpad = '52 05 0d 09 05 a1 01 85 01 09 22 a1 02 15 00 25 01 09 42 75 01 95 01 81 02 95 07 81 03 75 08 95 01 25 0f 09 51 81 02 c0 05 0d 09 54 25 05 75 08 95 01 81 02 c0'
+
+recording = f'''D: 0
+R: {mouse}
+N: Test Mouse
+P: usb-0000:00:14.0-1/input0
+I: 3 046d c077
+D: 1
+R: {touchpad}
+N: Test Touchpad
+I: 18 06cb 0001
+D: 0
+# B1: 1 | X: 1 | Y: -1
+E: 000001.000000 3 01 01 ff
+E: 000001.008000 3 00 02 fe
+D: 1
+E: 000002.500000 4 01 01 03 01
+'''
+
+
+class TestIndex(object):
+    @pytest.fixture
+    def index(self, tmp_path):
+        with RecordingIndex(str(tmp_path / 'index.sqlite')) as index:
+            yield index
+
+    def write(self, path, text=recording):
+        with open_recording(str(path), 'w') as f:
+            f.write(text)
+        return str(path)
+
+    def test_add(self, index, tmp_path):
+        path = self.write(tmp_path / 'rec.hid.gz')
+        assert index.add(path) is not None
+        # unchanged recordings are skipped
+        assert index.add(path) is None
+        assert index.add(path, force=True) is not None
+
+        assert index.stats() == {'recordings': 1, 'devices': 2, 'descriptors': 2, 'events': 3}
+
+        r = index.db.execute('SELECT * FROM recordings').fetchone()
+        assert r['path'] == os.path.abspath(path)
+        assert (r['events'], r['first_timestamp'], r['last_timestamp']) == (3, 1.0, 2.5)
+
+        devices = index.find_devices()
+        assert [d['name'] for d in devices] == ['Test Mouse', 'Test Touchpad']
+        mouse_device = devices[0]
+        assert (mouse_device['bus'], mouse_device['vid'], mouse_device['pid']) == (3, 0x046d, 0xc077)
+        assert mouse_device['phys'] == 'usb-0000:00:14.0-1/input0'
+        assert mouse_device['events'] == 2
+        assert mouse_device['hash'] == descriptor_hash(bytes.fromhex(mouse.split(' ', 1)[1]))
+
+    def test_deduplicated_descriptors(self, index, tmp_path):
+        for i in range(3):
+            index.add(self.write(tmp_path / f'rec{i}.hid'))
+        assert index.stats()['descriptors'] == 2
+        assert len(index.find_devices(name='Test Mouse')) == 3
+
+    def test_find_devices(self, index, tmp_path):
+        index.add(self.write(tmp_path / 'rec.hid'))
+
+        for application in ['Touch Pad', 'touch pad', 'Digitizers Touch Pad']:
+            assert [d['name'] for d in index.find_devices(application=application)] == ['Test Touchpad']
+        assert [d['name'] for d in index.find_devices(application='Mouse')] == ['Test Mouse']
+        assert index.find_devices(application='Touch Screen') == []
+
+        assert [d['name'] for d in index.find_devices(usage='Contact Count')] == ['Test Touchpad']
+        assert [d['name'] for d in index.find_devices(usage='Generic Desktop X')] == ['Test Mouse']
+        assert [d['name'] for d in index.find_devices(name='*Mouse')] == ['Test Mouse']
+        assert [d['name'] for d in index.find_devices(vid=0x06cb)] == ['Test Touchpad']
+        assert index.find_devices(vid=0x06cb, application='Mouse') == []
+
+        digest = index.find_devices(name='Test Mouse')[0]['hash']
+        assert [d['name'] for d in index.find_devices(descriptor=digest[:8])] == ['Test Mouse']
+
+    def test_events(self, index, tmp_path):
+        path = self.write(tmp_path / 'rec.hid')
+        index.add(path)
+        device = index.find_devices(name='Test Mouse')[0]
+        assert list(index.iter_events(device['id'])) == []
+
+        index.add(path, store_events=True, force=True)
+        device = index.find_devices(name='Test Mouse')[0]
+        assert list(index.iter_events(device['id'])) == [(1.0, b'\x01\x01\xff'), (1.008, b'\x00\x02\xfe')]
+
+    def test_changed_recording(self, index, tmp_path):
+        path = self.write(tmp_path / 'rec.hid')
+        index.add(path)
+        self.write(path, recording.split('D: 1')[0])
+        os.utime(path, (0, 0))
+        assert index.add(path) is not None
+        assert index.stats() == {'recordings': 1, 'devices': 1, 'descriptors': 2, 'events': 0}
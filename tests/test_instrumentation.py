@@ -0,0 +1,120 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import pytest
+import socket
+
+import hidtools.instrumentation as instrumentation
+from hidtools.cli.parse_hid import parse_hid
+from hidtools.hidraw import HidrawDevice
+from hidtools.instrumentation import timed
+
+
+@timed('test.echo', lambda args, r: len(r))
+def echo(data):
+    return data
+
+
+recording = '''R: 52 05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 95 03 75 01 81 02 95 01 75 05 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0
+N: test mouse
+I: 3 0001 0001
+E: 000000.000000 3 00 01 ff
+E: 000000.008000 3 01 00 00
+'''
+
+
+class TestInstrumentation(object):
+    @pytest.fixture(autouse=True)
+    def instrumented(self):
+        instrumentation.reset()
+        yield
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled(self):
+        assert echo(b'abc') == b'abc'
+        assert 'test.echo' not in instrumentation.snapshot()
+
+    def test_counters(self):
+        instrumentation.enable()
+        echo(b'abc')
+        echo(b'de')
+
+        stats = instrumentation.snapshot()['test.echo']
+        assert stats['count'] == 2
+        assert stats['bytes'] == 5
+        assert sum(stats['buckets']) == 2
+        assert stats['p50_us'] <= stats['p99_us']
+        assert 'test.echo: 2x 5B' in instrumentation.summary_line()
+
+    def test_interval(self):
+        instrumentation.enable()
+        echo(b'abc')
+        previous = instrumentation.snapshot()
+        echo(b'abcd')
+        echo(b'abcd')
+
+        line = instrumentation.summary_line(instrumentation.snapshot(), previous, 2.0)
+        assert 'test.echo: 1/s 4B/s' in line
+
+    def test_interval_p99(self):
+        s = instrumentation.stage('test.interval')
+        s.add(0.1)
+        previous = instrumentation.snapshot()
+        for _ in range(10):
+            s.add(0.00001)
+
+        # the slow call before the previous snapshot does not count
+        line = instrumentation.summary_line(instrumentation.snapshot(), previous, 1.0)
+        assert 'test.interval: 10/s mean 10.0us p99<16us' in line
+        assert 'p99<131072us' in instrumentation.summary_line()
+
+    def test_parse_hid(self):
+        instrumentation.enable()
+        parse_hid(io.StringIO(recording), io.StringIO())
+
+        stats = instrumentation.snapshot()
+        assert stats['rdesc.get']['count'] == 2
+        assert stats['report.format_report']['count'] == 2
+        assert stats['report.format_report']['bytes'] == 6
+
+    def test_hidraw_read_events(self):
+        reader, device = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        with reader, device:
+            reader.setblocking(False)
+            # skip the ioctls of __init__, a socket keeps the reports apart
+            hidraw = object.__new__(HidrawDevice)
+            hidraw.device = reader
+            hidraw.events = []
+            hidraw.time_offset = None
+
+            instrumentation.enable()
+            device.send(b'\x01\x02\x03')
+            device.send(b'\x04\x05\x06')
+            hidraw.read_events()
+            device.send(b'\x07\x08')
+            hidraw.read_events()
+            # nothing pending
+            hidraw.read_events()
+
+        assert len(hidraw.events) == 3
+        stats = instrumentation.snapshot()['hidraw.read_events']
+        assert stats['count'] == 3
+        assert stats['bytes'] == 8
@@ -40,6 +40,10 @@ class BaseKeyboard(base.UHIDTestDevice):
         super().__init__(name, 'Key', input_info=input_info, rdesc=rdesc)
         self.keystates = {}
 
+    def reset(self):
+        super().reset()
+        self.keystates = {}
+
     def _update_key_state(self, keys):
         """
         Update the internal state of keys with the new state given.
@@ -262,6 +266,8 @@ class PrimaxKeyboard(ArrayKeyboard):
 
 class BaseTest:
     class TestKeyboard(base.BaseTestCase.TestUhid):
+        use_pool = True
+
         def test_single_key(self):
             """check for key reliability."""
             uhdev = self.uhdev
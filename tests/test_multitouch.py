@@ -23,9 +23,11 @@ from hidtools.hut import HUT
 import libevdev
 import logging
 import pytest
-import sys
 import time
 
+from hidtools.device.multitouch import Touch
+import hidtools.device.multitouch as multitouch
+
 logger = logging.getLogger('hidtools.test.multitouch')
 
 
@@ -56,336 +58,20 @@ mt_quirks = {
 }
 
 
-class Data(object):
+class Digitizer(multitouch.Digitizer, base.UHIDTestDevice):
     pass
 
 
-class Touch(object):
-    def __init__(self, id, x, y):
-        self.contactid = id
-        self.x = x
-        self.y = y
-        self.cx = x
-        self.cy = y
-        self.tipswitch = True
-        self.confidence = True
-        self.tippressure = 15
-        self.azimuth = 0
-        self.inrange = True
-        self.width = 10
-        self.height = 10
-
-
-class Pen(Touch):
-    def __init__(self, x, y):
-        super().__init__(0, x, y)
-        self.barrel = False
-        self.invert = False
-        self.eraser = False
-        self.x_tilt = False
-        self.y_tilt = False
-        self.twist = 0
-
-
-class Digitizer(base.UHIDTestDevice):
-    @classmethod
-    def msCertificationBlob(cls, reportID):
-        return f'''
-        Usage Page (Digitizers)
-        Usage (Touch Screen)
-        Collection (Application)
-         Report ID ({reportID})
-         Usage Page (0xff00)
-         Usage (0xc5)
-         Logical Minimum (0)
-         Logical Maximum (255)
-         Report Size (8)
-         Report Count (256)
-         Feature (Data,Var,Abs)
-        End Collection
-    '''
-
-    def __init__(self, name, rdesc_str=None, rdesc=None, application='Touch Screen', physical='Finger', max_contacts=None, input_info=(3, 1, 2), quirks=None):
-        super().__init__(name, application, rdesc_str, rdesc, input_info)
-        self.scantime = 0
-        self.quirks = quirks
-        if max_contacts is None:
-            self.max_contacts = sys.maxsize
-            for features in self.parsed_rdesc.feature_reports.values():
-                for feature in features:
-                    if feature.usage_name in ['Contact Max']:
-                        self.max_contacts = feature.logical_max
-            for inputs in self.parsed_rdesc.input_reports.values():
-                for i in inputs:
-                    if (i.usage_name in ['Contact Count'] and
-                       i.logical_max > 0 and
-                       self.max_contacts > i.logical_max):
-                        self.max_contacts = i.logical_max
-            if self.max_contacts == sys.maxsize:
-                self.max_contacts = 1
-        else:
-            self.max_contacts = max_contacts
-        self.physical = physical
-        self.cur_application = application
-
-        for features in self.parsed_rdesc.feature_reports.values():
-            for feature in features:
-                if feature.usage_name == 'Inputmode':
-                    self.cur_application = 'Mouse'
-
-        self.fields = []
-        for r in self.parsed_rdesc.input_reports.values():
-            if r.application_name == self.application:
-                physicals = [f.physical_name for f in r]
-                if self.physical not in physicals and None not in physicals:
-                    continue
-                self.fields = [f.usage_name for f in r]
-
-    @property
-    def touches_in_a_report(self):
-        return self.fields.count('Contact Id')
-
-    def event(self, slots, global_data=None, contact_count=None, incr_scantime=True):
-        if incr_scantime:
-            self.scantime += 1
-        rs = []
-        # make sure we have only the required number of available slots
-        slots = slots[:self.max_contacts]
-
-        if global_data is None:
-            global_data = Data()
-        if contact_count is None:
-            global_data.contactcount = len(slots)
-        else:
-            global_data.contactcount = contact_count
-        global_data.scantime = self.scantime
-
-        while len(slots):
-            r = self.create_report(application=self.cur_application, data=slots, global_data=global_data)
-            self.call_input_event(r)
-            rs.append(r)
-            global_data.contactcount = 0
-        return rs
-
-    def get_report(self, req, rnum, rtype):
-        if rtype != self.UHID_FEATURE_REPORT:
-            return (1, [])
-
-        rdesc = None
-        for v in self.parsed_rdesc.feature_reports.values():
-            if v.report_ID == rnum:
-                rdesc = v
-
-        if rdesc is None:
-            return (1, [])
-
-        if 'Contact Max' not in [f.usage_name for f in rdesc]:
-            return (1, [])
-
-        self.contactmax = self.max_contacts
-        r = rdesc.create_report([self], None)
-        return (0, r)
-
-    def set_report(self, req, rnum, rtype, data):
-        if rtype != self.UHID_FEATURE_REPORT:
-            return 1
-
-        rdesc = None
-        for v in self.parsed_rdesc.feature_reports.values():
-            if v.report_ID == rnum:
-                rdesc = v
-
-        if rdesc is None:
-            return 1
-
-        if 'Inputmode' not in [f.usage_name for f in rdesc]:
-            return 0
-
-        Inputmode_seen = False
-        for f in rdesc:
-            if 'Inputmode' == f.usage_name:
-                values = f.get_values(data)
-                assert len(values) == 1
-                value = values[0]
-
-                if not Inputmode_seen:
-                    Inputmode_seen = True
-                    if value == 0:
-                        self.cur_application = 'Mouse'
-                    elif value == 2:
-                        self.cur_application = 'Touch Screen'
-                    elif value == 3:
-                        self.cur_application = 'Touch Pad'
-                else:
-                    if value != 0:
-                        # Elan bug where the device doesn't work properly
-                        # if we set twice an Input Mode in the same Feature
-                        self.cur_application = 'Mouse'
-
-        return 0
-
-
-class PTP(Digitizer):
-    def __init__(self, name, type='Click Pad', rdesc_str=None, rdesc=None, application='Touch Pad', physical='Pointer', max_contacts=None, input_info=None):
-        self.type = type.lower().replace(' ', '')
-        if self.type == 'clickpad':
-            self.buttontype = 0
-        else:  # pressurepad
-            self.buttontype = 1
-        self.clickpad_state = False
-        self.left_state = False
-        self.right_state = False
-        super().__init__(name, rdesc_str, rdesc, application, physical, max_contacts, input_info)
-
-    def event(self, slots=None, click=None, left=None, right=None, contact_count=None, incr_scantime=True):
-        # update our internal state
-        if click is not None:
-            self.clickpad_state = click
-        if left is not None:
-            self.left_state = left
-        if right is not None:
-            self.right_state = right
-
-        # now create the global data
-        global_data = Data()
-        global_data.b1 = 1 if self.clickpad_state else 0
-        global_data.b2 = 1 if self.left_state else 0
-        global_data.b3 = 1 if self.right_state else 0
-
-        if slots is None:
-            slots = [Data()]
-
-        return super().event(slots, global_data, contact_count, incr_scantime)
-
-
-class MinWin8TSParallel(Digitizer):
-    def __init__(self, max_slots):
-        self.max_slots = max_slots
-        self.phys_max = 120, 90
-        rdesc_finger_str = f'''
-            Usage Page (Digitizers)
-            Usage (Finger)
-            Collection (Logical)
-             Report Size (1)
-             Report Count (1)
-             Logical Minimum (0)
-             Logical Maximum (1)
-             Usage (Tip Switch)
-             Input (Data,Var,Abs)
-             Report Size (7)
-             Logical Maximum (127)
-             Input (Cnst,Var,Abs)
-             Report Size (8)
-             Logical Maximum (255)
-             Usage (Contact Id)
-             Input (Data,Var,Abs)
-             Report Size (16)
-             Unit Exponent (-1)
-             Unit (Centimeter,SILinear)
-             Logical Maximum (4095)
-             Physical Minimum (0)
-             Physical Maximum ({self.phys_max[0]})
-             Usage Page (Generic Desktop)
-             Usage (X)
-             Input (Data,Var,Abs)
-             Physical Maximum ({self.phys_max[1]})
-             Usage (Y)
-             Input (Data,Var,Abs)
-             Usage Page (Digitizers)
-             Usage (Azimuth)
-             Logical Maximum (360)
-             Unit (Degrees,SILinear)
-             Report Size (16)
-             Input (Data,Var,Abs)
-            End Collection
-'''
-        rdesc_str = f'''
-           Usage Page (Digitizers)
-           Usage (Touch Screen)
-           Collection (Application)
-            Report ID (1)
-            {rdesc_finger_str * self.max_slots}
-            Unit Exponent (-4)
-            Unit (Seconds,SILinear)
-            Logical Maximum (65535)
-            Physical Maximum (65535)
-            Usage Page (Digitizers)
-            Usage (Scan Time)
-            Input (Data,Var,Abs)
-            Report Size (8)
-            Logical Maximum (255)
-            Usage (Contact Count)
-            Input (Data,Var,Abs)
-            Report ID (2)
-            Logical Maximum ({self.max_slots})
-            Usage (Contact Max)
-            Feature (Data,Var,Abs)
-          End Collection
-          {Digitizer.msCertificationBlob(68)}
-'''
-        super().__init__(f'uhid test parallel {self.max_slots}', rdesc_str)
+class PTP(multitouch.PTP, base.UHIDTestDevice):
+    pass
 
 
-class MinWin8TSHybrid(Digitizer):
-    def __init__(self):
-        self.max_slots = 10
-        self.phys_max = 120, 90
-        rdesc_finger_str = f'''
-            Usage Page (Digitizers)
-            Usage (Finger)
-            Collection (Logical)
-             Report Size (1)
-             Report Count (1)
-             Logical Minimum (0)
-             Logical Maximum (1)
-             Usage (Tip Switch)
-             Input (Data,Var,Abs)
-             Report Size (7)
-             Logical Maximum (127)
-             Input (Cnst,Var,Abs)
-             Report Size (8)
-             Logical Maximum (255)
-             Usage (Contact Id)
-             Input (Data,Var,Abs)
-             Report Size (16)
-             Unit Exponent (-1)
-             Unit (Centimeter,SILinear)
-             Logical Maximum (4095)
-             Physical Minimum (0)
-             Physical Maximum ({self.phys_max[0]})
-             Usage Page (Generic Desktop)
-             Usage (X)
-             Input (Data,Var,Abs)
-             Physical Maximum ({self.phys_max[1]})
-             Usage (Y)
-             Input (Data,Var,Abs)
-            End Collection
-'''
-        rdesc_str = f'''
-           Usage Page (Digitizers)
-           Usage (Touch Screen)
-           Collection (Application)
-            Report ID (1)
-            {rdesc_finger_str * 2}
-            Unit Exponent (-4)
-            Unit (Seconds,SILinear)
-            Logical Maximum (65535)
-            Physical Maximum (65535)
-            Usage Page (Digitizers)
-            Usage (Scan Time)
-            Input (Data,Var,Abs)
-            Report Size (8)
-            Logical Maximum (255)
-            Usage (Contact Count)
-            Input (Data,Var,Abs)
-            Report ID (2)
-            Logical Maximum ({self.max_slots})
-            Usage (Contact Max)
-            Feature (Data,Var,Abs)
-          End Collection
-          {Digitizer.msCertificationBlob(68)}
-'''
-        super().__init__('uhid test hybrid', rdesc_str)
+class MinWin8TSParallel(multitouch.MinWin8TSParallel, base.UHIDTestDevice):
+    pass
+
+
+class MinWin8TSHybrid(multitouch.MinWin8TSHybrid, base.UHIDTestDevice):
+    pass
 
 
 class Win8TSConfidence(Digitizer):
@@ -471,6 +157,9 @@ class SmartTechDigitizer(Digitizer):
         # the report ID to use what the device sends
         return super().create_report(data, global_data=global_data, reportID=3)
 
+    def input_report(self):
+        return self.parsed_rdesc.input_reports[3]
+
     def match_evdev_rule(self, application, evdev):
         # we need to select the correct evdev node, as the device has multiple
         # Touch Screen application collections
@@ -905,6 +594,37 @@ class BaseTest:
             # orientation is clockwise, while Azimuth is counter clockwise
             assert libevdev.InputEvent(libevdev.EV_ABS.ABS_MT_ORIENTATION, 90) in events
 
+        def test_mt_encode_frames(self):
+            """send a swipe of the maximum number of contacts encoded with
+            encode_frames() and check the last positions. Release and
+            check."""
+            uhdev = self.uhdev
+
+            fields = multitouch.TOUCH_FIELDS + ('inrange',)
+            frames = multitouch.swipe(5, fingers=uhdev.max_contacts, start=(60, 65),
+                                      end=(100, 105), spacing=(20, 20), release=False)
+            frames = [[t + (True,) for t in frame] for frame in frames]
+            reports = uhdev.encode_frames(frames, fields)
+            uhdev.call_input_events([r for frame in reports for r in frame])
+            events = uhdev.next_sync_events()
+            self.debug_reports(reports[-1], uhdev, events)
+            for i, (contactid, x, y, *_) in enumerate(frames[-1]):
+                slot = self.get_slot(uhdev, Touch(contactid, x, y), i)
+
+                assert uhdev.evdev.slots[slot][libevdev.EV_ABS.ABS_MT_TRACKING_ID] != -1
+                assert uhdev.evdev.slots[slot][libevdev.EV_ABS.ABS_MT_POSITION_X] == x
+                assert uhdev.evdev.slots[slot][libevdev.EV_ABS.ABS_MT_POSITION_Y] == y
+
+            release = [[(contactid, x, y, False, True, False) for contactid, x, y, *_ in frames[-1]]]
+            reports = uhdev.encode_frames(release, fields)
+            uhdev.call_input_events(reports[0])
+            events = uhdev.next_sync_events()
+            self.debug_reports(reports[0], uhdev, events)
+            for i, (contactid, x, y, *_) in enumerate(frames[-1]):
+                slot = self.get_slot(uhdev, Touch(contactid, x, y), i)
+
+                assert uhdev.evdev.slots[slot][libevdev.EV_ABS.ABS_MT_TRACKING_ID] == -1
+
     class TestPTP(TestWin8Multitouch):
         def assertName(self, uhdev):
             assert uhdev.name in uhdev.evdev.name
@@ -0,0 +1,61 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from hidtools.device.playback import PlaybackStats, play_batches
+
+
+class FakeDevice(object):
+    def __init__(self):
+        self.calls = []
+
+    def call_input_events(self, reports):
+        self.calls.append(list(reports))
+
+
+class TestPlayback(object):
+    def test_batches(self):
+        device = FakeDevice()
+        batches = [[bytes([i, j]) for j in range(i % 3)] for i in range(50)]
+        sent = []
+        stats = play_batches(device, batches, rate=5000, on_send=lambda first, last: sent.append((first, last)))
+
+        assert isinstance(stats, PlaybackStats)
+        assert stats.sent == 50
+        assert stats.duration > 0
+        assert stats.rate > 0
+        # all reports in order, the reports of a batch always sent together
+        assert [r for call in device.calls for r in call] == [r for b in batches for r in b]
+        assert len(sent) == len(device.calls)
+        assert sent[0][0] == 0 and sent[-1][1] == 50
+        assert all(a[1] == b[0] for a, b in zip(sent, sent[1:]))
+        for (first, last), call in zip(sent, device.calls):
+            assert call == [r for b in batches[first:last] for r in b]
+
+    def test_pacing(self):
+        device = FakeDevice()
+        stats = play_batches(device, [[b'\x01']] * 5, rate=100)
+        # the last batch is due after 4 intervals
+        assert stats.duration >= 0.04
+        assert stats.sent == 5
+
+    def test_empty(self):
+        device = FakeDevice()
+        stats = play_batches(device, [], rate=100)
+        assert stats.sent == 0
+        assert device.calls == []
@@ -0,0 +1,450 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from hidtools.recording import open_recording, compression_from_data, UnsupportedCompression
+from hidtools.recording import segment_path, SegmentedRecording, RotatingOutput
+from hidtools.hid import ReportDescriptor
+from hidtools.hidraw import HIDRAW_BUFFER_SIZE, HidrawDevice, HidrawEvent, OverrunDetector
+from hidtools.cli.record import HidRecorder, RecordingWriter
+import hidtools.cli.record
+import hidtools.recording
+
+import io
+import logging
+import os
+import pytest
+import select
+import socket
+import sys
+logger = logging.getLogger('hidtools.test.recording')
+
+
+recording = '''R: 50 05 01 09 02 a1 01 09 01 a1 00 05 09 19 01 29 03 15 00 25 01 75 01 95 03 81 02 75 05 95 01 81 03 05 01 09 30 09 31 15 81 25 7f 75 08 95 02 81 06 c0 c0
+N: Test Mouse
+I: 3 0001 0002
+E: 000000.000000 3 01 00 00
+E: 000000.008000 3 00 01 ff
+'''
+
+
+class TestCompression(object):
+    @pytest.mark.parametrize('compression', [None, 'gzip', 'xz', 'bz2', 'zstd'])
+    def test_roundtrip(self, tmp_path, compression):
+        if compression == 'zstd' and hidtools.recording.zstandard is None:
+            pytest.skip('zstandard is not installed')
+
+        path = str(tmp_path / 'recording.hid')
+        with open_recording(path, 'w', compression) as f:
+            f.write(recording)
+
+        with open(path, 'rb') as f:
+            assert compression_from_data(f.read(8)) == compression
+
+        with open_recording(path) as f:
+            assert f.read() == recording
+
+    @pytest.mark.parametrize('extension,compression', [('.gz', 'gzip'), ('.xz', 'xz'), ('.bz2', 'bz2')])
+    def test_compression_from_extension(self, tmp_path, extension, compression):
+        path = str(tmp_path / f'recording.hid{extension}')
+        with open_recording(path, 'w') as f:
+            f.write(recording)
+
+        with open(path, 'rb') as f:
+            assert compression_from_data(f.read(8)) == compression
+
+    def test_unknown_compression(self, tmp_path):
+        with pytest.raises(UnsupportedCompression):
+            open_recording(str(tmp_path / 'recording.hid'), 'w', 'foo')
+
+
+class TestSegments(object):
+    header = recording.split('E:')[0]
+
+    def test_segment_path(self):
+        assert segment_path('/tmp/rec.hid', 0) == '/tmp/rec-0000.hid'
+        assert segment_path('/tmp/rec.hid.xz', 12) == '/tmp/rec-0012.hid.xz'
+        assert segment_path('rec', 1) == 'rec-0001'
+
+    def test_rotating_output(self, tmp_path):
+        path = str(tmp_path / 'rec.hid.gz')
+        with RotatingOutput(path, max_size=1) as output:
+            output.write(self.header)
+            output.flush()
+            assert output.should_rotate()
+            output.rotate()
+            output.write(self.header)
+
+        assert output.segments == [segment_path(path, 0), segment_path(path, 1)]
+        for segment in output.segments:
+            with open_recording(segment) as f:
+                assert f.read() == self.header
+
+    def test_single_device(self, tmp_path):
+        segments = []
+        for i in range(3):
+            path = str(tmp_path / f'rec-{i}.hid')
+            with open(path, 'w') as f:
+                f.write(self.header)
+                f.write(f'E: 00000{i}.000000 3 01 00 00\n')
+            segments.append(path)
+
+        with SegmentedRecording(segments) as f:
+            lines = list(f)
+
+        assert len([l for l in lines if l.startswith('R:')]) == 1
+        assert [l for l in lines if l.startswith('E:')] == [f'E: 00000{i}.000000 3 01 00 00\n' for i in range(3)]
+        assert not [l for l in lines if l.startswith('D:')]
+
+    def test_multiple_devices(self, tmp_path):
+        first = str(tmp_path / 'rec-0.hid')
+        with open(first, 'w') as f:
+            f.write(f'D: 0\n{self.header}D: 1\n{self.header}')
+            f.write('D: 0\nE: 000000.000000 3 01 00 00\n')
+            f.write('D: 1\nE: 000001.000000 3 01 00 00\n')
+        # device 0 was removed, device 2 was added before the rotation
+        second = str(tmp_path / 'rec-1.hid')
+        with open(second, 'w') as f:
+            f.write(f'D: 1\n{self.header}D: 2\n{self.header}')
+            f.write('E: 000002.000000 3 01 00 00\n')
+
+        with SegmentedRecording([first, second]) as f:
+            lines = []
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+
+        assert len([l for l in lines if l.startswith('R:')]) == 3
+        device = None
+        events = []
+        for l in lines:
+            if l.startswith('D:'):
+                device = int(l[2:])
+            elif l.startswith('E:'):
+                events.append((device, l[3:9]))
+        assert events == [(0, '000000'), (1, '000001'), (2, '000002')]
+
+    def test_device_added_mid_segment(self, tmp_path):
+        first = str(tmp_path / 'rec-0.hid')
+        with open(first, 'w') as f:
+            f.write(f'D: 0\n{self.header}')
+            f.write('E: 000000.000000 3 01 00 00\n')
+            # device 1 is hotplugged after the first event
+            f.write(f'D: 1\n{self.header}')
+            f.write('E: 000001.000000 3 01 00 00\n')
+        second = str(tmp_path / 'rec-1.hid')
+        with open(second, 'w') as f:
+            f.write(f'D: 0\n{self.header}D: 1\n{self.header}')
+            f.write('D: 1\nE: 000002.000000 3 01 00 00\n')
+
+        with SegmentedRecording([first, second]) as f:
+            lines = list(f)
+
+        assert len([l for l in lines if l.startswith('R:')]) == 2
+        assert len([l for l in lines if l.startswith('N:')]) == 2
+        device = None
+        events = []
+        for l in lines:
+            if l.startswith('D:'):
+                device = int(l[2:])
+            elif l.startswith('E:'):
+                events.append((device, l[3:9]))
+        assert events == [(0, '000000'), (1, '000001'), (1, '000002')]
+
+
+class FakeHidrawDevice(object):
+    name = 'fake device'
+
+    def dump(self, file, from_the_beginning=False):
+        print(f'N: {self.name}', file=file)
+
+    def format_event(self, event, annotate=True):
+        comment = f'# {len(event.bytes)} bytes\n' if annotate else ''
+        return f'{comment}E: {event.sec:06d}.{event.usec:06d} {len(event.bytes)}\n'
+
+
+class FakeUdevDevice(object):
+    def __init__(self, device_node, action='add'):
+        self.device_node = device_node
+        self.action = action
+
+
+class FakeMonitor(object):
+    def __init__(self, devices):
+        self.devices = list(devices)
+
+    def poll(self, timeout=None):
+        return self.devices.pop(0) if self.devices else None
+
+
+class TestHotplug(object):
+    def test_unusable_nodes(self, tmp_path, capsys, monkeypatch):
+        recorder = HidRecorder(io.StringIO())
+        # opening works but the hidraw ioctls fail
+        not_hidraw = tmp_path / 'hidraw0'
+        not_hidraw.write_text('')
+        denied = str(tmp_path / 'hidraw1')
+
+        real_open = open
+
+        def fake_open(path, *args, **kwargs):
+            if path == denied:
+                raise PermissionError(13, 'Permission denied', path)
+            return real_open(path, *args, **kwargs)
+
+        monkeypatch.setattr('builtins.open', fake_open)
+        recorder._monitor = FakeMonitor([
+            FakeUdevDevice(str(not_hidraw)),
+            FakeUdevDevice(denied),
+            FakeUdevDevice(str(tmp_path / 'hidraw2')),  # already removed
+            FakeUdevDevice(None),
+        ])
+        recorder._process_udev_events()
+        monkeypatch.undo()
+
+        assert recorder.device_count == 0
+        err = capsys.readouterr().err.splitlines()
+        assert len(err) == 2
+        assert err[0].startswith(f'Skipping {not_hidraw}: ')
+        assert err[1].startswith(f'Skipping {denied}: ')
+        assert 'Permission denied' in err[1]
+
+
+class TestRecordingWriter(object):
+    def writer(self, max_queue_size=4):
+        output = io.StringIO()
+        writer = RecordingWriter(output, max_queue_size=max_queue_size)
+        writes = []
+
+        def write(data):
+            writes.append(data)
+            output.write(data)
+
+        writer._write = write
+        return writer, output, writes
+
+    def events(self, output):
+        return [l for l in output.getvalue().splitlines() if l.startswith('E:')]
+
+    def test_queue_full(self):
+        writer, output, writes = self.writer()
+        writer.queue_device(0, FakeHidrawDevice())
+        # the device description takes one of the 4 slots
+        results = [writer.queue_event(0, 1.0 + i, b'\x01') for i in range(5)]
+        assert results == [True, True, True, False, False]
+        assert writer.dropped == 2
+        assert writer.queue_depth == 4
+
+        writer.start()
+        writer.stop()
+        assert writer.max_queue_depth == 4
+        assert writer.written == 3
+        assert writer.dropped == 2
+        assert self.events(output) == ['E: 000000.000000 1',
+                                       'E: 000001.000000 1',
+                                       'E: 000002.000000 1']
+
+    def test_batching(self):
+        writer, output, writes = self.writer(max_queue_size=64)
+        writer.queue_device(0, FakeHidrawDevice())
+        for i in range(20):
+            assert writer.queue_event(0, 1.0 + i / 1000, b'\x01\x02')
+        assert writer.queue_depth == 21
+
+        writer.start()
+        writer.stop()
+        # the stop request may already be queued when the depth is sampled
+        assert writer.max_queue_depth in (21, 22)
+        assert writer.dropped == 0
+        # everything already queued goes out with a single write
+        writes = [w for w in writes if w]
+        assert len(writes) == 1
+        assert writes[0].startswith('N: fake device\n')
+        assert writes[0].count('E: ') == 20
+
+    def test_stop_drains_queue(self):
+        writer, output, writes = self.writer(max_queue_size=64)
+        writer.start()
+        writer.queue_device(0, FakeHidrawDevice())
+        for i in range(10):
+            writer.queue_event(0, 1.0 + i, b'\x01')
+        writer.queue_annotation(0, 11.0, 'last')
+        writer.stop()
+
+        assert not writer.is_alive()
+        assert writer.queue_depth == 0
+        assert writer.written == 10
+        assert len(self.events(output)) == 10
+        assert output.getvalue().splitlines()[-1] == '# 000010.000000 last'
+
+
+class TestAnnotations(object):
+    def record(self, annotate_every, events=7):
+        output = io.StringIO()
+        writer = RecordingWriter(output, annotate_every=annotate_every)
+        writer.queue_device(0, FakeHidrawDevice())
+        writer.queue_device(1, FakeHidrawDevice())
+        for i in range(events):
+            writer.queue_event(0, 1.0 + i, b'\x01')
+            writer.queue_event(1, 1.5 + i, b'\x02\x03')
+        writer.start()
+        writer.stop()
+
+        # (device index, annotated) for every event
+        annotated = {0: [], 1: []}
+        idx = 0
+        comment = False
+        for line in output.getvalue().splitlines():
+            if line.startswith('D: '):
+                idx = int(line[3:])
+            elif line.startswith('E: '):
+                annotated[idx].append(comment)
+            comment = line.startswith('#')
+        return annotated
+
+    def test_annotate_every(self):
+        annotated = self.record(annotate_every=3)
+        # the counters are per device, not for the whole recording
+        expected = [True, False, False, True, False, False, True]
+        assert annotated == {0: expected, 1: expected}
+
+    def test_annotate_all(self):
+        assert self.record(annotate_every=1) == {0: [True] * 7, 1: [True] * 7}
+
+    def test_no_annotations(self):
+        assert self.record(annotate_every=0) == {0: [False] * 7, 1: [False] * 7}
+
+    def test_format_event(self):
+        # skip the 'R:' prefix and the length of the report descriptor
+        rdesc = recording.splitlines()[0].split(maxsplit=2)[2]
+        device = object.__new__(HidrawDevice)
+        device.report_descriptor = ReportDescriptor.from_bytes(bytes.fromhex(rdesc))
+        event = HidrawEvent(0, 8000, [0x00, 0x01, 0xff])
+
+        lines = device.format_event(event).splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith('# ')
+        assert 'X:    1' in lines[0]
+        assert lines[1] == 'E: 000000.008000 3 00 01 ff'
+
+        assert device.format_event(event, annotate=False) == 'E: 000000.008000 3 00 01 ff\n'
+
+    @pytest.mark.parametrize('args,annotate_every', [
+        ([], 1),
+        (['--annotate-every', '4'], 4),
+        (['--annotate-every', '-1'], 0),
+        (['--no-annotations'], 0),
+        (['--no-annotations', '--annotate-every', '4'], 0),
+    ])
+    def test_options(self, tmp_path, monkeypatch, args, annotate_every):
+        recorders = []
+
+        class Recorder(object):
+            def __init__(self, output, print_index=False, name_filter=None, annotate_every=1):
+                recorders.append(annotate_every)
+
+            def enable_hotplug(self):
+                # main() stops quietly on ^C
+                raise KeyboardInterrupt
+
+        monkeypatch.setattr(hidtools.cli.record, 'HidRecorder', Recorder)
+        monkeypatch.setattr(sys, 'argv', ['hid-recorder', '--all',
+                                          '--output', str(tmp_path / 'rec.hid')] + args)
+        hidtools.cli.record.main()
+        assert recorders == [annotate_every]
+
+
+class TestOverruns(object):
+    def detector(self, interval=0.001, reads=20):
+        detector = OverrunDetector()
+        for i in range(reads):
+            assert detector.update(i * interval, 1) == []
+        return detector
+
+    def test_nominal_interval(self):
+        assert OverrunDetector().nominal_interval is None
+        detector = self.detector()
+        assert detector.nominal_interval == pytest.approx(0.001)
+        assert detector.reports == 20
+        assert detector.max_depth == 1
+        assert detector.overruns == 0
+        assert 'no overruns' in detector.summary()
+
+    def test_queue_full(self):
+        detector = self.detector()
+        # 100ms without reading at 1kHz, only 63 reports were kept
+        capacity = HIDRAW_BUFFER_SIZE - 1
+        overruns = detector.update(0.019 + 0.1, capacity)
+        assert [o.kind for o in overruns] == ['queue-full']
+        assert overruns[0].is_loss
+        assert overruns[0].lost == 100 - capacity
+        assert detector.overruns == 1
+        assert detector.lost == 100 - capacity
+        assert detector.gaps == 1
+        assert '1 overruns' in detector.summary()
+
+    def test_high_watermark(self):
+        detector = self.detector()
+        overruns = detector.update(0.07, 50)
+        assert [o.kind for o in overruns] == ['high-watermark']
+        assert not overruns[0].is_loss
+        assert detector.overruns == 0
+        assert detector.lost == 0
+
+    def test_truncated_and_dropped(self):
+        detector = self.detector()
+        overruns = detector.update(0.02, 1, truncated=1)
+        assert [o.kind for o in overruns] == ['truncated']
+        overrun = detector.dropped(0.03, 5)
+        assert overrun.kind == 'dropped'
+        assert detector.overruns == 2
+        assert detector.lost == 6
+
+    def test_recorder(self):
+        # SOCK_SEQPACKET keeps the boundaries of the reports like hidraw
+        reader, device = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            output = io.StringIO()
+            recorder = HidRecorder(output)
+            os.set_blocking(reader.fileno(), False)
+            detector = OverrunDetector()
+            recorder.writer.queue_device(0, FakeHidrawDevice())
+            recorder.detectors[0] = (FakeHidrawDevice.name, detector)
+            recorder._devices[reader.fileno()] = (0, 'fake', None, detector)
+            recorder.writer.start()
+
+            for _ in range(HIDRAW_BUFFER_SIZE + 2):
+                device.send(b'\x01\x02\x03')
+            recorder._process_device(reader.fileno(), select.EPOLLIN)
+            recorder._process_device(reader.fileno(), select.EPOLLIN)
+            recorder.writer.stop()
+        finally:
+            reader.close()
+            device.close()
+
+        assert detector.reports == HIDRAW_BUFFER_SIZE + 2
+        assert detector.max_depth == HIDRAW_BUFFER_SIZE
+        assert recorder.overruns == 1
+
+        lines = output.getvalue().splitlines()
+        assert len([l for l in lines if l.startswith('E:')]) == HIDRAW_BUFFER_SIZE + 2
+        overruns = [l for l in lines if 'OVERRUN device 0: kernel queue full' in l]
+        assert len(overruns) == 1
+        assert overruns[0].startswith('# 000000.')
@@ -0,0 +1,605 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Tests for the UHIDDevice infrastructure itself
+
+import asyncio
+import base
+import libevdev
+import logging
+import os
+import pytest
+import resource
+import socket
+import struct
+import hidtools.uhid
+from hidtools.device.base_gamepad import SaitekGamepad
+from hidtools.device.pool import DevicePool
+from hidtools.uhid import UHIDDevice, UHIDNotReadyException
+logger = logging.getLogger('hidtools.test.uhid')
+
+
+class Mouse(base.UHIDTestDevice):
+    report_descriptor = [
+        0x05, 0x01,  # .Usage Page (Generic Desktop)        0
+        0x09, 0x02,  # .Usage (Mouse)                       2
+        0xa1, 0x01,  # .Collection (Application)            4
+        0x09, 0x01,  # ..Usage (Pointer)                    6
+        0xa1, 0x00,  # ..Collection (Physical)              8
+        0x05, 0x09,  # ...Usage Page (Button)               10
+        0x19, 0x01,  # ...Usage Minimum (1)                 12
+        0x29, 0x03,  # ...Usage Maximum (3)                 14
+        0x15, 0x00,  # ...Logical Minimum (0)               16
+        0x25, 0x01,  # ...Logical Maximum (1)               18
+        0x75, 0x01,  # ...Report Size (1)                   20
+        0x95, 0x03,  # ...Report Count (3)                  22
+        0x81, 0x02,  # ...Input (Data,Var,Abs)              24
+        0x75, 0x05,  # ...Report Size (5)                   26
+        0x95, 0x01,  # ...Report Count (1)                  28
+        0x81, 0x03,  # ...Input (Cnst,Var,Abs)              30
+        0x05, 0x01,  # ...Usage Page (Generic Desktop)      32
+        0x09, 0x30,  # ...Usage (X)                         34
+        0x09, 0x31,  # ...Usage (Y)                         36
+        0x15, 0x81,  # ...Logical Minimum (-127)            38
+        0x25, 0x7f,  # ...Logical Maximum (127)             40
+        0x75, 0x08,  # ...Report Size (8)                   42
+        0x95, 0x02,  # ...Report Count (2)                  44
+        0x81, 0x06,  # ...Input (Data,Var,Rel)              46
+        0xc0,        # ..End Collection                     48
+        0xc0,        # .End Collection                      49
+    ]
+
+    def __init__(self, name=None):
+        super().__init__(name, 'Mouse', rdesc=self.report_descriptor)
+
+
+@pytest.fixture
+def fake_uhdev(monkeypatch):
+    """
+    A factory of UHIDDevices writing to a socket instead of /dev/uhid,
+    without kernel device, poll or udev monitor. Returns the device and
+    the other end of the socket, which receives the messages.
+    """
+    for name, value in (('_devices', []), ('_devices_by_uniq', {}), ('_devices_by_sys_path', {}),
+                        ('_pyudev_context', None), ('_pyudev_monitor', None), ('_loop', None)):
+        monkeypatch.setattr(UHIDDevice, name, value, raising=False)
+    sockets = []
+
+    def create(info=(3, 0x046d, 0xc077)):
+        ours, kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        kernel.setblocking(False)
+        sockets.extend((ours, kernel))
+        with monkeypatch.context() as m:
+            m.setattr(os, 'open', lambda path, flags: ours.fileno())
+            for name in ('_init_process', '_append_fd_to_poll', '_init_pyudev'):
+                m.setattr(UHIDDevice, name, lambda *args: None)
+            uhdev = UHIDDevice()
+        uhdev.info = info
+        uhdev._ready = True
+        return uhdev, kernel
+
+    yield create
+
+    for s in sockets:
+        s.close()
+
+
+def get_report_reply(req, err, data):
+    # the message as built before the buffers were preallocated
+    return struct.pack('< L L H H 4096s', UHIDDevice._UHID_GET_REPORT_REPLY, req, err, len(data), bytes(data))
+
+
+def set_report_reply(req, err):
+    return struct.pack('< L L H', UHIDDevice._UHID_SET_REPORT_REPLY, req, err)
+
+
+def input2(data):
+    return struct.pack('< L H 4096s', UHIDDevice._UHID_INPUT2, len(data), bytes(data))
+
+
+def padded(message, size):
+    # the kernel zero-fills the messages we send short
+    return message.ljust(size, b'\x00')
+
+
+class TestReportReplies(object):
+    def test_static_get_report_reply(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        uhdev.add_get_report_reply(0x03, [0x03, 0x0a])
+
+        uhdev._get_report(7, 0x03, UHIDDevice.UHID_FEATURE_REPORT)
+        expected = get_report_reply(7, 0, [0x03, 0x0a])
+        assert padded(kernel.recv(8192), len(expected)) == expected
+        # the same message, only the request id is patched
+        uhdev._get_report(0x12345678, 0x03, UHIDDevice.UHID_FEATURE_REPORT)
+        expected = get_report_reply(0x12345678, 0, [0x03, 0x0a])
+        assert padded(kernel.recv(8192), len(expected)) == expected
+
+    def test_callable_get_report_reply(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        calls = []
+
+        def reply(rnum, rtype):
+            calls.append((rnum, rtype))
+            return (0, [rnum] * len(calls))
+
+        uhdev.add_get_report_reply(0x04, reply, rtype=UHIDDevice.UHID_INPUT_REPORT)
+        for req in (1, 2):
+            uhdev._get_report(req, 0x04, UHIDDevice.UHID_INPUT_REPORT)
+            expected = get_report_reply(req, 0, [0x04] * req)
+            assert padded(kernel.recv(8192), len(expected)) == expected
+        assert calls == [(0x04, UHIDDevice.UHID_INPUT_REPORT)] * 2
+
+        # other report types still go to get_report()
+        uhdev._get_report(3, 0x04, UHIDDevice.UHID_FEATURE_REPORT)
+        expected = get_report_reply(3, 5, [])
+        assert padded(kernel.recv(8192), len(expected)) == expected
+
+    def test_remove_get_report_reply(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        uhdev.add_get_report_reply(0x03, [0x03, 0x0a])
+        uhdev.add_get_report_reply(0x03, None)
+        # removing an unknown entry is fine
+        uhdev.add_get_report_reply(0x05, None)
+
+        uhdev._get_report(1, 0x03, UHIDDevice.UHID_FEATURE_REPORT)
+        expected = get_report_reply(1, 5, [])  # EIO from get_report()
+        assert padded(kernel.recv(8192), len(expected)) == expected
+
+    def test_set_report_reply(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        received = []
+        uhdev.add_set_report_reply(0x02, 0)
+        uhdev.add_set_report_reply(0x03, lambda rnum, rtype, data: received.append(data) or 22)
+
+        uhdev._set_report(1, 0x02, UHIDDevice.UHID_FEATURE_REPORT, memoryview(b'\x02\x01'))
+        assert kernel.recv(8192) == set_report_reply(1, 0)
+        uhdev._set_report(2, 0x03, UHIDDevice.UHID_FEATURE_REPORT, memoryview(b'\x03\x01\x02'))
+        assert kernel.recv(8192) == set_report_reply(2, 22)
+        assert received == [b'\x03\x01\x02']
+
+        uhdev.add_set_report_reply(0x02, None)
+        uhdev._set_report(3, 0x02, UHIDDevice.UHID_FEATURE_REPORT, memoryview(b'\x02\x01'))
+        assert kernel.recv(8192) == set_report_reply(3, 5)  # EIO from set_report()
+
+    def test_no_reply_when_destroyed(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        calls = []
+        uhdev.add_get_report_reply(0x03, [0x03, 0x0a])
+        uhdev.add_get_report_reply(0x04, lambda rnum, rtype: calls.append(rnum) or (0, [0x04]))
+        uhdev.add_set_report_reply(0x02, 0)
+        uhdev.add_set_report_reply(0x05, lambda rnum, rtype, data: calls.append(rnum) or 0)
+
+        uhdev._ready = False
+        uhdev._get_report(1, 0x03, UHIDDevice.UHID_FEATURE_REPORT)
+        uhdev._get_report(2, 0x04, UHIDDevice.UHID_FEATURE_REPORT)
+        uhdev._set_report(3, 0x02, UHIDDevice.UHID_FEATURE_REPORT, memoryview(b'\x02'))
+        uhdev._set_report(4, 0x05, UHIDDevice.UHID_FEATURE_REPORT, memoryview(b'\x05'))
+        assert calls == [0x04, 0x05]
+        with pytest.raises(BlockingIOError):
+            kernel.recv(8192)
+
+
+class TestInputEvents(object):
+    @pytest.fixture
+    def writev(self, monkeypatch):
+        """Record the messages of each os.writev() call, accepting
+        ``accept[i]`` messages of the i-th call, all by default"""
+        calls = []
+        accept = []
+
+        def writev(fd, buffers):
+            calls.append([bytes(b) for b in buffers])
+            n = accept.pop(0) if accept else len(buffers)
+            return sum(len(b) for b in buffers[:n])
+
+        monkeypatch.setattr(os, 'writev', writev)
+        return calls, accept
+
+    def test_batches(self, fake_uhdev, writev, monkeypatch):
+        uhdev, kernel = fake_uhdev()
+        calls, _ = writev
+        monkeypatch.setattr(UHIDDevice, '_IOV_MAX', 3)
+
+        # mixed lengths, a long report first to catch stale bytes
+        reports = [list(range(64)), [1], b'\x02\x03', bytearray(b'\x04' * 10), [], [5, 6, 7], [8] * 4096]
+        uhdev.call_input_events(reports)
+
+        assert [len(c) for c in calls] == [3, 3, 1]
+        messages = [m for c in calls for m in c]
+        assert len(messages) == len(reports)
+        for message, report in zip(messages, reports):
+            assert message == struct.pack('< L H', UHIDDevice._UHID_INPUT2, len(report)) + bytes(report)
+
+    def test_empty(self, fake_uhdev, writev):
+        uhdev, kernel = fake_uhdev()
+        calls, _ = writev
+        uhdev.call_input_events([])
+        assert calls == []
+
+    def test_short_write(self, fake_uhdev, writev, monkeypatch):
+        uhdev, kernel = fake_uhdev()
+        calls, accept = writev
+        monkeypatch.setattr(UHIDDevice, '_IOV_MAX', 4)
+
+        # the first call only accepts two messages, the rest is resubmitted
+        accept.append(2)
+        reports = [[i] * (i + 1) for i in range(6)]
+        uhdev.call_input_events(reports)
+        assert [len(c) for c in calls] == [4, 4]
+        assert calls[0][:2] + calls[1] == [struct.pack('< L H', UHIDDevice._UHID_INPUT2, len(r)) + bytes(r)
+                                           for r in reports]
+
+
+class TestMessages(object):
+    """The messages must match the ones built with struct.pack() before
+    the buffers were preallocated, except for the zero padding."""
+    def test_input2(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        # a longer report after a shorter one and the other way round
+        for report in ([0x01, 0x02, 0x03], list(range(200)), [0xff], [], [0xaa] * 4096):
+            uhdev.call_input_event(report)
+            expected = input2(report)
+            message = kernel.recv(8192)
+            assert len(message) == UHIDDevice._input2_header.size + len(report)
+            assert padded(message, len(expected)) == expected
+
+    def test_get_report_reply(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        for req, err, data in ((1, 0, [0x03, 0x0a]), (2, 0, list(range(100))), (3, 5, []), (4, 0, [0x42])):
+            uhdev._call_get_report(req, data, err)
+            expected = get_report_reply(req, err, data)
+            assert padded(kernel.recv(8192), len(expected)) == expected
+
+    def test_set_report_reply(self, fake_uhdev):
+        uhdev, kernel = fake_uhdev()
+        for req, err in ((1, 0), (0xffffffff, 5), (3, 0)):
+            uhdev._call_set_report(req, err)
+            assert kernel.recv(8192) == set_report_reply(req, err)
+
+
+class FakeUdevDevice(object):
+    def __init__(self, action, subsystem, sys_path, **properties):
+        self.action = action
+        self.subsystem = subsystem
+        self.sys_path = sys_path
+        self.properties = properties
+
+
+class FakeMonitor(object):
+    def __init__(self, events):
+        self.events = list(events)
+
+    def poll(self, timeout=None):
+        return self.events.pop(0) if self.events else None
+
+
+class TestUdevRouting(object):
+    uhid = '/sys/devices/virtual/misc/uhid'
+
+    def dispatch(self, monkeypatch, events):
+        monkeypatch.setattr(UHIDDevice, '_pyudev_monitor', FakeMonitor(events))
+        UHIDDevice._cls_udev_event_callback()
+
+    def record(self, uhdev):
+        events = []
+        uhdev.udev_event = events.append
+        return events
+
+    def test_routing(self, fake_uhdev, monkeypatch):
+        uhdev, _ = fake_uhdev()
+        received = self.record(uhdev)
+        hid = f'{self.uhid}/0003:046D:C077.0001'
+        events = [
+            FakeUdevDevice('add', 'hid', hid, HID_UNIQ=uhdev.uniq),
+            FakeUdevDevice('add', 'input', f'{hid}/input/input5'),
+            FakeUdevDevice('add', 'input', f'{hid}/input/input5/event5', DEVNAME='/dev/input/event5'),
+            FakeUdevDevice('add', 'hidraw', f'{hid}/hidraw/hidraw0', DEVNAME='/dev/hidraw0'),
+            FakeUdevDevice('add', 'leds', f'{hid}/input/input5/input5::capslock'),
+            # not ours: another HID device and a device without HID parent
+            FakeUdevDevice('add', 'input', f'{self.uhid}/0003:046D:C077.0009/input/input6'),
+            FakeUdevDevice('add', 'input', '/sys/devices/platform/i8042/serio0/input/input1/event1',
+                           DEVNAME='/dev/input/event1'),
+        ]
+        self.dispatch(monkeypatch, events)
+
+        assert uhdev.udev_device is events[0]
+        assert UHIDDevice._devices_by_sys_path == {hid: uhdev}
+        assert received == events[:5]
+        assert uhdev.device_nodes == ['/dev/input/event5']
+        assert uhdev.hidraw_nodes == ['/dev/hidraw0']
+        assert uhdev.is_ready()
+
+    def test_same_ids(self, fake_uhdev, monkeypatch):
+        # two devices with the same BUS:VID:PID only differ by the ID
+        first, _ = fake_uhdev()
+        second, _ = fake_uhdev()
+        received = self.record(first), self.record(second)
+        paths = f'{self.uhid}/0003:046D:C077.0001', f'{self.uhid}/0003:046D:C077.0002'
+        events = [
+            FakeUdevDevice('add', 'hid', paths[1], HID_UNIQ=second.uniq),
+            FakeUdevDevice('add', 'hid', paths[0], HID_UNIQ=first.uniq),
+            FakeUdevDevice('add', 'input', f'{paths[0]}/input/input5/event5', DEVNAME='/dev/input/event5'),
+            FakeUdevDevice('add', 'input', f'{paths[1]}/input/input6/event6', DEVNAME='/dev/input/event6'),
+        ]
+        self.dispatch(monkeypatch, events)
+
+        assert received[0] == [events[1], events[2]]
+        assert received[1] == [events[0], events[3]]
+        assert first.device_nodes == ['/dev/input/event5']
+        assert second.device_nodes == ['/dev/input/event6']
+
+    def test_long_id(self, fake_uhdev, monkeypatch):
+        # the ID has more than 4 digits after 0xFFFF devices were created
+        uhdev, _ = fake_uhdev()
+        received = self.record(uhdev)
+        hid = f'{self.uhid}/0003:046D:C077.1000A'
+        events = [
+            FakeUdevDevice('add', 'hid', hid, HID_UNIQ=uhdev.uniq),
+            FakeUdevDevice('add', 'input', f'{hid}/input/input5/event5', DEVNAME='/dev/input/event5'),
+            # a prefix of our ID is another device
+            FakeUdevDevice('add', 'input', f'{self.uhid}/0003:046D:C077.1000/input/input6/event6',
+                           DEVNAME='/dev/input/event6'),
+        ]
+        self.dispatch(monkeypatch, events)
+
+        assert received == events[:2]
+        assert uhdev.device_nodes == ['/dev/input/event5']
+        assert uhdev.is_ready()
+
+    def test_nested(self, fake_uhdev, monkeypatch):
+        # e.g. a device paired to a receiver
+        uhdev, _ = fake_uhdev()
+        received = self.record(uhdev)
+        hid = f'{self.uhid}/0003:046D:C52B.0003/0003:046D:4082.0004'
+        events = [
+            FakeUdevDevice('add', 'hid', hid, HID_UNIQ=uhdev.uniq),
+            FakeUdevDevice('add', 'input', f'{hid}/input/input7/event7', DEVNAME='/dev/input/event7'),
+            # the receiver itself
+            FakeUdevDevice('add', 'hidraw', f'{self.uhid}/0003:046D:C52B.0003/hidraw/hidraw1',
+                           DEVNAME='/dev/hidraw1'),
+        ]
+        self.dispatch(monkeypatch, events)
+
+        assert received == events[:2]
+        assert uhdev.device_nodes == ['/dev/input/event7']
+        assert uhdev.hidraw_nodes == []
+
+    def test_unknown_uniq(self, fake_uhdev, monkeypatch):
+        uhdev, _ = fake_uhdev()
+        received = self.record(uhdev)
+        hid = f'{self.uhid}/0003:046D:C077.0001'
+        self.dispatch(monkeypatch, [
+            FakeUdevDevice('add', 'hid', hid, HID_UNIQ='someone else'),
+            FakeUdevDevice('add', 'input', f'{hid}/input/input5/event5', DEVNAME='/dev/input/event5'),
+        ])
+        assert received == []
+        assert UHIDDevice._devices_by_sys_path == {}
+
+
+class TestUdevDevice(object):
+    @pytest.fixture
+    def sysfs(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(UHIDDevice, '_uhid_sys_path', str(tmp_path))
+        monkeypatch.setattr(hidtools.uhid.pyudev.Devices, 'from_sys_path',
+                            lambda context, path: FakeUdevDevice('add', 'hid', path))
+
+        def add(name, uniq=None):
+            path = tmp_path / name
+            path.mkdir()
+            if uniq is not None:
+                (path / 'uevent').write_text(f'DRIVER=hid-generic\nHID_ID=0003:0000046D:0000C077\n'
+                                             f'HID_UNIQ={uniq}\nMODALIAS=hid:b0003g0001v0000046Dp0000C077\n')
+            return str(path)
+        return add
+
+    def test_glob_fallback(self, fake_uhdev, sysfs):
+        first, _ = fake_uhdev()
+        second, _ = fake_uhdev()
+        sysfs('0003:046D:C077.0001', first.uniq)
+        # not a complete device yet
+        sysfs('0003:046D:C077.0002')
+        path = sysfs('0003:046D:C077.0003', second.uniq)
+        # another product
+        sysfs('0003:046D:C078.0004', second.uniq)
+
+        assert second.udev_device.sys_path == path
+        assert UHIDDevice._devices_by_sys_path == {path: second}
+        # the device is only looked up once
+        assert second.udev_device is second.udev_device
+
+    def test_glob_fallback_not_found(self, fake_uhdev, sysfs):
+        uhdev, _ = fake_uhdev()
+        sysfs('0003:046D:C077.0001', 'someone else')
+        assert uhdev.udev_device is None
+
+        # not before the kernel device was created
+        sysfs('0003:046D:C077.0002', uhdev.uniq)
+        uhdev._ready = False
+        assert uhdev.udev_device is None
+        uhdev._ready = True
+        assert uhdev.udev_device is not None
+
+    def test_udev_event_first(self, fake_uhdev, sysfs, monkeypatch):
+        uhdev, _ = fake_uhdev()
+        event = FakeUdevDevice('add', 'hid', '/sys/devices/virtual/misc/uhid/0003:046D:C077.0001',
+                               HID_UNIQ=uhdev.uniq)
+        monkeypatch.setattr(UHIDDevice, '_pyudev_monitor', FakeMonitor([event]))
+        UHIDDevice._cls_udev_event_callback()
+        assert uhdev.udev_device is event
+
+
+class TestAsyncio(object):
+    def test_ready(self):
+        async def run():
+            UHIDDevice.attach_event_loop()
+            try:
+                with Mouse() as uhdev:
+                    uhdev.create_kernel_device()
+                    await uhdev.ready(timeout=5)
+                    assert uhdev.evdev is not None
+
+                    uhdev.call_input_event([0x01, 0x01, 0xff])
+                    await asyncio.sleep(0.1)
+                    events = uhdev.next_sync_events()
+                    assert libevdev.InputEvent(libevdev.EV_KEY.BTN_LEFT, 1) in events
+                    assert libevdev.InputEvent(libevdev.EV_REL.REL_X, 1) in events
+            finally:
+                UHIDDevice.detach_event_loop()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_ready_without_loop(self, fake_uhdev):
+        uhdev, _ = fake_uhdev()
+
+        async def run():
+            with pytest.raises(RuntimeError, match='attach_event_loop'):
+                await uhdev.ready(timeout=1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+
+class TestReadiness(object):
+    def test_wait_ready_all(self):
+        devices = [Mouse(f'uhid test readiness {i}') for i in range(4)]
+        try:
+            for uhdev in devices:
+                uhdev.create_kernel_device()
+            UHIDDevice.wait_ready_all(devices, timeout=5)
+            for uhdev in devices:
+                assert uhdev.evdev is not None
+        finally:
+            for uhdev in devices:
+                uhdev.destroy()
+
+    def test_timeout(self):
+        with Mouse() as uhdev:
+            # the kernel device is never created, so it never gets ready
+            with pytest.raises(UHIDNotReadyException):
+                uhdev.wait_ready(timeout=0.1)
+
+
+class TestDevicePool(object):
+    def test_reuse(self):
+        pool = DevicePool()
+        try:
+            with pool.device(Mouse('uhid test pool')) as uhdev:
+                evdev = uhdev.evdev
+                # leave the button pressed
+                uhdev.call_input_event([0x01, 0x00, 0x00])
+                events = uhdev.next_sync_events()
+                assert libevdev.InputEvent(libevdev.EV_KEY.BTN_LEFT, 1) in events
+
+            with pool.device(Mouse('uhid test pool')) as uhdev:
+                assert uhdev.evdev is evdev
+                assert uhdev.evdev.value[libevdev.EV_KEY.BTN_LEFT] == 0
+                assert uhdev.next_sync_events() == []
+
+            with pool.device(Mouse('uhid test pool other')) as other:
+                assert other is not uhdev
+        finally:
+            pool.clear()
+
+    def test_reuse_gamepad(self):
+        pool = DevicePool()
+        try:
+            with pool.device(SaitekGamepad(name='uhid test pool gamepad')) as uhdev:
+                uhdev.event(left=(0, 255), right=(10, 20), buttons={1: True})
+                uhdev.next_sync_events()
+
+            with pool.device(SaitekGamepad(name='uhid test pool gamepad')) as other:
+                assert other is uhdev
+                # the axes are centred again, not zero
+                for stick in ('left_stick', 'right_stick'):
+                    for axis in ('x', 'y'):
+                        code = uhdev.axes_map[stick][axis].evdev
+                        assert uhdev.evdev.value[code] == 127
+                assert uhdev.evdev.value[libevdev.EV_KEY.BTN_TRIGGER] == 0
+        finally:
+            pool.clear()
+
+
+class TestDispatcher(object):
+    def test_readable_high_fd(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard <= 1100:
+            pytest.skip('cannot open fds beyond FD_SETSIZE')
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1100), hard))
+        r, w = os.pipe()
+        try:
+            high = os.dup2(r, 1050)
+            try:
+                assert not UHIDDevice._readable(high)
+                os.write(w, b'x')
+                assert UHIDDevice._readable(high)
+            finally:
+                os.close(high)
+        finally:
+            os.close(r)
+            os.close(w)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def test_dispatcher(self):
+        UHIDDevice.start_dispatcher()
+        try:
+            with Mouse() as uhdev:
+                uhdev.create_kernel_device()
+                uhdev.wait_ready(timeout=5)
+                assert uhdev.evdev is not None
+
+                uhdev.call_input_event([0x01, 0x01, 0xff])
+                events = uhdev.next_sync_events()
+                assert libevdev.InputEvent(libevdev.EV_KEY.BTN_LEFT, 1) in events
+        finally:
+            UHIDDevice.stop_dispatcher()
+        assert UHIDDevice._dispatcher is None
+
+
+class TestProcesses(object):
+    def test_fork(self):
+        with Mouse() as uhdev:
+            uhdev.create_kernel_device()
+            uhdev.wait_ready(timeout=5)
+
+            pid = os.fork()
+            if pid == 0:
+                # the child starts over with its own poll object and udev
+                # monitor and doesn't know the parent's devices
+                status = 1
+                try:
+                    UHIDDevice.dispatch(10)
+                    if not UHIDDevice._devices:
+                        with Mouse('uhid test child') as child:
+                            child.create_kernel_device()
+                            child.wait_ready(timeout=5)
+                            status = 0
+                finally:
+                    os._exit(status)
+
+            _, status = os.waitpid(pid, 0)
+            assert os.WEXITSTATUS(status) == 0
+            assert UHIDDevice._devices == [uhdev]